@@ -1,28 +1,183 @@
-# api_client.py
 import requests
 import json
 import datetime
+import gzip
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+from urllib.parse import quote, urljoin
+
+import numpy as np
+from requests.adapters import HTTPAdapter
+
+from result_spool import ResultSpool
 # Ya no se necesita encode_image_to_base64 aquí, se hace para video en main.py
 
+try: # Opcional: compresión zstd de los lotes (si no está instalado se usa gzip)
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BATCH_COMPRESSIONS = ("gzip", "zstd", "none")
+
+_STOP_SENDER = object() # Marcador de cierre para el hilo de envío
+
+class _DeliveryRejected(Exception):
+    """El receptor rechazó la petición con un 4xx no reintentable (reenviarla daría el mismo resultado)."""
+    def __init__(self, status_code, reason):
+        super().__init__(f"{status_code} {reason}")
+        self.status_code = status_code
+
 class APIClient:
-    def __init__(self, config):
+    """
+    Envía los resultados al servidor externo por una `requests.Session` con conexiones keep-alive
+    reutilizadas. Con `external_server.delivery.async_enabled` el trabajador solo encola el payload
+    (cola acotada; si está llena, espera) y un hilo en segundo plano lo envía, con reintentos y backoff exponencial con
+    jitter ante errores de red, timeouts, 429 y 5xx. `close()` vacía la cola antes de terminar.
+    El video anotado (transfer_mode 'stream') se sube como cuerpo binario desde el archivo, en bloques,
+    a `external_server.video_upload_url/<vehicle_unique_id>` antes de enviar el payload JSON.
+    Con `external_server.batching.enabled` los payloads se agrupan por cantidad o ventana de tiempo y
+    se envían comprimidos (gzip/zstd) a `external_server.batch_url`; cada lote (con sus videos) se guarda antes en un
+    spool en disco (`ResultSpool`) y se reenvía en orden, también tras un reinicio, hasta que el
+    receptor lo acepta; si lo rechaza de forma permanente (4xx) pasa a la cola de descartes del spool.
+    """
+    def __init__(self, config, instance_name=None, active_instances=None):
+        """
+        Args:
+            config (AppConfig): Configuración (secciones 'external_server' y 'processing.payload_video').
+            instance_name (str, optional): Subcarpeta del spool de lotes para esta instancia (cada proceso
+                                           que envíe resultados necesita la suya, p. ej. 'worker_0').
+            active_instances (list, optional): Instancias de esta ejecución. Si se indica, este cliente se queda
+                                               con los lotes pendientes de las demás subcarpetas del spool (p. ej.
+                                               de workers de una ejecución anterior con más procesos).
+        """
         self.config = config
         self.server_enabled = config.get('external_server.enabled', False)
         self.server_url = config.get('external_server.url')
         self.timeout = config.get('external_server.timeout_seconds', 5)
         self.debug_mode = config.get('processing.debug_mode', False)
-        
+
         # La config de 'payload_video' ahora se usa en main.py para generar el video
         self.include_video = config.get('processing.payload_video.include_processed_video', False)
 
         if self.server_enabled and not self.server_url:
             print("[API_CLIENT] ADVERTENCIA: Envío habilitado pero 'external_server.url' no configurada.")
-        # ... (resto del init)
+        # Endpoint de subida de videos (por defecto, 'vehicle_video' junto a la URL de resultados)
+        self.video_upload_url = config.get('external_server.video_upload_url') or \
+            (urljoin(self.server_url, "vehicle_video") if self.server_url else None)
+
+        # Entrega: sesión con pool de conexiones, reintentos y (opcional) hilo de envío asíncrono
+        self.max_retries = max(0, int(config.get('external_server.delivery.max_retries', 3)))
+        self.retry_backoff = config.get('external_server.delivery.retry_backoff_seconds', 0.5)
+        self.retry_backoff_max = config.get('external_server.delivery.retry_backoff_max_seconds', 10.0)
+        self.async_enabled = config.get('external_server.delivery.async_enabled', True)
+        # Cola llena: None (o negativo) bloquea al trabajador hasta que haya hueco (sin pérdida);
+        # > 0 espera ese tiempo y luego descarta; 0 descarta al momento
+        self.enqueue_timeout = config.get('external_server.delivery.enqueue_timeout_seconds', None)
+        self.shutdown_flush_timeout = config.get('external_server.delivery.shutdown_flush_timeout_seconds', 30.0)
+        pool_size = max(1, int(config.get('external_server.delivery.pool_maxsize', 4)))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+        self._stats_lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0 # Payloads descartados tras agotar los reintentos
+        self.dropped = 0 # Payloads no encolados (cola llena)
+        self.retries = 0
+        self.send_latencies = deque(maxlen=1000) # Segundos por envío exitoso (incluye reintentos y video)
+        self.videos_uploaded = 0
+        self.video_upload_failures = 0
+        self.video_bytes_uploaded = 0
+        self._closed = False
+        self._flush_deadline = None
+
+        # Envío por lotes comprimidos con spool persistente (usa siempre el hilo de envío)
+        self.batching_enabled = self.server_enabled and bool(self.server_url) and config.get('external_server.batching.enabled', False)
+        self.batch_url = config.get('external_server.batch_url') or (f"{self.server_url.rstrip('/')}/batch" if self.server_url else None)
+        self.batch_max_size = max(1, int(config.get('external_server.batching.max_batch_size', 100)))
+        self.batch_max_wait = config.get('external_server.batching.max_batch_wait_seconds', 5.0)
+        # Tamaño máximo del lote (JSON sin comprimir): por defecto, un margen por debajo del límite del receptor
+        max_batch_mb = config.get('external_server.batching.max_batch_mb') or \
+            0.9 * config.get('external_server.receptor_max_batch_mb', 256)
+        self.batch_max_bytes = max(1, int(max_batch_mb * 1024 * 1024))
+        self.batch_compression = config.get('external_server.batching.compression', 'gzip')
+        if self.batch_compression not in BATCH_COMPRESSIONS:
+            print(f"[API_CLIENT] ADVERTENCIA: Compresión de lotes '{self.batch_compression}' no válida ({BATCH_COMPRESSIONS}). Usando 'gzip'.")
+            self.batch_compression = 'gzip'
+        if self.batch_compression == 'zstd' and zstandard is None:
+            if self.batching_enabled: print("[API_CLIENT] ADVERTENCIA: 'zstandard' no está instalado; los lotes se comprimirán con gzip.")
+            self.batch_compression = 'gzip'
+        self._zstd_compressor = zstandard.ZstdCompressor() if self.batch_compression == 'zstd' else None
+        # Los videos en Base64 dentro de los lotes superan enseguida el límite del receptor: con lotes se suben aparte
+        self.video_transfer_mode = config.get('processing.payload_video.transfer_mode', 'stream')
+        if self.batching_enabled and self.video_transfer_mode == 'base64':
+            print("[API_CLIENT] ADVERTENCIA: transfer_mode 'base64' no es compatible con el envío por lotes; se usará 'stream'.")
+            self.video_transfer_mode = 'stream'
+        self.spool = None
+        if self.batching_enabled and config.get('external_server.batching.spool_enabled', True):
+            spool_dir = Path(config.get('external_server.batching.spool_dir', 'result_spool'))
+            self.spool = ResultSpool(spool_dir / instance_name if instance_name else spool_dir,
+                                     max_segment_bytes=int(config.get('external_server.batching.spool_segment_mb', 16)) * 1024 * 1024,
+                                     fsync=config.get('external_server.batching.spool_fsync', True))
+            if instance_name and active_instances is not None: self._adopt_orphan_spools(spool_dir, active_instances)
+        self._spool_failures = 0 # Intentos fallidos seguidos de vaciar el spool (para el backoff)
+        self._spool_retry_at = 0.0
+        self._spool_videos_uploaded = set() # Videos de lotes del spool ya subidos (a la espera de enviar su lote)
+        self.batches_sent = 0
+        self.batches_dead_lettered = 0
+        self.batch_bytes_raw = 0
+        self.batch_bytes_sent = 0
+
+        self.send_queue = None
+        self._sender_thread = None
+        # Etapa de `StageTimer` de las llamadas a send_vehicle_data: con hilo de envío solo miden el encolado
+        self.delivery_stage = "send"
+        if self.server_enabled and self.server_url and (self.async_enabled or self.batching_enabled):
+            self.delivery_stage = "send_enqueue"
+            self.send_queue = queue.Queue(maxsize=max(1, int(config.get('external_server.delivery.queue_size', 20))))
+            sender_loop = self._batch_sender_loop if self.batching_enabled else self._sender_loop
+            self._sender_thread = threading.Thread(target=sender_loop, name="api_client_sender", daemon=True)
+            self._sender_thread.start()
+
+    def _adopt_orphan_spools(self, spool_dir, active_instances):
+        """Pasa a este spool los lotes de las subcarpetas de `spool_dir` que no usa ninguna instancia activa."""
+        for other_dir in sorted(spool_dir.iterdir()):
+            if other_dir.name in active_instances or not ResultSpool.is_spool_dir(other_dir): continue
+            try:
+                adopted = self.spool.adopt(other_dir)
+            except OSError as e_adopt:
+                print(f"[API_CLIENT] ERROR recuperando el spool '{other_dir}': {e_adopt}")
+                continue
+            if adopted: print(f"[API_CLIENT] {adopted} lote(s) del spool sin dueño '{other_dir}' pasan a '{self.spool.spool_dir}'.")
 
     # Modificado para aceptar video_base64_to_send
-    def send_vehicle_data(self, vehicle_data_payload, video_base64_to_send=None, job_source_name="unknown_job_source"):
+    def send_vehicle_data(self, vehicle_data_payload, video_base64_to_send=None, job_source_name="unknown_job_source",
+                          video_file_path=None):
+        """
+        Prepara el payload y lo envía (modo síncrono) o lo encola para el hilo de envío (modo asíncrono).
+
+        Args:
+            vehicle_data_payload (dict): Payload del vehículo (debe incluir 'vehicle_unique_id' si hay video).
+            video_base64_to_send (str, optional): Video en Base64 a incluir en el JSON (transfer_mode 'base64').
+            job_source_name (str, optional): Nombre del trabajo de origen.
+            video_file_path (str, optional): Video a subir como cuerpo binario (transfer_mode 'stream').
+                                             El cliente pasa a ser su dueño y lo elimina tras el envío.
+
+        Returns:
+            bool: True si se entregó (síncrono) o se encoló (asíncrono); False si está deshabilitado,
+                  se descartó por cola llena o falló tras los reintentos.
+        """
         if not self.server_enabled or not self.server_url:
             # ... (manejo de no habilitado) ...
+            self._remove_video_file(video_file_path)
             return False
 
         payload_to_send = vehicle_data_payload.copy()
@@ -30,28 +185,351 @@ class APIClient:
         payload_to_send['source_id'] = job_source_name # job_source_name es más descriptivo que self.base_source_path
         payload_to_send['video_sent_status'] = "not_included"
 
-        if self.include_video and video_base64_to_send: # Usar video_base64_to_send
+        if self.include_video and video_file_path:
+            payload_to_send['video_sent_status'] = "streamed" # El receptor lo asocia por 'vehicle_unique_id'
+        elif self.include_video and video_base64_to_send: # Usar video_base64_to_send
             payload_to_send['processed_video_base64'] = video_base64_to_send
             payload_to_send['video_sent_status'] = "included"
             if self.debug_mode: print(f"[API_CLIENT] Incluyendo video Base64 en payload para Job: {job_source_name}.")
-        elif self.include_video and not video_base64_to_send:
-            if self.debug_mode: print(f"[API_CLIENT] Configurado para incluir video, pero no se proporcionó video Base64 para Job: {job_source_name}.")
-            payload_to_send['video_sent_status'] = "configured_but_not_provided"
+        else:
+            self._remove_video_file(video_file_path)
+            video_file_path = None
+            if self.include_video:
+                if self.debug_mode: print(f"[API_CLIENT] Configurado para incluir video, pero no se proporcionó video para Job: {job_source_name}.")
+                payload_to_send['video_sent_status'] = "configured_but_not_provided"
 
-        
-        headers = {'Content-Type': 'application/json'}
-        # Log del payload sin el video completo
-        payload_for_log = {k:v for k,v in payload_to_send.items() if k != 'processed_video_base64'}
-        if 'processed_video_base64' in payload_to_send : 
-            payload_for_log['processed_video_base64_status'] = "Present (Length: {})".format(len(payload_to_send['processed_video_base64']))
-        
-        if self.debug_mode: print(f"[API_CLIENT] Intentando enviar datos a {self.server_url}: {json.dumps(payload_for_log, indent=2)}")
+        if self.send_queue is None:
+            return self._deliver(payload_to_send, job_source_name, video_file_path)
+        if self._closed:
+            print(f"[API_CLIENT] ADVERTENCIA: Cliente cerrado; se descarta el resultado de Job: {job_source_name}.")
+            self._remove_video_file(video_file_path)
+            return False
+        item = (payload_to_send, job_source_name, video_file_path) # Solo la ruta del video: la cola no retiene su contenido
+        try:
+            if self.enqueue_timeout is None or self.enqueue_timeout < 0: self.send_queue.put(item)
+            elif self.enqueue_timeout > 0: self.send_queue.put(item, timeout=self.enqueue_timeout)
+            else: self.send_queue.put_nowait(item)
+        except queue.Full:
+            with self._stats_lock: self.dropped += 1
+            print(f"[API_CLIENT] ERROR: Cola de envío llena ({self.send_queue.maxsize}); se descarta el resultado de Job: {job_source_name}.")
+            self._remove_video_file(video_file_path)
+            return False
+        if self.debug_mode: print(f"[API_CLIENT] Resultado de Job: {job_source_name} encolado (pendientes: {self.send_queue.qsize()}).")
+        return True
+
+    def _sender_loop(self):
+        while True:
+            item = self.send_queue.get()
+            try:
+                if item is _STOP_SENDER: return
+                self._deliver(*item)
+            finally:
+                self.send_queue.task_done()
+
+    def _batch_sender_loop(self):
+        """
+        Hilo de envío en modo lotes: agrupa los payloads hasta `max_batch_size`, `max_batch_mb` (JSON sin
+        comprimir) o `max_batch_wait_seconds` desde el primero, guarda cada lote en el spool y vacía el spool en orden (con backoff si el
+        receptor no responde). Con spool, los videos se guardan en él y se suben justo antes de enviar su
+        lote (también en los reenvíos); sin spool, al sacar su payload de la cola.
+        """
+        batch, batch_videos, batch_bytes, batch_deadline = [], {}, 0, None
+        while True:
+            waits = []
+            if batch: waits.append(batch_deadline - time.monotonic())
+            if self.spool is not None and self.spool.pending_count(): waits.append(self._spool_retry_at - time.monotonic())
+            try:
+                item = self.send_queue.get(timeout=max(0.0, min(waits)) if waits else None)
+            except queue.Empty:
+                item = None
+            stopping = item is _STOP_SENDER
+            try:
+                if item is not None and not stopping:
+                    payload_to_send, job_source_name, video_file_path = item
+                    if video_file_path: video_file_path = self._keep_batch_video(payload_to_send, video_file_path, job_source_name)
+                    payload_bytes = len(json.dumps(payload_to_send, ensure_ascii=False).encode("utf-8")) + 1
+                    if payload_bytes > self.batch_max_bytes:
+                        print(f"[API_CLIENT] ADVERTENCIA: Payload de Job: {job_source_name} ({payload_bytes} bytes) mayor que el máximo por lote; se envía solo.")
+                    if batch and batch_bytes + payload_bytes > self.batch_max_bytes: # No cabe: cerrar el lote actual
+                        self._flush_batch(batch, batch_videos)
+                        batch, batch_videos, batch_bytes = [], {}, 0
+                    if not batch: batch_deadline = time.monotonic() + self.batch_max_wait
+                    if video_file_path: batch_videos[len(batch)] = video_file_path
+                    batch.append(payload_to_send)
+                    batch_bytes += payload_bytes
+                if batch and (stopping or len(batch) >= self.batch_max_size or batch_bytes >= self.batch_max_bytes
+                              or time.monotonic() >= batch_deadline):
+                    self._flush_batch(batch, batch_videos)
+                    batch, batch_videos, batch_bytes = [], {}, 0
+                self._drain_spool(force=stopping)
+            except Exception as e:
+                print(f"[API_CLIENT] ERROR en el hilo de envío por lotes: {e}")
+            finally:
+                if item is not None: self.send_queue.task_done()
+            if stopping: return
+
+    def _encode_batch(self, payloads):
+        """Cuerpo del lote (array JSON comprimido) y su Content-Encoding (None sin compresión)."""
+        raw = json.dumps(payloads, ensure_ascii=False).encode("utf-8")
+        if self.batch_compression == 'zstd': body, encoding = self._zstd_compressor.compress(raw), 'zstd'
+        elif self.batch_compression == 'gzip': body, encoding = gzip.compress(raw, compresslevel=6), 'gzip'
+        else: body, encoding = raw, None
+        return raw, body, encoding
+
+    def _post_batch(self, batch_id, payloads, max_retries=None, raise_rejected=False):
+        """
+        Envía un lote a `batch_url`. `X-Batch-Id` permite al receptor ignorar lotes repetidos.
+        Con `raise_rejected`, un rechazo permanente (4xx) lanza `_DeliveryRejected` en vez de devolver False.
+        """
+        raw, body, encoding = self._encode_batch(payloads)
+        headers = {'X-Batch-Id': batch_id}
+        if encoding: headers['Content-Encoding'] = encoding
+        t0 = time.perf_counter()
+        response = self._post_with_retries(self.batch_url, f"lote {batch_id[:8]}", body=body, headers=headers,
+                                           max_retries=max_retries, raise_rejected=raise_rejected)
+        if response is None: return False
+        with self._stats_lock:
+            self.sent += len(payloads)
+            self.batches_sent += 1
+            self.batch_bytes_raw += len(raw)
+            self.batch_bytes_sent += len(body)
+            self.send_latencies.append(time.perf_counter() - t0)
+        if self.debug_mode: print(f"[API_CLIENT] Lote {batch_id[:8]} enviado: {len(payloads)} payload(s), {len(raw)} -> {len(body)} bytes ({encoding or 'sin comprimir'}).")
+        return True
 
+    def _keep_batch_video(self, payload_to_send, video_file_path, job_source_name):
+        """Guarda el video en el spool hasta enviar su lote y devuelve su ruta; sin spool lo sube ya (devuelve None)."""
+        if self.spool is not None:
+            try:
+                return self.spool.keep_video(video_file_path)
+            except OSError as e_keep:
+                print(f"[API_CLIENT] ERROR guardando video en el spool ({e_keep}); se sube directamente.")
+        self._upload_payload_video(payload_to_send, video_file_path, job_source_name)
+        return None
+
+    def _flush_batch(self, payloads, videos=None):
+        """Guarda el lote en el spool (o, sin spool, sube sus videos y lo envía). `videos`: {índice del payload: ruta}."""
+        batch_id = uuid.uuid4().hex
+        videos = videos or {}
+        if self.spool is not None:
+            try:
+                self.spool.append(batch_id, payloads, videos)
+                return
+            except OSError as e_spool:
+                print(f"[API_CLIENT] ERROR guardando lote en el spool ({e_spool}); se intenta enviar directamente.")
+        for index, video_file_path in videos.items(): self._upload_payload_video(payloads[index], video_file_path, f"lote {batch_id[:8]}")
+        if not self._post_batch(batch_id, payloads):
+            with self._stats_lock: self.failed += len(payloads)
+
+    def _upload_spooled_videos(self, record):
+        """
+        Sube los videos de un lote del spool aún no subidos en esta ejecución (un intento cada uno).
+        Devuelve False si el receptor no está disponible; un video rechazado o perdido se marca 'upload_failed'.
+        """
+        for index, video_file_path in (record.get("videos") or {}).items():
+            if video_file_path in self._spool_videos_uploaded: continue
+            payload = record["payloads"][int(index)]
+            if not os.path.exists(video_file_path):
+                payload['video_sent_status'] = "upload_failed"
+                continue
+            try:
+                if not self._upload_video(payload.get('vehicle_unique_id', record["batch_id"]), video_file_path,
+                                          f"lote {record['batch_id'][:8]}", max_retries=0, raise_rejected=True):
+                    return False
+            except _DeliveryRejected:
+                payload['video_sent_status'] = "upload_failed"
+                continue
+            self._spool_videos_uploaded.add(video_file_path)
+        return True
+
+    def _drain_spool(self, force=False):
+        """Envía en orden los lotes pendientes del spool; ante un fallo se detiene hasta el siguiente reintento."""
+        if self.spool is None or not self.spool.pending_count(): return
+        if not force and time.monotonic() < self._spool_retry_at: return
+        for seq, record in self.spool.iter_pending():
+            if self._closed_and_expired(): return
+            # Un solo intento por lote: el reintento lo da el propio spool, sin bloquear el hilo de envío
+            try:
+                # Primero los videos: al llegar el lote, el receptor ya los tiene asociados
+                delivered = self._upload_spooled_videos(record) and \
+                    self._post_batch(record["batch_id"], record["payloads"], max_retries=0, raise_rejected=True)
+            except _DeliveryRejected as e_rejected:
+                # Reenviarlo no serviría y bloquearía los lotes siguientes: se aparta y se continúa
+                self.spool.dead_letter(record, f"HTTP {e_rejected}")
+                self.spool.ack(seq)
+                self._spool_videos_uploaded.difference_update((record.get("videos") or {}).values())
+                with self._stats_lock:
+                    self.failed += len(record["payloads"])
+                    self.batches_dead_lettered += 1
+                print(f"[API_CLIENT] Lote {record['batch_id'][:8]} rechazado por el receptor ({e_rejected}); movido a descartes del spool.")
+                continue
+            if not delivered:
+                self._spool_failures += 1
+                delay = self._backoff_delay(self._spool_failures)
+                self._spool_retry_at = time.monotonic() + delay
+                with self._stats_lock: self.retries += 1
+                print(f"[API_CLIENT] Receptor no disponible: {self.spool.pending_count()} lote(s) en el spool, reintento en {delay:.1f}s.")
+                return
+            self.spool.ack(seq)
+            for video_file_path in (record.get("videos") or {}).values():
+                self._remove_video_file(video_file_path)
+                self._spool_videos_uploaded.discard(video_file_path)
+            self._spool_failures = 0
+
+    def _backoff_delay(self, attempt):
+        """Backoff exponencial con jitter completo: uniforme en [0, min(máximo, base * 2^intento)]."""
+        return random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * (2 ** attempt)))
+
+    def _remove_video_file(self, video_file_path):
+        if not video_file_path: return
         try:
-            response = requests.post(self.server_url, data=json.dumps(payload_to_send), headers=headers, timeout=self.timeout)
-            response.raise_for_status()
-            if self.debug_mode: print(f"[API_CLIENT] Datos para Vehículo (Job: {job_source_name}) enviados. Respuesta: {response.status_code}")
-            return True
-        except Exception as e:
-            print(f"[API_CLIENT] ERROR general enviando para Vehículo (Job: {job_source_name}): {e}")
-            return False
\ No newline at end of file
+            os.remove(video_file_path)
+        except OSError as e_del:
+            if self.debug_mode: print(f"[API_CLIENT] No se pudo eliminar el video temporal '{video_file_path}': {e_del}")
+
+    def _post_with_retries(self, url, job_source_name, body=None, file_path=None, headers=None, max_retries=None,
+                           raise_rejected=False):
+        """
+        POST con reintentos. El cuerpo es `body` o, si se indica `file_path`, el archivo abierto en cada
+        intento (requests lo envía en bloques con su Content-Length, sin leerlo entero).
+
+        Returns:
+            requests.Response or None: Respuesta aceptada, o None si falló tras los reintentos.
+
+        Raises:
+            _DeliveryRejected: Con `raise_rejected`, si el receptor responde un 4xx no reintentable.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        for attempt in range(max_retries + 1):
+            try:
+                if file_path:
+                    with open(file_path, "rb") as file_body:
+                        response = self.session.post(url, data=file_body, headers=headers, timeout=self.timeout)
+                else:
+                    response = self.session.post(url, data=body, headers=headers, timeout=self.timeout)
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise requests.HTTPError(f"{response.status_code} {response.reason}", response=response)
+                response.raise_for_status() # Otros 4xx: la petición no es válida, no se reintenta
+                return response
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                response = getattr(e, 'response', None)
+                retryable = response is None or response.status_code == 429 or response.status_code >= 500
+                if not retryable or attempt == max_retries or self._closed_and_expired():
+                    print(f"[API_CLIENT] ERROR enviando a {url} (Job: {job_source_name}) tras {attempt + 1} intento(s): {e}")
+                    if not retryable and raise_rejected: raise _DeliveryRejected(response.status_code, response.reason)
+                    return None
+                delay = self._backoff_delay(attempt)
+                with self._stats_lock: self.retries += 1
+                if self.debug_mode: print(f"[API_CLIENT] Reintento {attempt + 1}/{max_retries} para Job: {job_source_name} en {delay:.2f}s ({e})")
+                time.sleep(delay)
+            except Exception as e:
+                print(f"[API_CLIENT] ERROR general enviando a {url} (Job: {job_source_name}): {e}")
+                return None
+
+    def _upload_video(self, vehicle_id, video_file_path, job_source_name, max_retries=None, raise_rejected=False):
+        """
+        Sube el video como cuerpo binario a `video_upload_url/<vehicle_id>`. Devuelve True si se aceptó.
+        Con `raise_rejected`, un rechazo permanente (4xx) lanza `_DeliveryRejected`.
+        """
+        try:
+            video_size = os.path.getsize(video_file_path)
+        except OSError as e_size:
+            print(f"[API_CLIENT] ERROR: No se puede leer el video '{video_file_path}' de Job: {job_source_name}: {e_size}")
+            return False
+        upload_url = f"{self.video_upload_url.rstrip('/')}/{quote(str(vehicle_id), safe='')}"
+        try:
+            response = self._post_with_retries(upload_url, job_source_name, file_path=video_file_path,
+                                               headers={'Content-Type': 'application/octet-stream'},
+                                               max_retries=max_retries, raise_rejected=raise_rejected)
+        except _DeliveryRejected:
+            with self._stats_lock: self.video_upload_failures += 1
+            raise
+        with self._stats_lock:
+            if response is None:
+                self.video_upload_failures += 1
+                return False
+            self.videos_uploaded += 1
+            self.video_bytes_uploaded += video_size
+        if self.debug_mode: print(f"[API_CLIENT] Video de Vehículo '{vehicle_id}' subido ({video_size} bytes). Respuesta: {response.status_code}")
+        return True
+
+    def _upload_payload_video(self, payload_to_send, video_file_path, job_source_name):
+        """Sube el video del payload y elimina el archivo; si falla, lo indica en 'video_sent_status'."""
+        try:
+            # Primero el video: al llegar el payload, el receptor ya lo tiene asociado a 'vehicle_unique_id'
+            if not self._upload_video(payload_to_send.get('vehicle_unique_id', job_source_name), video_file_path, job_source_name):
+                payload_to_send['video_sent_status'] = "upload_failed"
+        finally:
+            self._remove_video_file(video_file_path)
+
+    def _deliver(self, payload_to_send, job_source_name, video_file_path=None):
+        """Sube el video (si hay) y envía el payload JSON, con reintentos. Devuelve True si se aceptó el payload."""
+        t0 = time.perf_counter()
+        if video_file_path: self._upload_payload_video(payload_to_send, video_file_path, job_source_name)
+
+        # Log del payload sin el video completo
+        if self.debug_mode:
+            payload_for_log = {k:v for k,v in payload_to_send.items() if k != 'processed_video_base64'}
+            if 'processed_video_base64' in payload_to_send:
+                payload_for_log['processed_video_base64_status'] = "Present (Length: {})".format(len(payload_to_send['processed_video_base64']))
+            print(f"[API_CLIENT] Intentando enviar datos a {self.server_url}: {json.dumps(payload_for_log, indent=2)}")
+
+        response = self._post_with_retries(self.server_url, job_source_name, body=json.dumps(payload_to_send))
+        with self._stats_lock:
+            if response is None:
+                self.failed += 1
+                return False
+            self.sent += 1
+            self.send_latencies.append(time.perf_counter() - t0)
+        if self.debug_mode: print(f"[API_CLIENT] Datos para Vehículo (Job: {job_source_name}) enviados. Respuesta: {response.status_code}")
+        return True
+
+    def _closed_and_expired(self):
+        """Durante el cierre, no se reintenta una vez agotado el plazo de vaciado de la cola."""
+        return self._closed and time.monotonic() > self._flush_deadline
+
+    def get_stats(self):
+        """Envíos exitosos, fallidos, descartados y reintentos, videos y lotes enviados, pendientes y latencia por envío (ms)."""
+        with self._stats_lock:
+            latencies_ms = np.array(self.send_latencies) * 1000.0
+            stats = {"sent": self.sent, "failed": self.failed, "dropped": self.dropped, "retries": self.retries,
+                     "videos_uploaded": self.videos_uploaded, "video_upload_failures": self.video_upload_failures,
+                     "video_bytes_uploaded": self.video_bytes_uploaded,
+                     "batches_sent": self.batches_sent, "batches_dead_lettered": self.batches_dead_lettered,
+                     "batch_bytes_raw": self.batch_bytes_raw,
+                     "batch_bytes_sent": self.batch_bytes_sent,
+                     "spool_pending_batches": self.spool.pending_count() if self.spool else 0,
+                     "queue_depth": self.send_queue.qsize() if self.send_queue else 0,
+                     "queue_size": self.send_queue.maxsize if self.send_queue else 0}
+        if len(latencies_ms):
+            stats.update({"latency_mean_ms": round(float(latencies_ms.mean()), 2),
+                          "latency_p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+                          "latency_p95_ms": round(float(np.percentile(latencies_ms, 95)), 2),
+                          "latency_max_ms": round(float(latencies_ms.max()), 2)})
+        return stats
+
+    def close(self, timeout=None):
+        """
+        Deja de aceptar resultados, espera a que el hilo de envío vacíe la cola (hasta `timeout`
+        segundos; por defecto `shutdown_flush_timeout_seconds`) y cierra las conexiones.
+        """
+        if self._closed: return
+        timeout = self.shutdown_flush_timeout if timeout is None else timeout
+        self._flush_deadline = time.monotonic() + timeout
+        self._closed = True
+        if self._sender_thread is not None:
+            pending = self.send_queue.qsize()
+            if pending: print(f"[API_CLIENT] Enviando {pending} resultado(s) pendiente(s) antes de cerrar...")
+            self.send_queue.put(_STOP_SENDER) # Tras los pendientes (FIFO)
+            self._sender_thread.join(timeout)
+            if self._sender_thread.is_alive():
+                print(f"[API_CLIENT] ADVERTENCIA: {self.send_queue.qsize()} resultado(s) sin enviar al cerrar.")
+                while True: # Eliminar los videos temporales de los resultados que no se enviarán
+                    try: item = self.send_queue.get_nowait()
+                    except queue.Empty: break
+                    if item is not _STOP_SENDER: self._remove_video_file(item[2])
+        self.session.close()
+        stats = self.get_stats()
+        print(f"[API_CLIENT] Cerrado. Enviados: {stats['sent']}, fallidos: {stats['failed']}, descartados: {stats['dropped']}, reintentos: {stats['retries']}.")
+        if stats['spool_pending_batches']:
+            print(f"[API_CLIENT] {stats['spool_pending_batches']} lote(s) quedan en el spool '{self.spool.spool_dir}' y se enviarán en el próximo arranque.")
@@ -0,0 +1,120 @@
+# backend_benchmark.py
+"""
+Compara backends de inferencia (ONNX Runtime / OpenVINO, con o sin INT8) contra la línea base
+PyTorch (`best.pt`) sobre una carpeta de imágenes de la propia instalación.
+
+Reporta, por backend:
+  * Latencia por frame (media, p50, p95) de la inferencia.
+  * Delta de exactitud frente a PyTorch: concordancia de detecciones (misma clase e IoU >= umbral)
+    expresada como precisión / exhaustividad / F1 respecto a las detecciones de la línea base.
+
+Uso:
+    python backend_benchmark.py --images D:/muestras/camion3 --backends onnx openvino --int8
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+from config_loader import AppConfig
+from model_backends import prepare_model_for_backend
+from utils import compute_iou
+
+def _run_backend(model, image_paths, imgsz, conf, warmup):
+    """Ejecuta predicción (sin tracking) sobre las imágenes. Devuelve (detecciones por imagen, latencias en ms)."""
+    detections_per_image, latencies_ms = [], []
+    for idx, path in enumerate(image_paths):
+        frame = cv2.imread(path)
+        if frame is None: continue
+        t0 = time.perf_counter()
+        result = model.predict(source=frame, imgsz=imgsz, conf=conf, verbose=False)[0]
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+        if idx >= warmup: latencies_ms.append(elapsed_ms)
+        boxes = result.boxes
+        detections_per_image.append(list(zip(boxes.cls.cpu().numpy().astype(int), boxes.xyxy.cpu().numpy())))
+    return detections_per_image, latencies_ms
+
+def _match_against_baseline(baseline, candidate, iou_threshold):
+    """Empareja de forma voraz detecciones candidatas con las de la línea base (misma clase, IoU >= umbral)."""
+    matched = total_baseline = total_candidate = 0
+    for base_dets, cand_dets in zip(baseline, candidate):
+        total_baseline += len(base_dets)
+        total_candidate += len(cand_dets)
+        used = set()
+        for cls_c, box_c in cand_dets:
+            best_iou, best_j = iou_threshold, None
+            for j, (cls_b, box_b) in enumerate(base_dets):
+                if j in used or cls_b != cls_c: continue
+                iou = compute_iou(box_c, box_b)
+                if iou >= best_iou: best_iou, best_j = iou, j
+            if best_j is not None:
+                used.add(best_j)
+                matched += 1
+    precision = matched / total_candidate if total_candidate else 1.0
+    recall = matched / total_baseline if total_baseline else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if (precision + recall) else 0.0
+    return {"baseline_detections": total_baseline, "candidate_detections": total_candidate,
+            "matched": matched, "precision_vs_baseline": round(precision, 4),
+            "recall_vs_baseline": round(recall, 4), "f1_vs_baseline": round(f1, 4)}
+
+def _latency_summary(latencies_ms):
+    if not latencies_ms: return {"frames": 0}
+    arr = np.array(latencies_ms)
+    return {"frames": len(arr), "mean_ms": round(float(arr.mean()), 2),
+            "p50_ms": round(float(np.percentile(arr, 50)), 2), "p95_ms": round(float(np.percentile(arr, 95)), 2)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara backends de inferencia contra la línea base PyTorch.")
+    parser.add_argument("--images", type=str, required=True, help="Carpeta con imágenes de muestra de la instalación.")
+    parser.add_argument("--backends", nargs="+", default=["onnx", "openvino"], help="Backends a comparar (onnx, openvino).")
+    parser.add_argument("--int8", action="store_true", help="Evaluar también las variantes INT8 (usa model.int8_calibration_folder).")
+    parser.add_argument("--max_images", type=int, default=200, help="Máximo de imágenes a evaluar.")
+    parser.add_argument("--warmup", type=int, default=5, help="Frames iniciales excluidos de la latencia.")
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU mínimo para considerar dos detecciones equivalentes.")
+    parser.add_argument("--output", type=str, default=None, help="Archivo JSON donde guardar el reporte.")
+    args = parser.parse_args()
+
+    cfg = AppConfig(config_path_str="config.yaml")
+    pt_path = cfg.get('model.path')
+    imgsz = cfg.get('model.imgsz', 640)
+    conf = cfg.get('model.min_global_confidence_for_tracker', 0.1)
+    image_paths = sorted(str(p) for p in Path(args.images).glob(cfg.get('source.image_glob_pattern', "*.jpg")))[:args.max_images]
+    if not image_paths:
+        print(f"[BACKEND_BENCH] No se encontraron imágenes en: {args.images}")
+        return
+
+    print(f"[BACKEND_BENCH] Línea base PyTorch sobre {len(image_paths)} imágenes...")
+    baseline_dets, baseline_lat = _run_backend(YOLO(pt_path, task="detect"), image_paths, imgsz, conf, args.warmup)
+    report = {"images": len(image_paths), "imgsz": imgsz, "pytorch": {"latency": _latency_summary(baseline_lat)}}
+
+    variants = [(b, False) for b in args.backends] + ([(b, True) for b in args.backends] if args.int8 else [])
+    for backend, int8 in variants:
+        name = f"{backend}{'_int8' if int8 else ''}"
+        print(f"[BACKEND_BENCH] Evaluando '{name}'...")
+        try:
+            model_path = prepare_model_for_backend(pt_path, backend=backend, int8=int8,
+                                                   calibration_folder=cfg.get('model.int8_calibration_folder'),
+                                                   imgsz=imgsz, class_names=cfg.get('classes.names', []),
+                                                   calibration_max_images=cfg.get('model.int8_calibration_max_images', 300),
+                                                   debug_mode=True)
+            dets, lat = _run_backend(YOLO(model_path, task="detect"), image_paths, imgsz, conf, args.warmup)
+        except Exception as e:
+            print(f"[BACKEND_BENCH] ERROR evaluando '{name}': {e}")
+            report[name] = {"error": str(e)}
+            continue
+        latency = _latency_summary(lat)
+        if latency.get("mean_ms") and report["pytorch"]["latency"].get("mean_ms"):
+            latency["speedup_vs_pytorch"] = round(report["pytorch"]["latency"]["mean_ms"] / latency["mean_ms"], 2)
+        report[name] = {"latency": latency, "accuracy_delta": _match_against_baseline(baseline_dets, dets, args.iou)}
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"[BACKEND_BENCH] Reporte guardado en: {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import copy
 import yaml
 from pathlib import Path
 
@@ -118,3 +119,27 @@ class AppConfig:
             return default
         except TypeError: # Ocurre si 'value' se vuelve None en algún punto intermedio y se intenta indexar
             return default
+
+    def with_overrides(self, overrides):
+        """
+        Devuelve una copia de la configuración con algunos valores reemplazados (p. ej. para barridos
+        de parámetros), volviendo a resolver los IDs de clase y los umbrales por clase.
+
+        Args:
+            overrides (dict): Ruta de claves separadas por puntos -> nuevo valor,
+                              ej. {'tire_logic.iou_threshold_same_physical_tire': 0.5}.
+
+        Returns:
+            AppConfig: Nueva instancia; la original no se modifica.
+        """
+        new_config = copy.copy(self)
+        new_config.config_data = copy.deepcopy(self.config_data)
+        for key_path, value in overrides.items():
+            keys = key_path.split('.')
+            node = new_config.config_data
+            for key in keys[:-1]:
+                if not isinstance(node.get(key), dict): node[key] = {}
+                node = node[key]
+            node[keys[-1]] = value
+        new_config._resolve_class_ids_and_thresholds()
+        return new_config
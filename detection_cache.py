@@ -0,0 +1,159 @@
+# detection_cache.py
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from detections import FrameDetections
+
+_FILE_SUFFIX = ".npz"
+
+def hash_file(path, chunk_size=1 << 20):
+    """Hash (blake2b) del contenido de un archivo o, si es una carpeta (modelo OpenVINO), de todos sus archivos."""
+    digest = hashlib.blake2b(digest_size=16)
+    path = Path(path)
+    files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+    for file_path in files:
+        digest.update(file_path.name.encode("utf-8"))
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""): digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_frame(frame):
+    """Hash del contenido exacto de un frame (píxeles y shape)."""
+    digest = hashlib.blake2b(np.ascontiguousarray(frame).data, digest_size=16)
+    digest.update(str(frame.shape).encode("ascii"))
+    return digest.hexdigest()
+
+class _JobCacheRecorder:
+    """
+    Caché de un trabajo: sirve las detecciones ya guardadas para los frames cuyo hash coincide y
+    registra todas las del trabajo (en orden) para reescribir su archivo si hubo frames nuevos.
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self._entries = {} # hash de frame -> (xyxy, conf, cls) del archivo cargado
+        self._loaded_key = None
+        self._recorded = [] # (hash, xyxy, conf, cls) de cada frame del trabajo, en orden
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, frame_hash):
+        """Detecciones cacheadas para el frame, o None."""
+        if self._loaded_key is None and not self._recorded:
+            # Primer frame del trabajo: su hash identifica el archivo del trabajo
+            self._loaded_key = frame_hash
+            self._entries = self.cache.load_job(frame_hash)
+        entry = self._entries.get(frame_hash)
+        if entry is None: self.misses += 1
+        else: self.hits += 1
+        return entry
+
+    def record(self, frame_hash, xyxy, conf, cls):
+        self._recorded.append((frame_hash, xyxy, conf, cls))
+
+    def finish(self):
+        """Guarda el trabajo si tuvo frames sin caché (reemplazando el archivo anterior)."""
+        if self.misses and self._recorded:
+            self.cache.save_job(self._recorded[0][0], self._recorded)
+        return {"hits": self.hits, "misses": self.misses}
+
+class DetectionCache:
+    """
+    Caché persistente de detecciones (antes del tracking) para re-ejecutar secuencias archivadas sin
+    volver a pasar el modelo, p. ej. al ajustar `tire_logic`. Cada trabajo se guarda en un archivo
+    columnar comprimido (hashes de frame, desplazamientos y arrays de cajas/confianzas/clases) cuyo
+    nombre es el hash de su primer frame, dentro de una carpeta por huella del modelo y de los
+    parámetros de detección. El tracking se rehace en vivo sobre las detecciones cacheadas, por lo
+    que la configuración del tracker no invalida la caché.
+    El tamaño total se limita a `max_size_mb` eliminando los archivos usados hace más tiempo (LRU).
+    """
+    def __init__(self, cache_dir, fingerprint_data, max_size_mb=2048, debug_mode=False):
+        """
+        Args:
+            cache_dir (str): Carpeta raíz de la caché.
+            fingerprint_data (dict): Todo lo que determina las detecciones (hash del modelo, backend,
+                                     imgsz, confianza mínima, cascada...). Se serializa a la huella.
+            max_size_mb (float, optional): Tamaño máximo total de la caché en MB.
+            debug_mode (bool, optional): Si es True, imprime mensajes de depuración.
+        """
+        self.root = Path(cache_dir)
+        self.fingerprint = hashlib.blake2b(json.dumps(fingerprint_data, sort_keys=True).encode("utf-8"), digest_size=8).hexdigest()
+        self.dir = self.root / self.fingerprint
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.debug_mode = debug_mode
+        self._lock = threading.Lock() # Escrituras y desalojo desde varios hilos trabajadores
+        with open(self.dir / "fingerprint.json", "w", encoding="utf-8") as f: json.dump(fingerprint_data, f, indent=2, sort_keys=True)
+
+    def start_job(self):
+        return _JobCacheRecorder(self)
+
+    def _job_path(self, job_key):
+        return self.dir / f"{job_key}{_FILE_SUFFIX}"
+
+    def load_job(self, job_key):
+        """Carga el archivo de un trabajo como {hash de frame: (xyxy, conf, cls)} (vacío si no existe)."""
+        path = self._job_path(job_key)
+        try:
+            with np.load(path) as data:
+                hashes, offsets = data["frame_hashes"], data["offsets"]
+                xyxy, conf, cls = data["xyxy"], data["conf"], data["cls"]
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return {}
+        try: os.utime(path) # Marca de uso reciente para el desalojo LRU
+        except OSError: pass
+        entries = {}
+        for i, frame_hash in enumerate(hashes):
+            start, end = offsets[i], offsets[i + 1]
+            entries[str(frame_hash)] = (xyxy[start:end], conf[start:end], cls[start:end])
+        if self.debug_mode: print(f"[DETECTION_CACHE] {len(entries)} frames cacheados cargados de {path.name}")
+        return entries
+
+    def save_job(self, job_key, recorded):
+        """Escribe (o reemplaza) el archivo columnar de un trabajo y aplica el límite de tamaño."""
+        counts = [len(xyxy) for _, xyxy, _, _ in recorded]
+        offsets = np.zeros(len(recorded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        path = self._job_path(job_key)
+        tmp_path = path.with_name(path.stem + ".tmp" + _FILE_SUFFIX)
+        with self._lock:
+            np.savez_compressed(tmp_path,
+                                frame_hashes=np.array([frame_hash for frame_hash, _, _, _ in recorded]),
+                                offsets=offsets,
+                                xyxy=np.concatenate([xyxy for _, xyxy, _, _ in recorded]).astype(np.float32).reshape(-1, 4),
+                                conf=np.concatenate([conf for _, _, conf, _ in recorded]).astype(np.float32),
+                                cls=np.concatenate([cls for _, _, _, cls in recorded]).astype(np.uint16))
+            os.replace(tmp_path, path)
+            self._evict_to_size_cap(keep=path)
+        if self.debug_mode: print(f"[DETECTION_CACHE] Trabajo guardado: {path.name} ({len(recorded)} frames, {path.stat().st_size / 1024:.0f} KB)")
+
+    def _evict_to_size_cap(self, keep=None):
+        files = [(p.stat().st_mtime, p.stat().st_size, p) for p in self.root.rglob(f"*{_FILE_SUFFIX}")]
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files, key=lambda item: item[0]):
+            if total <= self.max_size_bytes: break
+            if path == keep: continue
+            try:
+                path.unlink()
+                total -= size
+                if self.debug_mode: print(f"[DETECTION_CACHE] Desalojado (LRU): {path.name}")
+            except OSError:
+                pass
+
+    @staticmethod
+    def to_arrays(result):
+        """Arrays (xyxy, conf, cls) de un resultado de detección (Results o FrameDetections)."""
+        boxes = result.boxes if result is not None else None
+        if boxes is None or len(boxes) == 0:
+            return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.float32)
+        return boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy()
+
+    @staticmethod
+    def to_detections(frame, entry, names):
+        """FrameDetections (sin IDs) de una entrada cacheada, asociada al frame de entrada del detector."""
+        xyxy, conf, cls = entry
+        return FrameDetections(frame, xyxy, conf, cls, names=names, orig_shape=frame.shape[:2])
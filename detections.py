@@ -0,0 +1,157 @@
+# detections.py
+import cv2
+import numpy as np
+
+class _DetectionArray:
+    """
+    Envoltorio mínimo de un array NumPy que imita la interfaz de los tensores de ultralytics
+    usada en el proyecto (`.cpu().numpy()`), para que `TireCounterLogic` funcione igual
+    con resultados de YOLO o con `FrameDetections`.
+    """
+    def __init__(self, array):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+    def __len__(self):
+        return len(self.array)
+
+class _NumpyBoxes:
+    """
+    Vista NumPy de las cajas, equivalente a `Results.boxes.cpu().numpy()`:
+    atributos como arrays planos e indexable, tal como la consumen los trackers de ultralytics.
+    """
+    def __init__(self, xyxy, conf, cls, track_ids=None):
+        self.xyxy, self.conf, self.cls, self.id = xyxy, conf, cls, track_ids
+
+    @property
+    def xywh(self):
+        xywh = self.xyxy.copy()
+        xywh[:, 0] = (self.xyxy[:, 0] + self.xyxy[:, 2]) / 2
+        xywh[:, 1] = (self.xyxy[:, 1] + self.xyxy[:, 3]) / 2
+        xywh[:, 2] = self.xyxy[:, 2] - self.xyxy[:, 0]
+        xywh[:, 3] = self.xyxy[:, 3] - self.xyxy[:, 1]
+        return xywh
+
+    def __len__(self):
+        return len(self.xyxy)
+
+    def __getitem__(self, idx):
+        return _NumpyBoxes(self.xyxy[idx], self.conf[idx], self.cls[idx], self.id[idx] if self.id is not None else None)
+
+class DetectionBoxes:
+    """Cajas de un frame en formato compatible con `Results.boxes` (xyxy, conf, cls, id)."""
+    def __init__(self, xyxy, conf, cls, track_ids=None):
+        self.xyxy = _DetectionArray(np.asarray(xyxy, dtype=np.float32).reshape(-1, 4))
+        self.conf = _DetectionArray(np.asarray(conf, dtype=np.float32).reshape(-1))
+        self.cls = _DetectionArray(np.asarray(cls, dtype=np.float32).reshape(-1))
+        self.id = _DetectionArray(np.asarray(track_ids, dtype=np.float32).reshape(-1)) if track_ids is not None else None
+
+    def __len__(self):
+        return len(self.xyxy)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return _NumpyBoxes(self.xyxy.array, self.conf.array, self.cls.array, self.id.array if self.id is not None else None)
+
+# Paleta de colores BGR por clase para plot()
+_CLASS_COLORS = [(56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207),
+                 (10, 249, 72), (23, 204, 146), (134, 219, 61), (52, 147, 26), (187, 212, 0)]
+
+class FrameDetections:
+    """
+    Resultado de detección/tracking de un frame independiente de ultralytics.
+    Se usa cuando las cajas deben transformarse antes de llegar a `TireCounterLogic`
+    (p. ej. decodificación a resolución reducida) y expone la misma interfaz que
+    `ultralytics.engine.results.Results` que consume el resto del proyecto:
+    `boxes.{xyxy,conf,cls,id}`, `orig_img`, `orig_shape`, `names`, `plot()` y `len()`.
+    """
+    def __init__(self, orig_img, xyxy, conf, cls, track_ids=None, names=None, orig_shape=None):
+        """
+        Args:
+            orig_img (numpy.ndarray): Imagen sobre la que se dibuja en `plot()`.
+            xyxy, conf, cls (array-like): Cajas, confianzas y clases de las detecciones.
+            track_ids (array-like, optional): IDs de tracking (None si no hay tracking).
+            names (dict, optional): Mapa class_id -> nombre para las etiquetas.
+            orig_shape (tuple, optional): (alto, ancho) del frame en el que están expresadas las cajas.
+                                          Si difiere del tamaño de `orig_img`, `plot()` reescala la imagen.
+        """
+        self.orig_img = orig_img
+        self.orig_shape = tuple(orig_shape[:2]) if orig_shape is not None else tuple(orig_img.shape[:2])
+        self.names = names or {}
+        self.boxes = DetectionBoxes(xyxy, conf, cls, track_ids)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @classmethod
+    def from_yolo_results(cls, yolo_results, orig_img=None, orig_shape=None):
+        """Convierte un `Results` de ultralytics en `FrameDetections` (copiando a NumPy)."""
+        boxes = yolo_results.boxes
+        if boxes is None or len(boxes) == 0:
+            xyxy, conf, class_ids, track_ids = np.zeros((0, 4)), np.zeros(0), np.zeros(0), None
+            if boxes is not None and boxes.id is not None: track_ids = np.zeros(0)
+        else:
+            xyxy = boxes.xyxy.cpu().numpy()
+            conf = boxes.conf.cpu().numpy()
+            class_ids = boxes.cls.cpu().numpy()
+            track_ids = boxes.id.cpu().numpy() if boxes.id is not None else None
+        return cls(orig_img if orig_img is not None else yolo_results.orig_img, xyxy, conf, class_ids,
+                   track_ids=track_ids, names=yolo_results.names, orig_shape=orig_shape)
+
+    def scaled(self, scale_x, scale_y, orig_img=None, orig_shape=None):
+        """
+        Devuelve una copia con las cajas escaladas (x*scale_x, y*scale_y).
+
+        Args:
+            scale_x, scale_y (float): Factores de escala por eje.
+            orig_img (numpy.ndarray, optional): Imagen asociada a la copia. Por defecto, la misma.
+            orig_shape (tuple, optional): (alto, ancho) del espacio de coordenadas destino.
+        """
+        xyxy = self.boxes.xyxy.numpy() * np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        track_ids = self.boxes.id.numpy() if self.boxes.id is not None else None
+        return FrameDetections(self.orig_img if orig_img is None else orig_img, xyxy, self.boxes.conf.numpy(),
+                               self.boxes.cls.numpy(), track_ids=track_ids, names=self.names,
+                               orig_shape=orig_shape if orig_shape is not None else self.orig_shape)
+
+    def plot(self, conf=True, line_width=None, font_size=None, labels=True):
+        """
+        Dibuja las cajas sobre una copia de `orig_img` (reescalada a `orig_shape` si hace falta),
+        con argumentos equivalentes a `Results.plot()`.
+
+        Returns:
+            numpy.ndarray: Imagen anotada en el espacio de coordenadas de las cajas.
+        """
+        img = self.orig_img
+        target_h, target_w = self.orig_shape
+        if img.shape[0] != target_h or img.shape[1] != target_w:
+            img = cv2.resize(img, (target_w, target_h), interpolation=cv2.INTER_LINEAR)
+        else:
+            img = img.copy()
+
+        lw = line_width or max(round(sum(img.shape[:2]) / 2 * 0.003), 2)
+        font_scale = font_size if font_size else lw / 3
+        font_thickness = max(lw - 1, 1)
+
+        xyxy = self.boxes.xyxy.numpy()
+        confs = self.boxes.conf.numpy()
+        class_ids = self.boxes.cls.numpy().astype(int)
+        track_ids = self.boxes.id.numpy().astype(int) if self.boxes.id is not None else None
+        for i in range(len(xyxy)):
+            x1, y1, x2, y2 = (int(v) for v in xyxy[i])
+            color = _CLASS_COLORS[class_ids[i] % len(_CLASS_COLORS)]
+            cv2.rectangle(img, (x1, y1), (x2, y2), color, lw, cv2.LINE_AA)
+            if not labels: continue
+            label = (f"id:{track_ids[i]} " if track_ids is not None else "") + str(self.names.get(class_ids[i], class_ids[i]))
+            if conf: label += f" {confs[i]:.2f}"
+            (text_w, text_h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, font_thickness)
+            label_y = y1 - 3 if y1 - text_h - 3 >= 0 else y1 + text_h + 3
+            cv2.rectangle(img, (x1, label_y - text_h - 3), (x1 + text_w, label_y + 3), color, -1, cv2.LINE_AA)
+            cv2.putText(img, label, (x1, label_y), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255), font_thickness, cv2.LINE_AA)
+        return img
@@ -1,30 +1,385 @@
 # detector.py
+import itertools
+import math
+import threading
+import cv2
+import numpy as np
 from ultralytics import YOLO
+from detections import FrameDetections
+from model_backends import prepare_model_for_backend
+from frame_tracker import FrameTracker
+from tracker_logic import get_tire_search_region
+from detection_cache import DetectionCache, hash_file, hash_frame
 
 class ObjectDetector:
+    """
+    Encapsula el modelo YOLO (una sola copia de los pesos) y los estados de tracking.
+    Cada trabajo/stream puede tener su propia sesión de tracking (`create_tracker_session`),
+    de modo que varios hilos comparten el modelo sin mezclar IDs ni memoria de tracks.
+    """
     def __init__(self, config):
         self.model_path = config.get('model.path')
         self.tracker_config = config.get('model.tracker_config_file', "bytetrack.yaml") # Default si no está en config
         self.min_global_conf = config.get('model.min_global_confidence_for_tracker', 0.1)
         self.debug_mode = config.get('processing.debug_mode', False)
+
+        # Backend de inferencia (pytorch / onnx / openvino) y cuantización INT8 opcional
+        self.backend = config.get('model.backend', "pytorch")
+        self.int8 = config.get('model.int8', False)
+        self.imgsz = config.get('model.imgsz', 640)
+        # Los modelos exportados tienen forma de entrada fija (batch 1): se les pasa un frame por llamada
+        self.fixed_batch_model = self.backend != "pytorch"
         
         try:
-            self.model = YOLO(self.model_path)
-            if self.debug_mode: print(f"[DETECTOR] Modelo YOLO cargado desde: {self.model_path}")
+            self.model_path = prepare_model_for_backend(
+                self.model_path, backend=self.backend, int8=self.int8,
+                calibration_folder=config.get('model.int8_calibration_folder'),
+                imgsz=self.imgsz, class_names=config.get('classes.names', []),
+                calibration_max_images=config.get('model.int8_calibration_max_images', 300),
+                debug_mode=self.debug_mode)
+            self.model = YOLO(self.model_path, task="detect")
+            if self.debug_mode: print(f"[DETECTOR] Modelo YOLO cargado desde: {self.model_path} (backend: {self.backend}{', INT8' if self.int8 else ''})")
         except Exception as e:
             print(f"Error Crítico: No se pudo cargar el modelo YOLO desde '{self.model_path}'.")
             raise RuntimeError(f"Fallo al cargar modelo YOLO: {e}")
 
-    def track_objects(self, frame):
+        # Cascada: vehículos a baja resolución en el frame completo y llantas a resolución completa
+        # solo en las regiones donde `TireCounterLogic` las buscará (requiere sesión de tracking)
+        self.cascade_enabled = config.get('model.cascade.enabled', False)
+        self.cascade_vehicle_imgsz = config.get('model.cascade.vehicle_imgsz', 320)
+        self.cascade_tire_imgsz = config.get('model.cascade.tire_imgsz', self.imgsz)
+        self.cascade_crop_margin = config.get('model.cascade.crop_margin_fraction', 0.1)
+        self.cascade_nms_iou = config.get('model.cascade.tire_nms_iou', 0.5)
+        self.vehicle_class_ids = list(config.vehicle_class_ids)
+        self.tire_class_id = config.tire_class_id
+        self.tire_region_params = (config.get('tire_logic.vehicle_box_expansion_x_percent', 0.0),
+                                   config.get('tire_logic.vehicle_box_expansion_y_percent', 0.0),
+                                   config.get('tire_logic.min_y_fraction_from_veh_top'),
+                                   config.get('tire_logic.max_y_extension_below_veh_bottom_fraction'))
+        if self.cascade_enabled:
+            if self.backend != "pytorch" and (self.cascade_vehicle_imgsz != self.imgsz or self.cascade_tire_imgsz != self.imgsz):
+                print(f"[DETECTOR] ADVERTENCIA: el backend '{self.backend}' tiene tamaño de entrada fijo; la cascada usará imgsz={self.imgsz} en ambas pasadas.")
+            # Con backends exportados ambas pasadas van además imagen a imagen (ver `_predict`)
+                self.cascade_vehicle_imgsz = self.cascade_tire_imgsz = self.imgsz
+            if self.tire_class_id == -1 or not self.vehicle_class_ids:
+                print("[DETECTOR] ADVERTENCIA: cascada deshabilitada (clases de vehículo/llanta no configuradas).")
+                self.cascade_enabled = False
+            elif self.debug_mode:
+                print(f"[DETECTOR] Cascada activa: vehículos a {self.cascade_vehicle_imgsz}px, llantas a {self.cascade_tire_imgsz}px en recortes.")
+
+        # El predictor de ultralytics no es reentrante: las llamadas al modelo se serializan,
+        # mientras que tracking, lógica de llantas, dibujo y E/S de cada hilo corren en paralelo.
+        self._model_lock = threading.Lock()
+        self._tracker_sessions = {} # session_id -> FrameTracker
+        self._sessions_lock = threading.Lock()
+        self._session_counter = itertools.count(1)
+
+        # Caché persistente de detecciones por contenido de frame (re-ejecución de secuencias archivadas)
+        self.detection_cache = None
+        self._cache_recorders = {} # session_id -> _JobCacheRecorder
+        if config.get('model.detection_cache.enabled', False):
+            fingerprint_data = {
+                "model_hash": hash_file(self.model_path), "backend": self.backend, "int8": self.int8,
+                "imgsz": self.imgsz, "min_global_conf": self.min_global_conf,
+                "cascade": [self.cascade_vehicle_imgsz, self.cascade_tire_imgsz, self.cascade_crop_margin,
+                            self.cascade_nms_iou, self.vehicle_class_ids, self.tire_class_id,
+                            list(self.tire_region_params)] if self.cascade_enabled else None,
+            }
+            self.detection_cache = DetectionCache(config.get('model.detection_cache.dir', "detection_cache"), fingerprint_data,
+                                                  max_size_mb=config.get('model.detection_cache.max_size_mb', 2048),
+                                                  debug_mode=self.debug_mode)
+            print(f"[DETECTOR] Caché de detecciones activa: {self.detection_cache.dir}")
+
+    # --- Sesiones de tracking (estado por trabajo / stream) ---
+
+    def create_tracker_session(self, name="job", use_detection_cache=False):
+        """
+        Crea un estado de tracking independiente (IDs desde 1, sin tracks heredados).
+
+        Args:
+            name (str, optional): Prefijo descriptivo para el ID de la sesión.
+            use_detection_cache (bool, optional): Leer/guardar las detecciones de la sesión en la caché
+                                                  persistente (si está habilitada). Solo para fuentes finitas.
+
+        Returns:
+            str: ID de la sesión, a pasar a `track_objects` / `iter_tracked_frames`.
+        """
+        session_id = f"{name}#{next(self._session_counter)}"
+        with self._sessions_lock:
+            self._tracker_sessions[session_id] = FrameTracker(self.tracker_config)
+            if use_detection_cache and self.detection_cache is not None:
+                self._cache_recorders[session_id] = self.detection_cache.start_job()
+        if self.debug_mode: print(f"[DETECTOR] Sesión de tracking creada: {session_id}")
+        return session_id
+
+    def reset_tracker_session(self, session_id):
+        """Reinicia el estado de tracking de una sesión existente (p. ej. reconexión de un stream)."""
+        self._get_tracker_session(session_id).reset()
+        if self.debug_mode: print(f"[DETECTOR] Sesión de tracking reiniciada: {session_id}")
+
+    def destroy_tracker_session(self, session_id):
+        """Elimina una sesión de tracking y libera su memoria. No falla si ya no existe."""
+        with self._sessions_lock:
+            removed = self._tracker_sessions.pop(session_id, None)
+            cache_recorder = self._cache_recorders.pop(session_id, None)
+        if cache_recorder is not None:
+            cache_stats = cache_recorder.finish()
+            print(f"[DETECTION_CACHE] Sesión {session_id}: {cache_stats['hits']} frames desde caché, {cache_stats['misses']} inferidos.")
+        if self.debug_mode and removed is not None: print(f"[DETECTOR] Sesión de tracking eliminada: {session_id}")
+
+    def _get_tracker_session(self, session_id):
+        with self._sessions_lock:
+            frame_tracker = self._tracker_sessions.get(session_id)
+        if frame_tracker is None:
+            raise KeyError(f"Sesión de tracking inexistente: '{session_id}'")
+        return frame_tracker
+
+    def track_objects(self, frame, original_shape=None, session_id=None, roi=None):
+        """
+        Ejecuta detección + tracking sobre un frame.
+
+        Args:
+            frame (numpy.ndarray): Frame BGR (posiblemente decodificado a escala reducida).
+            original_shape (tuple, optional): Shape del frame en resolución original. Si difiere del
+                                              de `frame`, las cajas se reescalan a ese espacio.
+            session_id (str, optional): Sesión de tracking a usar. Sin sesión se usa el tracker
+                                        interno del modelo (`model.track(persist=True)`), compartido.
+            roi (RegionOfInterest, optional): Región a la que se recorta el frame antes de la inferencia.
+
+        Returns:
+            Results or FrameDetections or None: Resultados del frame, en coordenadas originales.
+        """
         if frame is None:
             if self.debug_mode: print("[DETECTOR] Error: Frame de entrada es None para track_objects.")
             return None
+        if session_id is not None:
+            return self.track_batch([frame], session_id, [original_shape], roi=roi)[0]
+        if roi is not None:
+            return roi.map_result(self.track_objects(roi.apply(frame, original_shape)), frame, original_shape)
+        if self.cascade_enabled and self.debug_mode:
+            print("[DETECTOR] Cascada no disponible sin sesión de tracking: se usa model.track() de una pasada.")
         try:
-            results = self.model.track(source=frame, persist=True, 
-                                       tracker=self.tracker_config, 
-                                       conf=self.min_global_conf, 
-                                       verbose=False) 
-            return results[0] 
+            with self._model_lock:
+                results = self.model.track(source=frame, persist=True, 
+                                           tracker=self.tracker_config, 
+                                           conf=self.min_global_conf, 
+                                           imgsz=self.imgsz,
+                                           verbose=False) 
+            return self._map_to_original_shape(results[0], original_shape)
         except Exception as e:
             print(f"Error durante model.track(): {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def _map_to_original_shape(self, result, original_shape):
+        """Reescala las cajas de `result` al espacio del frame original (decodificación reducida)."""
+        if original_shape is None: return result
+        frame_h, frame_w = result.orig_shape[:2]
+        orig_h, orig_w = original_shape[:2]
+        if (frame_h, frame_w) == (orig_h, orig_w): return result
+        return FrameDetections.from_yolo_results(result).scaled(orig_w / frame_w, orig_h / frame_h, orig_shape=(orig_h, orig_w))
+
+    def _predict(self, source, **predict_kwargs):
+        """
+        `model.predict` de una lista de imágenes (llamar con `_model_lock` tomado): en un único lote con
+        PyTorch, o de una en una con los backends exportados (ONNX/OpenVINO rechazan un batch > 1).
+        """
+        if not self.fixed_batch_model:
+            return self.model.predict(source=list(source), batch=len(source), verbose=False, **predict_kwargs)
+        results = []
+        for image in source: results.extend(self.model.predict(source=image, batch=1, verbose=False, **predict_kwargs))
+        return results
+
+    def detect_batch(self, frames):
+        """
+        Detección pura (sin tracking) de un lote de frames en una sola llamada al modelo
+        (dos llamadas en modo cascada, ver `_detect_batch_cascade`; frame a frame con backends exportados).
+
+        Args:
+            frames (list[numpy.ndarray]): Frames BGR del lote.
+
+        Returns:
+            list[Results or FrameDetections]: Resultados de detección por frame, en el mismo orden.
+        """
+        if not frames: return []
+        if self.cascade_enabled: return self._detect_batch_cascade(frames)
+        with self._model_lock:
+            return self._predict(frames, conf=self.min_global_conf, imgsz=self.imgsz)
+
+    def _detect_batch_cached(self, frames, session_ids):
+        """
+        `detect_batch` con la caché persistente: los frames de sesiones con caché cuyo contenido ya se
+        detectó se sirven desde disco y solo el resto pasa por el modelo (en un único lote).
+        """
+        with self._sessions_lock:
+            recorders = [self._cache_recorders.get(session_id) for session_id in session_ids] if self._cache_recorders else []
+        if not any(recorders): return self.detect_batch(frames)
+
+        results, frame_hashes, missing = [None] * len(frames), [None] * len(frames), []
+        for i, (frame, recorder) in enumerate(zip(frames, recorders)):
+            entry = None
+            if recorder is not None:
+                frame_hashes[i] = hash_frame(frame)
+                entry = recorder.lookup(frame_hashes[i])
+            if entry is None: missing.append(i)
+            else: results[i] = DetectionCache.to_detections(frame, entry, self.model.names)
+        if missing:
+            for i, result in zip(missing, self.detect_batch([frames[i] for i in missing])): results[i] = result
+        for i, recorder in enumerate(recorders): # En orden de frame (el primero da nombre al archivo del trabajo)
+            if recorder is not None: recorder.record(frame_hashes[i], *DetectionCache.to_arrays(results[i]))
+        return results
+
+    def _tire_crop_window(self, v_box, frame_shape):
+        """Ventana entera (x1, y1, x2, y2) del frame a recortar para buscar las llantas de un vehículo."""
+        x1, y1, x2, y2 = get_tire_search_region(v_box, frame_shape, *self.tire_region_params)
+        # La región acota el centro de la llanta: el margen deja entrar la llanta completa
+        margin = (v_box[3] - v_box[1]) * self.cascade_crop_margin
+        fh, fw = frame_shape[:2]
+        return (max(0, math.floor(x1 - margin)), max(0, math.floor(y1 - margin)),
+                min(fw, math.ceil(x2 + margin)), min(fh, math.ceil(y2 + margin)))
+
+    def _detect_batch_cascade(self, frames):
+        """
+        Detección en dos etapas de un lote de frames:
+          1. Vehículos en los frames completos a `cascade.vehicle_imgsz` (baja resolución).
+          2. Llantas en los recortes a resolución original de la región inferior de cada vehículo
+             (la misma que usa `TireCounterLogic` para asociar llantas), a `cascade.tire_imgsz`.
+        Las llantas se trasladan a coordenadas del frame y se suprimen duplicados entre recortes solapados.
+
+        Returns:
+            list[FrameDetections]: Vehículos y llantas de cada frame, en coordenadas del frame.
+        """
+        with self._model_lock:
+            vehicle_results = self._predict(frames, conf=self.min_global_conf, imgsz=self.cascade_vehicle_imgsz,
+                                            classes=self.vehicle_class_ids)
+        crops, crop_origins = [], [] # crop_origins: (índice de frame, x0, y0)
+        for frame_pos, (frame, result) in enumerate(zip(frames, vehicle_results)):
+            for v_box in result.boxes.xyxy.cpu().numpy():
+                x1, y1, x2, y2 = self._tire_crop_window(v_box, frame.shape)
+                if x2 - x1 < 2 or y2 - y1 < 2: continue
+                crops.append(frame[y1:y2, x1:x2])
+                crop_origins.append((frame_pos, x1, y1))
+
+        tires_per_frame = [[] for _ in frames] # (xyxy, conf) por frame
+        if crops:
+            with self._model_lock:
+                tire_results = self._predict(crops, conf=self.min_global_conf, imgsz=self.cascade_tire_imgsz,
+                                             classes=[self.tire_class_id])
+            for (frame_pos, x0, y0), result in zip(crop_origins, tire_results):
+                xyxy = result.boxes.xyxy.cpu().numpy() + np.array([x0, y0, x0, y0], dtype=np.float32)
+                tires_per_frame[frame_pos].extend(zip(xyxy, result.boxes.conf.cpu().numpy()))
+
+        merged = []
+        for frame, result, tires in zip(frames, vehicle_results, tires_per_frame):
+            xyxy = [result.boxes.xyxy.cpu().numpy()]
+            conf = [result.boxes.conf.cpu().numpy()]
+            cls = [result.boxes.cls.cpu().numpy()]
+            if tires:
+                tire_xyxy = np.array([box for box, _ in tires], dtype=np.float32)
+                tire_conf = np.array([score for _, score in tires], dtype=np.float32)
+                keep = self._nms_indices(tire_xyxy, tire_conf)
+                xyxy.append(tire_xyxy[keep]); conf.append(tire_conf[keep]); cls.append(np.full(len(keep), self.tire_class_id, dtype=np.float32))
+            merged.append(FrameDetections(frame, np.concatenate(xyxy), np.concatenate(conf), np.concatenate(cls),
+                                          names=result.names, orig_shape=frame.shape[:2]))
+        return merged
+
+    def _nms_indices(self, xyxy, scores):
+        """Índices de las llantas que sobreviven a la supresión de no máximos (recortes solapados)."""
+        xywh = np.column_stack([xyxy[:, 0], xyxy[:, 1], xyxy[:, 2] - xyxy[:, 0], xyxy[:, 3] - xyxy[:, 1]])
+        keep = cv2.dnn.NMSBoxes(xywh.tolist(), scores.tolist(), 0.0, self.cascade_nms_iou)
+        return np.array(keep, dtype=int).reshape(-1)
+
+    def track_batch(self, frames, session_id, original_shapes=None, roi=None):
+        """
+        Detecta un lote de frames en bloque y luego aplica el tracking frame a frame, en orden.
+        Devuelve los mismos IDs/clases/cajas/confianzas que `track_objects` frame a frame.
+
+        Args:
+            frames (list[numpy.ndarray]): Frames del lote, en orden temporal.
+            session_id (str): Sesión de tracking del trabajo/stream.
+            original_shapes (list[tuple], optional): Shapes originales por frame (decodificación reducida).
+            roi (RegionOfInterest, optional): Región de interés de la fuente (recorte previo a la inferencia).
+
+        Returns:
+            list[FrameDetections or None]: Resultados con IDs de tracking por frame.
+        """
+        return self.track_batch_sessions(frames, [session_id] * len(frames), original_shapes,
+                                         rois=[roi] * len(frames) if roi is not None else None)
+
+    def track_batch_sessions(self, frames, session_ids, original_shapes=None, rois=None):
+        """
+        Detecta en un solo lote frames que pueden pertenecer a sesiones distintas (p. ej. el último
+        frame de cada cámara) y aplica a cada frame el tracking de su sesión, en el orden del lote.
+
+        Args:
+            frames (list[numpy.ndarray]): Frames del lote.
+            session_ids (list[str]): Sesión de tracking de cada frame.
+            original_shapes (list[tuple], optional): Shapes originales por frame (decodificación reducida).
+            rois (list[RegionOfInterest or None], optional): Región de interés de cada frame. Se detecta y
+                                                             trackea sobre el recorte y las cajas vuelven a
+                                                             coordenadas del frame original.
+
+        Returns:
+            list[FrameDetections or None]: Resultados con IDs de tracking por frame.
+        """
+        frame_trackers = [self._get_tracker_session(session_id) for session_id in session_ids]
+        rois = rois or [None] * len(frames)
+        original_shapes = original_shapes or [None] * len(frames)
+        input_frames = [roi.apply(frame, original_shape) if roi is not None else frame
+                        for frame, original_shape, roi in zip(frames, original_shapes, rois)]
+        try:
+            detection_results = self._detect_batch_cached(input_frames, session_ids)
+        except Exception as e:
+            print(f"Error durante model.predict() en lote: {e}")
+            return [None] * len(frames)
+        tracked = []
+        for frame, original_shape, roi, result, frame_tracker in zip(frames, original_shapes, rois, detection_results, frame_trackers):
+            if roi is not None:
+                tracked.append(roi.map_result(frame_tracker.update(result), frame, original_shape))
+            else:
+                tracked.append(self._map_to_original_shape(frame_tracker.update(result), original_shape))
+        return tracked
+
+    def iter_tracked_frames(self, frame_source, batch_size=1, session_id=None, sampler=None, roi=None):
+        """
+        Recorre una fuente de frames y genera sus resultados de tracking, en orden.
+        Con `batch_size > 1` y una sesión de tracking, agrupa los frames en lotes para la
+        detección (`track_batch`); si no, usa `track_objects` frame a frame.
+
+        Args:
+            frame_source (iterable): Pares (frame, original_shape) en orden temporal.
+            batch_size (int, optional): Tamaño de lote para la detección. Defaults to 1.
+            session_id (str, optional): Sesión de tracking del trabajo (requerida para lotes).
+            sampler (AdaptiveFrameSampler, optional): Compuerta de muestreo. Los frames que descarta
+                                                      no se infieren y reciben las detecciones del último
+                                                      frame inferido.
+            roi (RegionOfInterest, optional): Región de interés de la fuente (recorte previo a la inferencia).
+
+        Yields:
+            tuple: (frame, original_shape, resultados) por cada frame de la fuente.
+        """
+        use_batches = batch_size > 1 and session_id is not None
+        batch = []
+        for frame, original_shape in frame_source:
+            if sampler is not None and not sampler.should_infer(frame):
+                # El frame reutiliza el resultado anterior: primero hay que resolver el lote pendiente
+                if batch: yield from self._track_batch_items(batch, session_id, sampler, roi)
+                batch = []
+                yield frame, original_shape, sampler.reuse_result(frame)
+                continue
+            if not use_batches:
+                result = self.track_objects(frame.copy(), original_shape=original_shape, session_id=session_id, roi=roi)
+                if sampler is not None: sampler.observe(result)
+                yield frame, original_shape, result
+                continue
+            batch.append((frame, original_shape))
+            if len(batch) < batch_size: continue
+            yield from self._track_batch_items(batch, session_id, sampler, roi)
+            batch = []
+        if batch: yield from self._track_batch_items(batch, session_id, sampler, roi)
+
+    def _track_batch_items(self, batch, session_id, sampler=None, roi=None):
+        frames = [frame for frame, _ in batch]
+        original_shapes = [original_shape for _, original_shape in batch]
+        for (frame, original_shape), result in zip(batch, self.track_batch(frames, session_id, original_shapes, roi=roi)):
+            if sampler is not None: sampler.observe(result)
+            yield frame, original_shape, result
@@ -0,0 +1,138 @@
+# frame_sampling.py
+from collections import deque
+
+import cv2
+import numpy as np
+
+from detections import FrameDetections
+
+class AdaptiveFrameSampler:
+    """
+    Compuerta previa a la inferencia para secuencias con muchos frames casi idénticos
+    (camión detenido en la barrera, cámara disparando por temporizador).
+
+    Por cada frame decide si se ejecuta el detector o se reutilizan las detecciones del último
+    frame inferido:
+      * Frames estáticos: se compara una miniatura en escala de grises del frame con la del último
+        frame inferido; si la fracción de píxeles que cambian es mínima, se salta la inferencia.
+      * Paso (stride) adaptativo: tras cada inferencia se mide el desplazamiento por frame de los
+        vehículos (mismo track ID) y se detecta cada N frames, con N tal que ningún vehículo se
+        mueva más de `max_displacement_per_inference` (fracción de la diagonal) entre inferencias.
+        Si aparece o desaparece un vehículo, N vuelve a 1.
+    Nunca se encadenan más de `max_consecutive_skips` frames sin inferir.
+    """
+    def __init__(self, config, vehicle_class_ids=None):
+        """
+        Args:
+            config (AppConfig): Configuración (sección 'processing.frame_sampling').
+            vehicle_class_ids (list[int], optional): Clases de vehículo para medir el movimiento.
+                                                     Por defecto, las de la configuración.
+        """
+        self.thumbnail_width = int(config.get('processing.frame_sampling.thumbnail_width', 64))
+        self.pixel_diff_threshold = config.get('processing.frame_sampling.pixel_diff_threshold', 12)
+        self.static_changed_fraction = config.get('processing.frame_sampling.static_changed_fraction', 0.005)
+        self.adaptive_stride = config.get('processing.frame_sampling.adaptive_stride', True)
+        self.max_stride = max(1, int(config.get('processing.frame_sampling.max_stride', 4)))
+        self.max_displacement_per_inference = config.get('processing.frame_sampling.max_displacement_per_inference', 0.02)
+        self.max_consecutive_skips = max(0, int(config.get('processing.frame_sampling.max_consecutive_skips', 15)))
+        self.vehicle_class_ids = set(vehicle_class_ids if vehicle_class_ids is not None else config.vehicle_class_ids)
+        self.reset()
+
+    def reset(self):
+        """Reinicia el estado y las estadísticas (al empezar un trabajo)."""
+        self.stride = 1
+        self._reference_thumbnail = None # Miniatura del último frame enviado a inferencia
+        self._frames_since_inference = 0
+        self._last_result = None
+        self._last_vehicle_centers = None # track_id -> centro (x, y) en la última inferencia observada
+        self._pending_gaps = deque() # Frames de la fuente entre cada inferencia decidida y la anterior (aún sin observar)
+        self.frames_total = 0
+        self.frames_inferred = 0
+        self.frames_skipped_static = 0
+        self.frames_skipped_stride = 0
+        self.stride_histogram = {}
+
+    def _thumbnail(self, frame):
+        h, w = frame.shape[:2]
+        thumb_w = min(self.thumbnail_width, w)
+        thumb_h = max(1, round(h * thumb_w / w))
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        return cv2.resize(gray, (thumb_w, thumb_h), interpolation=cv2.INTER_AREA)
+
+    def should_infer(self, frame):
+        """
+        Decide si el frame debe pasar por el detector. Si devuelve False, el llamador debe usar
+        `reuse_result(frame)` como resultado del frame.
+        """
+        self.frames_total += 1
+        thumbnail = self._thumbnail(frame)
+        skip_reason = None
+        if self._reference_thumbnail is not None and self._last_result is not None \
+                and self._frames_since_inference < self.max_consecutive_skips \
+                and thumbnail.shape == self._reference_thumbnail.shape:
+            diff = cv2.absdiff(thumbnail, self._reference_thumbnail)
+            changed_fraction = np.count_nonzero(diff > self.pixel_diff_threshold) / diff.size
+            if changed_fraction < self.static_changed_fraction: skip_reason = "static"
+            elif self._frames_since_inference + 1 < self.stride: skip_reason = "stride"
+
+        if skip_reason == "static": self.frames_skipped_static += 1
+        elif skip_reason == "stride": self.frames_skipped_stride += 1
+        if skip_reason:
+            self._frames_since_inference += 1
+            return False
+        self._reference_thumbnail = thumbnail
+        self._pending_gaps.append(self._frames_since_inference + 1)
+        self._frames_since_inference = 0
+        self.frames_inferred += 1
+        self.stride_histogram[self.stride] = self.stride_histogram.get(self.stride, 0) + 1
+        return True
+
+    def observe(self, result):
+        """
+        Registra el resultado de un frame inferido (en el mismo orden en que `should_infer` los
+        aceptó) y ajusta el paso según el desplazamiento de los vehículos desde la inferencia anterior.
+
+        Args:
+            result (Results or FrameDetections or None): Resultado del detector para el frame.
+        """
+        frames_elapsed = self._pending_gaps.popleft() if self._pending_gaps else 1
+        self._last_result = result
+        centers, diagonal = self._vehicle_centers(result)
+        previous_centers, self._last_vehicle_centers = self._last_vehicle_centers, centers
+        if not self.adaptive_stride: return
+        if previous_centers is None or centers is None or set(centers) != set(previous_centers) or not centers:
+            self.stride = 1 # Vehículos que entran/salen (o sin referencia): máxima frecuencia de detección
+            return
+        max_motion = max((np.hypot(*(centers[t_id] - previous_centers[t_id])) / diagonal for t_id in centers), default=0.0)
+        motion_per_frame = max_motion / frames_elapsed
+        if motion_per_frame <= 0: self.stride = self.max_stride
+        else: self.stride = int(np.clip(self.max_displacement_per_inference // motion_per_frame, 1, self.max_stride))
+
+    def _vehicle_centers(self, result):
+        """Centros de los vehículos con track ID del resultado, y diagonal del frame."""
+        if result is None or result.boxes is None or result.boxes.id is None: return None, None
+        xyxy = result.boxes.xyxy.cpu().numpy()
+        class_ids = result.boxes.cls.cpu().numpy().astype(int)
+        track_ids = result.boxes.id.cpu().numpy().astype(int)
+        centers = {int(t_id): np.array([(box[0] + box[2]) / 2, (box[1] + box[3]) / 2])
+                   for box, c_id, t_id in zip(xyxy, class_ids, track_ids) if c_id in self.vehicle_class_ids}
+        h, w = result.orig_shape[:2]
+        return centers, float(np.hypot(h, w))
+
+    def reuse_result(self, frame):
+        """Detecciones del último frame inferido, asociadas al frame actual (para dibujar sobre él)."""
+        if self._last_result is None: return None
+        return FrameDetections.from_yolo_results(self._last_result, orig_img=frame, orig_shape=self._last_result.orig_shape)
+
+    def get_stats(self):
+        """Frames totales, inferidos y saltados (por estático y por paso) y uso de cada paso."""
+        skipped = self.frames_skipped_static + self.frames_skipped_stride
+        return {
+            "frames_total": self.frames_total,
+            "frames_inferred": self.frames_inferred,
+            "frames_skipped": skipped,
+            "frames_skipped_static": self.frames_skipped_static,
+            "frames_skipped_stride": self.frames_skipped_stride,
+            "skipped_fraction": round(skipped / self.frames_total, 3) if self.frames_total else 0.0,
+            "inferences_per_stride": dict(sorted(self.stride_histogram.items())),
+        }
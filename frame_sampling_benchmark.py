@@ -0,0 +1,82 @@
+# frame_sampling_benchmark.py
+"""
+Mide el efecto del muestreo adaptativo de frames (`processing.frame_sampling`) sobre secuencias
+de muestra de la instalación: procesa cada trabajo con y sin muestreo y compara frames inferidos,
+tiempo total y el resultado final (clase del vehículo principal y conteo de llantas).
+
+Uso:
+    python frame_sampling_benchmark.py --jobs D:/muestras/camion1 D:/muestras/camion2 --type image_folder
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+from config_loader import AppConfig
+from detector import ObjectDetector
+from frame_sampling import AdaptiveFrameSampler
+from input_handler import JobInputController
+from job_processing import iter_job_frames
+from tracker_logic import TireCounterLogic
+
+def _run_job(job_type, job_path, cfg, detector, tire_counter, sampler):
+    """Procesa un trabajo sin video ni envío. Devuelve (payload final, segundos, frames inferidos)."""
+    job_name = Path(job_path).name
+    job_input_ctrl = JobInputController(job_type, job_path, cfg)
+    tire_counter.reset_state_for_new_job()
+    session_id = detector.create_tracker_session(job_name)
+    frames = 0
+    t0 = time.perf_counter()
+    try:
+        for _, original_shape, yolo_results in detector.iter_tracked_frames(
+                iter_job_frames(job_input_ctrl), session_id=session_id, sampler=sampler):
+            frames += 1
+            tire_counter.process_job_detections(yolo_results, frames, original_shape)
+        payload = tire_counter.finalize_job_and_prepare_payload(job_source_name=job_name)
+    finally:
+        job_input_ctrl.release()
+        detector.destroy_tracker_session(session_id)
+    elapsed = time.perf_counter() - t0
+    return payload, elapsed, sampler.frames_inferred if sampler else frames
+
+def main():
+    parser = argparse.ArgumentParser(description="Efecto del muestreo adaptativo de frames en el conteo de llantas.")
+    parser.add_argument("--jobs", nargs="+", required=True, help="Rutas de los trabajos de muestra.")
+    parser.add_argument("--type", type=str, default="image_folder", help="Tipo de fuente (image_folder, video_file).")
+    parser.add_argument("--config", type=str, default="config.yaml", help="Archivo de configuración.")
+    parser.add_argument("--output", type=str, default=None, help="Archivo JSON donde guardar el reporte.")
+    args = parser.parse_args()
+
+    cfg = AppConfig(config_path_str=args.config)
+    detector = ObjectDetector(cfg)
+    tire_counter = TireCounterLogic(cfg)
+    tire_counter.debug_mode = detector.debug_mode = False
+
+    report = []
+    print(f"{'trabajo':<30} {'frames':>7} {'inferidos':>9} {'ms base':>9} {'ms muestreo':>12} {'llantas base':>13} {'llantas muestreo':>17} {'clase igual':>12}")
+    for job_path in args.jobs:
+        base_payload, base_s, frames = _run_job(args.type, job_path, cfg, detector, tire_counter, None)
+        sampler = AdaptiveFrameSampler(cfg)
+        sampled_payload, sampled_s, inferred = _run_job(args.type, job_path, cfg, detector, tire_counter, sampler)
+        base_payload, sampled_payload = base_payload or {}, sampled_payload or {}
+        row = {"job": str(job_path), "frames": frames, "sampling": sampler.get_stats(),
+               "baseline_seconds": round(base_s, 3), "sampled_seconds": round(sampled_s, 3),
+               "baseline_tire_count": base_payload.get("tire_count"), "sampled_tire_count": sampled_payload.get("tire_count"),
+               "baseline_class": base_payload.get("vehicle_class"), "sampled_class": sampled_payload.get("vehicle_class")}
+        row["same_tire_count"] = row["baseline_tire_count"] == row["sampled_tire_count"]
+        row["same_class"] = row["baseline_class"] == row["sampled_class"]
+        report.append(row)
+        print(f"{Path(job_path).name[:30]:<30} {frames:>7} {inferred:>9} {base_s * 1000:>9.0f} {sampled_s * 1000:>12.0f} "
+              f"{str(row['baseline_tire_count']):>13} {str(row['sampled_tire_count']):>17} {str(row['same_class']):>12}")
+
+    if report:
+        total_frames = sum(r["sampling"]["frames_total"] for r in report)
+        total_skipped = sum(r["sampling"]["frames_skipped"] for r in report)
+        print(f"[SAMPLING_BENCH] Frames saltados: {total_skipped}/{total_frames}. "
+              f"Conteo de llantas igual en {sum(r['same_tire_count'] for r in report)}/{len(report)} trabajos.")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: json.dump(report, f, indent=2)
+        print(f"[SAMPLING_BENCH] Reporte guardado en: {args.output}")
+
+if __name__ == '__main__':
+    main()
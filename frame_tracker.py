@@ -0,0 +1,79 @@
+# frame_tracker.py
+from ultralytics.trackers.bot_sort import BOTSORT
+from ultralytics.trackers.byte_tracker import BYTETracker
+from ultralytics.utils import IterableSimpleNamespace, yaml_load
+from ultralytics.utils.checks import check_yaml
+
+from detections import FrameDetections
+
+# Mismos trackers que usa `model.track()` internamente, según 'tracker_type' del YAML
+_TRACKER_CLASSES = {"bytetrack": BYTETracker, "botsort": BOTSORT}
+
+class FrameTracker:
+    """
+    Tracker independiente del modelo: recibe las detecciones de cada frame (en orden)
+    y les asigna IDs de tracking con el mismo algoritmo y configuración que `model.track()`
+    (ByteTrack/BoT-SORT de ultralytics, leído de `model.tracker_config_file`).
+
+    Permite separar la detección (que puede hacerse en lotes) del tracking (secuencial),
+    y mantener un estado de tracking propio por trabajo o por stream.
+    """
+    def __init__(self, tracker_config_file, frame_rate=30):
+        """
+        Args:
+            tracker_config_file (str): YAML del tracker (ej. "bytetrack.yaml").
+            frame_rate (int, optional): FPS de la fuente (ajusta el buffer de tracks perdidos). Defaults to 30.
+        """
+        self.tracker_cfg = IterableSimpleNamespace(**yaml_load(check_yaml(tracker_config_file)))
+        if self.tracker_cfg.tracker_type not in _TRACKER_CLASSES:
+            raise ValueError(f"Tracker no soportado: '{self.tracker_cfg.tracker_type}'. Opciones: {list(_TRACKER_CLASSES)}")
+        self.frame_rate = frame_rate
+        self.tracker = None
+        self.reset()
+
+    def _next_local_id(self):
+        """Contador de IDs propio de este tracker (el de ultralytics es global a nivel de clase)."""
+        self._last_track_id += 1
+        return self._last_track_id
+
+    def _create_tracker(self):
+        tracker = _TRACKER_CLASSES[self.tracker_cfg.tracker_type](args=self.tracker_cfg, frame_rate=self.frame_rate)
+        # Los STrack toman su ID de `BaseTrack.next_id()`, un contador compartido por todos los trackers
+        # del proceso. Se sustituye por el contador local para que cada sesión numere sus tracks sin
+        # interferir con las demás (y sin que un reset ajeno provoque IDs repetidos).
+        original_init_track = tracker.init_track
+        def init_track_with_local_ids(*args, **kwargs):
+            new_tracks = original_init_track(*args, **kwargs)
+            for track in new_tracks: track.next_id = self._next_local_id
+            return new_tracks
+        tracker.init_track = init_track_with_local_ids
+        return tracker
+
+    def update(self, detection_result):
+        """
+        Asocia las detecciones de un frame con los tracks existentes.
+        Replica el post-procesado de `model.track()`: si no hay detecciones o ningún track
+        confirmado, el resultado queda sin IDs (y `TireCounterLogic` lo ignora).
+
+        Args:
+            detection_result (Results or FrameDetections): Detecciones (sin IDs) del frame.
+
+        Returns:
+            FrameDetections: Detecciones del frame con IDs de tracking.
+        """
+        detections = FrameDetections.from_yolo_results(detection_result)
+        if len(detections) == 0: return detections
+
+        # El tracker de ultralytics consume Boxes en NumPy (xyxy / xywh / conf / cls)
+        tracks = self.tracker.update(detection_result.boxes.cpu().numpy(), detection_result.orig_img)
+        if len(tracks) == 0: return detections
+
+        # Columnas de tracks: x1, y1, x2, y2, track_id, score, cls, idx
+        return FrameDetections(detection_result.orig_img, tracks[:, :4], tracks[:, 5], tracks[:, 6],
+                               track_ids=tracks[:, 4], names=detection_result.names,
+                               orig_shape=detections.orig_shape)
+
+    def reset(self):
+        """Reinicia el estado del tracker (tracks activos, perdidos y contador de IDs)."""
+        self._last_track_id = 0
+        self.tracker = self._create_tracker()
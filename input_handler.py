@@ -3,7 +3,252 @@ from pathlib import Path
 import glob
 import os
 import shutil
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Flags de OpenCV para decodificar directamente a escala reducida (1/2, 1/4, 1/8).
+# En JPEG la reducción se hace en el dominio DCT, sin decodificar todos los píxeles.
+_REDUCED_DECODE_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+def read_image_size(image_path_str):
+    """
+    Lee el tamaño (ancho, alto) de una imagen JPEG o PNG a partir de su cabecera,
+    sin decodificar los píxeles.
+
+    Args:
+        image_path_str (str): Ruta de la imagen.
+
+    Returns:
+        tuple or None: (ancho, alto), o None si el formato no se reconoce.
+    """
+    try:
+        with open(image_path_str, 'rb') as f:
+            head = f.read(24)
+            if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+                return int.from_bytes(head[16:20], 'big'), int.from_bytes(head[20:24], 'big')
+            if head[:2] != b'\xff\xd8': return None
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF: return None
+                if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7: continue # Marcadores sin longitud
+                segment_len = int.from_bytes(f.read(2), 'big')
+                # SOF0..SOF15 (excepto DHT=C4, JPG=C8, DAC=CC) contienen las dimensiones
+                if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                    sof = f.read(5)
+                    return int.from_bytes(sof[3:5], 'big'), int.from_bytes(sof[1:3], 'big')
+                f.seek(segment_len - 2, 1)
+    except OSError:
+        return None
+
+def choose_reduced_decode_scale(image_size, model_input_size):
+    """
+    Elige el mayor factor de reducción (8, 4 o 2) cuyo lado mayor decodificado
+    siga cubriendo el tamaño de entrada del modelo. Devuelve 1 si ninguno sirve.
+
+    Args:
+        image_size (tuple or None): (ancho, alto) original de la imagen.
+        model_input_size (int): Lado de entrada del modelo (imgsz de YOLO).
+    """
+    if not image_size or model_input_size <= 0: return 1
+    max_side = max(image_size)
+    for factor in (8, 4, 2):
+        if -(-max_side // factor) >= model_input_size: # ceil, igual que IMREAD_REDUCED_*
+            return factor
+    return 1
+
+class PrefetchingImageReader:
+    """
+    Lector de secuencias de imágenes que decodifica por adelantado los próximos N archivos
+    en un pool de hilos (cv2.imread libera el GIL durante la E/S y la decodificación).
+    Entrega los frames estrictamente en el orden de la lista y nunca mantiene más de
+    `read_ahead` frames decodificados (o en decodificación) a la vez.
+    """
+    def __init__(self, image_paths, decode_fn, num_workers=4, read_ahead=8):
+        """
+        Args:
+            image_paths (list[str]): Rutas de las imágenes, en orden de procesamiento.
+            decode_fn (callable): Función ruta -> numpy.ndarray (o None si falla la lectura).
+            num_workers (int, optional): Hilos de decodificación. Defaults to 4.
+            read_ahead (int, optional): Máximo de frames adelantados en memoria. Defaults to 8.
+        """
+        self.image_paths = list(image_paths)
+        self.decode_fn = decode_fn
+        self.read_ahead = max(1, int(read_ahead))
+        self.executor = ThreadPoolExecutor(max_workers=max(1, int(num_workers)), thread_name_prefix="img_prefetch")
+        self.pending = deque() # (ruta, future) en orden de la secuencia
+        self.next_submit_idx = 0
+        self._fill()
+
+    def _fill(self):
+        """Lanza decodificaciones hasta completar la ventana de lectura adelantada."""
+        while len(self.pending) < self.read_ahead and self.next_submit_idx < len(self.image_paths):
+            path = self.image_paths[self.next_submit_idx]
+            self.pending.append((path, self.executor.submit(self.decode_fn, path)))
+            self.next_submit_idx += 1
+
+    def next(self):
+        """
+        Devuelve el siguiente frame de la secuencia.
+
+        Returns:
+            tuple or None: (ruta, frame) donde frame puede ser None si la imagen no se pudo leer;
+                           None cuando la secuencia se ha agotado.
+        """
+        if not self.pending: return None
+        path, future = self.pending.popleft()
+        try:
+            frame = future.result()
+        except Exception as e:
+            print(f"Advertencia [PREFETCH]: Error decodificando '{path}': {e}")
+            frame = None
+        self._fill() # Reponer la ventana tras liberar un hueco
+        return path, frame
+
+    def close(self):
+        """Cancela las lecturas pendientes y detiene el pool."""
+        for _, future in self.pending: future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=False)
+
+def _open_video_capture(url, open_timeout_ms=0, read_timeout_ms=0):
+    """Abre un VideoCapture con buffer mínimo y, si el backend lo soporta, timeouts de apertura/lectura."""
+    params = []
+    if open_timeout_ms and hasattr(cv2, "CAP_PROP_OPEN_TIMEOUT_MSEC"): params += [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(open_timeout_ms)]
+    if read_timeout_ms and hasattr(cv2, "CAP_PROP_READ_TIMEOUT_MSEC"): params += [cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(read_timeout_ms)]
+    cap = cv2.VideoCapture(url, cv2.CAP_ANY, params) if params else cv2.VideoCapture(url)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1) # Ignorado por algunos backends; el hilo de captura cubre el resto
+    return cap
+
+class LatestFrameGrabber:
+    """
+    Captura RTSP de baja latencia: un hilo dedicado lee el stream sin pausa y conserva solo el
+    frame más reciente, de modo que el consumidor nunca procesa frames acumulados en el buffer del
+    decodificador. Los frames sustituidos antes de ser leídos se cuentan como saltados.
+    Si el stream se corta, reconecta con espera exponencial (backoff) sin que el consumidor falle.
+    """
+    def __init__(self, url, reconnect_initial_delay=1.0, reconnect_max_delay=30.0, max_reconnect_attempts=0,
+                 open_timeout_ms=10000, read_timeout_ms=10000, debug_mode=False):
+        """
+        Args:
+            url (str): URL del stream (o ruta de video).
+            reconnect_initial_delay (float, optional): Espera antes del primer reintento (s).
+            reconnect_max_delay (float, optional): Espera máxima entre reintentos (s).
+            max_reconnect_attempts (int, optional): Reintentos seguidos antes de abandonar (0 = sin límite).
+            open_timeout_ms, read_timeout_ms (int, optional): Timeouts del backend de captura (si los soporta).
+            debug_mode (bool, optional): Si es True, imprime mensajes de depuración.
+        """
+        self.url = url
+        self.reconnect_initial_delay = reconnect_initial_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.open_timeout_ms = open_timeout_ms
+        self.read_timeout_ms = read_timeout_ms
+        self.debug_mode = debug_mode
+
+        self.cap = None
+        self._condition = threading.Condition()
+        self._latest_frame = None
+        self._latest_seq = 0 # Secuencia del último frame capturado
+        self._served_seq = 0 # Secuencia del último frame entregado al consumidor
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.ended = False # Se agotaron los reintentos (o se cerró el grabber)
+
+        self.frames_grabbed = 0
+        self.frames_skipped = 0
+        self.reconnects = 0
+        self.last_frame_time = None
+
+    def start(self):
+        """Abre el stream (falla con ConnectionError si no es posible) y arranca el hilo de captura."""
+        self.cap = _open_video_capture(self.url, self.open_timeout_ms, self.read_timeout_ms)
+        if not self.cap.isOpened():
+            self.cap.release()
+            raise ConnectionError(f"No se pudo abrir video: {self.url}")
+        self._thread = threading.Thread(target=self._grab_loop, name="rtsp_grabber", daemon=True)
+        self._thread.start()
+
+    def _grab_loop(self):
+        failed_attempts = 0 # Reintentos seguidos sin recibir ningún frame (se reinicia con cada frame)
+        while not self._stop_event.is_set():
+            ret, frame = self.cap.read()
+            if not ret:
+                failed_attempts = self._reconnect(failed_attempts)
+                if failed_attempts is None: break
+                continue
+            failed_attempts = 0
+            with self._condition:
+                if self._latest_seq > self._served_seq: self.frames_skipped += 1 # El anterior no llegó a leerse
+                self._latest_frame = frame
+                self._latest_seq += 1
+                self.frames_grabbed += 1
+                self.last_frame_time = time.monotonic()
+                self._condition.notify_all()
+        with self._condition:
+            self.ended = True
+            self._condition.notify_all()
+
+    def _reconnect(self, failed_attempts):
+        """
+        Reabre el stream con backoff exponencial. Un stream que abre pero no entrega frames no
+        reinicia la espera: el contador solo vuelve a cero cuando llega un frame.
+
+        Returns:
+            int or None: Reintentos seguidos acumulados, o None si se detuvo o se agotaron los reintentos.
+        """
+        self.cap.release()
+        while not self._stop_event.is_set():
+            if self.max_reconnect_attempts and failed_attempts >= self.max_reconnect_attempts:
+                print(f"[RTSP_GRABBER] Stream '{self.url}' perdido: {failed_attempts} reintentos sin éxito.")
+                return None
+            delay = min(self.reconnect_initial_delay * (2 ** failed_attempts), self.reconnect_max_delay)
+            failed_attempts += 1
+            print(f"[RTSP_GRABBER] Stream '{self.url}' cortado. Reintento {failed_attempts} en {delay:.1f}s...")
+            if self._stop_event.wait(delay): return None
+            self.cap = _open_video_capture(self.url, self.open_timeout_ms, self.read_timeout_ms)
+            if self.cap.isOpened():
+                self.reconnects += 1
+                if self.debug_mode: print(f"[RTSP_GRABBER] Stream '{self.url}' reabierto (reconexiones: {self.reconnects}).")
+                return failed_attempts
+            self.cap.release()
+        return None
+
+    def read(self, timeout=None):
+        """
+        Devuelve el frame más reciente que aún no se haya entregado, esperando a que llegue uno.
+
+        Args:
+            timeout (float, optional): Espera máxima en segundos (None = hasta que haya frame o termine).
+
+        Returns:
+            tuple: (bool ret, numpy.ndarray frame). ret es False si el stream terminó o se agotó la espera.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._latest_seq > self._served_seq or self.ended, timeout=timeout):
+                return False, None
+            if self._latest_seq <= self._served_seq: return False, None # Terminado sin frames pendientes
+            self._served_seq = self._latest_seq
+            return True, self._latest_frame
+
+    def get_stats(self):
+        """Frames capturados y saltados, reconexiones y antigüedad (s) del último frame."""
+        with self._condition:
+            age = time.monotonic() - self.last_frame_time if self.last_frame_time else None
+            return {"frames_grabbed": self.frames_grabbed, "frames_skipped": self.frames_skipped,
+                    "reconnects": self.reconnects, "last_frame_age_seconds": round(age, 3) if age is not None else None,
+                    "ended": self.ended}
+
+    def close(self):
+        """Detiene el hilo de captura y libera el stream."""
+        self._stop_event.set()
+        with self._condition:
+            self.ended = True
+            self._condition.notify_all()
+        if self._thread: self._thread.join(timeout=max(2.0, self.read_timeout_ms / 1000.0))
+        if self.cap: self.cap.release()
 
 class JobInputController:
     """
@@ -34,8 +279,22 @@ class JobInputController:
         self.processed_suffix = self.config_app.get('source.processed_folder_suffix', '_procesado')
         self.move_to_processed_path_str = self.config_app.get('source.move_to_processed_path')
 
+        # Lectura adelantada en paralelo para secuencias de imágenes
+        self.prefetch_enabled = self.config_app.get('source.prefetch.enabled', False)
+        self.prefetch_workers = self.config_app.get('source.prefetch.num_workers', 4)
+        self.prefetch_read_ahead = self.config_app.get('source.prefetch.read_ahead', 8)
+        self.image_prefetcher = None # PrefetchingImageReader de la secuencia actual (se crea al primer read_frame)
+
+        # Decodificación a resolución reducida ajustada a la entrada del modelo (solo secuencias de imágenes)
+        self.reduced_decode_enabled = self.config_app.get('source.reduced_decode.enabled', False)
+        self.model_input_size = self.config_app.get('source.reduced_decode.model_input_size', 640)
+        self.decode_scale = 1 # Factor de reducción de la secuencia actual (1 = resolución completa)
+        self.decode_original_size = None # (ancho, alto) original de la primera imagen de la secuencia
 
         self.cap = None # Para VideoCapture de rtsp/video_file
+        # Captura de baja latencia para rtsp: hilo que sirve siempre el frame más reciente y reconecta
+        self.rtsp_low_latency = self.config_app.get('source.rtsp_capture.low_latency', False)
+        self.rtsp_grabber = None # LatestFrameGrabber si rtsp_low_latency
         self.current_job_image_files = [] # Lista de archivos para image_file/image_folder/secuencia de watch_folder
         self.current_job_image_idx = 0 # Índice para iterar sobre current_job_image_files
 
@@ -56,7 +315,19 @@ class JobInputController:
         if self.job_source_path is None and self.job_source_type not in ["watch_folder"]:
              raise ValueError(f"Error: job_source_path es None para el tipo '{self.job_source_type}'.")
 
-        if self.job_source_type in ["rtsp", "video_file"]:
+        if self.job_source_type == "rtsp" and self.rtsp_low_latency:
+            if not self.job_source_path: raise ValueError(f"Ruta vacía para {self.job_source_type}")
+            self.rtsp_grabber = LatestFrameGrabber(
+                self.job_source_path,
+                reconnect_initial_delay=self.config_app.get('source.rtsp_capture.reconnect_initial_delay_seconds', 1.0),
+                reconnect_max_delay=self.config_app.get('source.rtsp_capture.reconnect_max_delay_seconds', 30.0),
+                max_reconnect_attempts=self.config_app.get('source.rtsp_capture.max_reconnect_attempts', 0),
+                open_timeout_ms=self.config_app.get('source.rtsp_capture.open_timeout_ms', 10000),
+                read_timeout_ms=self.config_app.get('source.rtsp_capture.read_timeout_ms', 10000),
+                debug_mode=self.debug_mode)
+            self.rtsp_grabber.start()
+            if self.debug_mode: print(f"  Stream RTSP '{self.job_source_path}' abierto (captura de baja latencia).")
+        elif self.job_source_type in ["rtsp", "video_file"]:
             if not self.job_source_path: raise ValueError(f"Ruta vacía para {self.job_source_type}")
             self.cap = cv2.VideoCapture(self.job_source_path)
             if not self.cap.isOpened(): raise ConnectionError(f"No se pudo abrir video: {self.job_source_path}")
@@ -66,6 +337,7 @@ class JobInputController:
                 raise FileNotFoundError(f"Archivo de imagen no encontrado: {self.job_source_path}")
             self.current_job_image_files = [self.job_source_path]
             if self.debug_mode: print(f"  Fuente de imagen individual: {self.job_source_path}")
+            self._select_decode_scale()
         elif self.job_source_type == "image_folder":
             folder_path = Path(self.job_source_path)
             if not folder_path.is_dir(): raise NotADirectoryError(f"Carpeta no encontrada: {self.job_source_path}")
@@ -73,6 +345,7 @@ class JobInputController:
             if not self.current_job_image_files: raise FileNotFoundError(f"No imágenes en carpeta: {self.job_source_path}")
             if self.debug_mode: print(f"  Cargadas {len(self.current_job_image_files)} imágenes para trabajo desde: {self.job_source_path}")
             self.current_processing_folder_path = folder_path
+            self._select_decode_scale()
         elif self.job_source_type == "watch_folder":
             if not self.watch_folder_path_str or not Path(self.watch_folder_path_str).is_dir():
                 raise NotADirectoryError(f"Carpeta a monitorear no encontrada: {self.watch_folder_path_str}")
@@ -101,6 +374,8 @@ class JobInputController:
                     self.current_processing_folder_path = item
                     self.current_job_image_files = [str(p) for p in image_files]
                     self.current_job_image_idx = 0
+                    self._close_image_prefetcher() # La lectura adelantada era de la secuencia anterior
+                    self._select_decode_scale()
                     self.reset_payload_frames() # <--- Resetear frames para la nueva secuencia
                     return True # Nueva secuencia lista
         return False # No hay nuevas secuencias
@@ -124,13 +399,22 @@ class JobInputController:
 
         # Determinar el tipo de fuente para la lectura actual
         # Si es watch_folder, pero ya se cargó una secuencia, opera como image_folder
-        if self.job_source_type in ["rtsp", "video_file"]:
+        if self.rtsp_grabber:
+            ret, frame = self.rtsp_grabber.read()
+        elif self.job_source_type in ["rtsp", "video_file"]:
             if self.cap: ret, frame = self.cap.read()
         elif self.job_source_type in ["image_file", "image_folder", "watch_folder"]:
             if self.current_job_image_idx < len(self.current_job_image_files):
-                image_path_str = self.current_job_image_files[self.current_job_image_idx]
+                if self.prefetch_enabled:
+                    if self.image_prefetcher is None:
+                        self.image_prefetcher = PrefetchingImageReader(
+                            self.current_job_image_files[self.current_job_image_idx:], self._decode_image,
+                            num_workers=self.prefetch_workers, read_ahead=self.prefetch_read_ahead)
+                    image_path_str, frame = self.image_prefetcher.next()
+                else:
+                    image_path_str = self.current_job_image_files[self.current_job_image_idx]
+                    frame = self._decode_image(image_path_str)
                 current_file_name_for_api = str(Path(image_path_str).name)
-                frame = cv2.imread(image_path_str)
                 self.current_job_image_idx += 1
                 if frame is not None:
                     ret = True
@@ -146,6 +430,45 @@ class JobInputController:
 
         return ret, frame, current_file_name_for_api
     
+    def _select_decode_scale(self):
+        """Fija el factor de decodificación reducida para la secuencia actual (a partir de su primera imagen)."""
+        self.decode_scale, self.decode_original_size = 1, None
+        if not self.reduced_decode_enabled or not self.current_job_image_files: return
+        self.decode_original_size = read_image_size(self.current_job_image_files[0])
+        self.decode_scale = choose_reduced_decode_scale(self.decode_original_size, self.model_input_size)
+        if self.debug_mode: print(f"[JOB_INPUT] Decodificación reducida: tamaño original {self.decode_original_size}, escala 1/{self.decode_scale}")
+
+    def _decode_image(self, image_path_str):
+        """Decodifica una imagen de la secuencia desde disco (a escala reducida si está activado)."""
+        if self.decode_scale > 1:
+            return cv2.imread(image_path_str, _REDUCED_DECODE_FLAGS[self.decode_scale])
+        return cv2.imread(image_path_str)
+
+    def get_original_frame_shape(self, frame):
+        """
+        Devuelve el shape del frame en resolución original. Si la secuencia se decodifica
+        a escala reducida, las coordenadas de las detecciones deben expresarse en este espacio.
+
+        Args:
+            frame (numpy.ndarray): Frame devuelto por `read_frame`.
+
+        Returns:
+            tuple: (alto, ancho[, canales]) en resolución original.
+        """
+        if self.decode_scale == 1: return frame.shape
+        h, w = frame.shape[:2]
+        if self.decode_original_size:
+            orig_w, orig_h = self.decode_original_size
+            if -(-orig_w // self.decode_scale) == w and -(-orig_h // self.decode_scale) == h:
+                return (orig_h, orig_w) + frame.shape[2:]
+        return (h * self.decode_scale, w * self.decode_scale) + frame.shape[2:]
+
+    def _close_image_prefetcher(self):
+        """Detiene la lectura adelantada de la secuencia actual, si existe."""
+        if self.image_prefetcher:
+            self.image_prefetcher.close()
+            self.image_prefetcher = None
+
     def reset_payload_frames(self):
         """Resetea los frames guardados para el payload y el contador de frames del job."""
         if self.debug_mode: print("[JOB_INPUT] Reseteando frames para payload.")
@@ -157,8 +480,17 @@ class JobInputController:
     def release(self):
         """Libera el recurso de VideoCapture si se estaba usando."""
         if self.cap: self.cap.release()
+        if self.rtsp_grabber:
+            stats = self.rtsp_grabber.get_stats()
+            self.rtsp_grabber.close()
+            if self.debug_mode: print(f"[JOB_INPUT] Captura RTSP: {stats['frames_grabbed']} frames, {stats['frames_skipped']} saltados, {stats['reconnects']} reconexiones.")
+        self._close_image_prefetcher()
         if self.debug_mode: print(f"[JOB_INPUT] Recurso de captura liberado para: {self.job_source_path}")
 
+    def get_capture_stats(self):
+        """Estadísticas de la captura de baja latencia (None si la fuente no la usa)."""
+        return self.rtsp_grabber.get_stats() if self.rtsp_grabber else None
+
     def get_current_processing_source_name(self):
         """
         Devuelve un nombre descriptivo de la fuente que se está procesando actualmente.
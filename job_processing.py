@@ -0,0 +1,255 @@
+# job_processing.py
+import cv2
+import time
+import uuid
+import base64 # Para codificar el video (transfer_mode 'base64')
+from pathlib import Path
+
+from utils import annotate_frame
+from input_handler import JobInputController
+from video_writer import IncrementalVideoWriter
+from pipeline import JobPipeline
+from frame_sampling import AdaptiveFrameSampler
+from roi import RegionOfInterest
+from stage_timing import NULL_STAGE_TIMER
+
+# Tipos de fuente offline en los que se permite la detección por lotes (processing.batch_inference)
+BATCH_INFERENCE_SOURCE_TYPES = ("image_folder", "video_file")
+# Tipos de fuente con emisión por vehículo al perder su track (processing.streaming_emission)
+STREAMING_EMISSION_SOURCE_TYPES = ("rtsp", "video_file")
+
+def iter_job_frames(job_input_ctrl, stage_timer=NULL_STAGE_TIMER):
+    """
+    Generador de frames del job: (frame, shape original) hasta agotar la fuente.
+    La shape original difiere de la del frame si hay decodificación reducida.
+    La lectura de cada frame se mide como etapa 'decode' de `stage_timer`.
+    """
+    while True:
+        with stage_timer.measure("decode"):
+            ret, frame, _ = job_input_ctrl.read_frame()
+        if not ret: return
+        yield frame, job_input_ctrl.get_original_frame_shape(frame)
+
+def send_vehicle_payloads(payloads, api_client, job_name, debug_mode=False, stage_timer=NULL_STAGE_TIMER):
+    """Envía (si hay cliente) los payloads de vehículos finalizados en modo streaming."""
+    for payload in payloads:
+        if debug_mode: print(f"  [JOB_WORKER] Vehículo '{payload['vehicle_unique_id']}' finalizado ({payload['status']}): {payload['vehicle_class']}, {payload['tire_count']} llantas.")
+        if api_client:
+            with stage_timer.measure(api_client.delivery_stage): api_client.send_vehicle_data(payload, job_source_name=job_name)
+
+def process_job(current_job, cfg, detector, tire_counter, api_client=None, stage_timer=None):
+    """
+    Procesa un trabajo completo: lectura de frames, detección/tracking, conteo de llantas,
+    video anotado y envío del resultado final al servidor externo.
+    Es independiente del hilo o proceso que lo ejecute (hilo de `main.py` o proceso del pool).
+
+    Args:
+        current_job (dict): Trabajo de la cola ({'type', 'path', 'received_at'} y, opcional, 'roi').
+        cfg (AppConfig): Instancia de configuración.
+        detector (ObjectDetector): Detector (compartido entre trabajos del mismo proceso).
+        tire_counter (TireCounterLogic): Lógica de conteo del trabajador (se resetea por job).
+        api_client (APIClient, optional): Cliente para enviar resultados (None si está deshabilitado).
+        stage_timer (StageTimer, optional): Registra la duración de cada etapa (decode, inference,
+                                            tire_logic, plot, resize, video_write, base64 y send, o
+                                            send_enqueue si el cliente envía desde un hilo aparte).
+
+    El video anotado se envía según `processing.payload_video.transfer_mode`: 'stream' cede el archivo
+    temporal a `api_client`, que lo sube como cuerpo binario (sin cargarlo entero en memoria) y lo
+    elimina; 'base64' lo incrusta en el JSON del payload final (formato anterior).
+
+    Con `processing.streaming_emission.enabled` (fuentes rtsp/video_file) no se espera al final del
+    trabajo: cada vehículo se envía en cuanto lleva `frames_to_keep_data_for_lost_tracks` frames sin
+    verse y su estado se libera; al terminar la fuente se envían los que sigan activos.
+
+    Con `processing.frame_sampling.enabled` los frames estáticos o casi duplicados no se infieren
+    (reutilizan las detecciones anteriores) y el paso de detección se adapta al movimiento de los vehículos.
+
+    La región de interés del trabajo ('roi' del payload, o `source.roi` por defecto) recorta y enmascara
+    cada frame antes de la inferencia; las cajas se devuelven en coordenadas del frame completo.
+
+    Con `processing.early_termination.enabled` (salvo en modo streaming) el trabajo deja de leer frames
+    cuando el vehículo principal ya salió y su conteo de llantas se estabilizó.
+
+    Returns:
+        dict: Resumen del trabajo ('job_name', 'frames', 'wall_seconds', 'success', 'vehicles_emitted',
+              'frames_skipped', 'terminated_early_at_frame' y, con muestreo adaptativo, 'frame_sampling').
+    """
+    t_job_start = time.perf_counter()
+    frame_idx_job = 0
+    processed_successfully = False
+    job_type, job_path = current_job['type'], current_job['path']
+    job_name = str(Path(job_path).name)
+    display_window_title = f"Procesando Job: {job_name}"
+    visualization_active_for_this_job = False
+    debug_mode = cfg.get('processing.debug_mode')
+    streaming_emission = cfg.get('processing.streaming_emission.enabled', False) and job_type in STREAMING_EMISSION_SOURCE_TYPES
+    vehicles_emitted = 0
+    sampler = AdaptiveFrameSampler(cfg) if cfg.get('processing.frame_sampling.enabled', False) else None
+    # En streaming la fuente no tiene un único vehículo principal: la terminación temprana no aplica
+    early_termination = cfg.get('processing.early_termination.enabled', False) and not streaming_emission
+    terminated_early_at_frame = None
+    stage_timer = stage_timer or NULL_STAGE_TIMER
+
+    print(f"\n[JOB_WORKER] Iniciando procesado para: '{job_name}' (Tipo: {job_type})")
+
+    # --- Preparación para Video de Salida ---
+    video_payload_config = cfg.get('processing.payload_video', {})
+    # En modo streaming no hay payload final al que adjuntar el video (y en rtsp crecería sin límite)
+    create_video_output = video_payload_config.get('include_processed_video', False) and not streaming_emission
+    output_video_writer = None
+    tracker_session_id = None
+    if create_video_output:
+        video_ext = video_payload_config.get('output_video_extension', '.mp4')
+        # Nombre seguro y único: con envío asíncrono el video de un job puede seguir pendiente cuando llega otro con el mismo nombre
+        temp_video_filename = f"temp_output_{job_name.replace(' ', '_').replace('.', '_')}_{uuid.uuid4().hex[:8]}{video_ext}"
+        output_video_writer = IncrementalVideoWriter(temp_video_filename, video_payload_config, debug_mode=debug_mode,
+                                                     stage_timer=stage_timer)
+
+    try:
+        roi = RegionOfInterest.from_spec(current_job.get('roi') or cfg.get('source.roi'))
+        if roi is not None and debug_mode: print(f"[JOB_WORKER] ROI del trabajo: {roi.to_spec()}")
+        job_input_ctrl = JobInputController(job_type, job_path, cfg)
+        tire_counter.reset_state_for_new_job() # Resetear estado para este job
+        # Tracker propio: IDs no se heredan entre jobs. La caché de detecciones solo aplica a fuentes finitas
+        tracker_session_id = detector.create_tracker_session(job_name, use_detection_cache=job_type != "rtsp")
+        processed_successfully = True # Asumir éxito hasta que se interrumpa o falle
+        use_pipeline = cfg.get('processing.pipeline.enabled', False)
+        batch_inference_enabled = cfg.get('processing.batch_inference.enabled', False)
+
+        def emit_lost_vehicles(frame_idx):
+            nonlocal vehicles_emitted
+            payloads = tire_counter.evict_lost_vehicles(frame_idx, job_name)
+            if payloads:
+                send_vehicle_payloads(payloads, api_client, job_name, debug_mode, stage_timer)
+                vehicles_emitted += len(payloads)
+        on_frame_processed = emit_lost_vehicles if streaming_emission else None
+
+        def stop_when_converged(frame_idx):
+            nonlocal terminated_early_at_frame
+            if not tire_counter.main_vehicle_converged(frame_idx): return False
+            terminated_early_at_frame = frame_idx
+            print(f"[JOB_WORKER] Terminación temprana en frame {frame_idx}: vehículo principal fuera de escena y conteo de llantas estable.")
+            return True
+        stop_condition = stop_when_converged if early_termination else None
+        if streaming_emission: print(f"[JOB_WORKER] Emisión por vehículo activa (ventana de pérdida: {tire_counter.frames_to_keep_data} frames).")
+
+        if use_pipeline:
+            # Modo pipeline: decodificación, inferencia y anotación/codificación en hilos solapados
+            job_pipeline = JobPipeline(cfg, detector, tire_counter,
+                                       video_writer=output_video_writer, display_window_title=display_window_title,
+                                       tracker_session_id=tracker_session_id,
+                                       batch_inference=batch_inference_enabled and job_type in BATCH_INFERENCE_SOURCE_TYPES,
+                                       on_frame_processed=on_frame_processed, sampler=sampler,
+                                       stop_condition=stop_condition, roi=roi, stage_timer=stage_timer)
+            try:
+                processed_successfully = job_pipeline.run(job_input_ctrl)
+            finally:
+                visualization_active_for_this_job = job_pipeline.visualization_active
+                frame_idx_job = job_pipeline.stage_stats["inference"].items
+        else:
+            batch_size = 1
+            if batch_inference_enabled and job_type in BATCH_INFERENCE_SOURCE_TYPES:
+                # Detección por lotes + tracking secuencial en la sesión del job
+                batch_size = cfg.get('processing.batch_inference.batch_size', 8)
+
+            # Bucle para procesar frames del job actual (modo serie)
+            # El tiempo de cada paso del generador es inferencia, salvo la decodificación que arrastra
+            tracked_frames = stage_timer.timed_iter(detector.iter_tracked_frames(
+                    iter_job_frames(job_input_ctrl, stage_timer), batch_size=batch_size, session_id=tracker_session_id, sampler=sampler, roi=roi),
+                "inference", excluded_seconds=lambda: stage_timer.total_seconds("decode"))
+            for frame, original_frame_shape, yolo_results in tracked_frames:
+                frame_idx_job += 1
+
+                # Lógica de conteo de llantas
+                with stage_timer.measure("tire_logic"):
+                    current_vehicle_detections_this_frame = tire_counter.process_job_detections(
+                        yolo_results, frame_idx_job, original_frame_shape
+                    )
+                if on_frame_processed: on_frame_processed(frame_idx_job)
+                stop_now = stop_condition is not None and stop_condition(frame_idx_job)
+
+                with stage_timer.measure("plot"):
+                    output_frame_for_display_and_video = annotate_frame(
+                        frame, yolo_results,
+                        current_vehicle_detections_this_frame,
+                        tire_counter.vehicle_physical_tires_current_job,
+                        cfg
+                    )
+
+                if output_video_writer: # Escribir el frame directamente en el video (sin acumular en memoria)
+                    output_video_writer.write(output_frame_for_display_and_video)
+
+                # Visualización (si está habilitada)
+                if cfg.get('processing.show_visualization_per_job'):
+                    visualization_active_for_this_job = True
+                    cv2.imshow(display_window_title, output_frame_for_display_and_video)
+                    key_press = cv2.waitKey(cfg.get('processing.visualization_wait_key',1)) & 0xFF
+                    if key_press == ord('q'):
+                        processed_successfully = False; break
+                if stop_now: break
+
+        if visualization_active_for_this_job:
+            try: cv2.destroyWindow(display_window_title)
+            except: pass
+
+        video_base64 = None
+        video_file_to_send = None
+        if output_video_writer:
+            if not processed_successfully:
+                output_video_writer.abort() # Job interrumpido: descartar video parcial
+            else:
+                temp_video_path = output_video_writer.finalize()
+                # El cliente puede imponer 'stream' (p. ej. con envío por lotes)
+                transfer_mode = api_client.video_transfer_mode if api_client else video_payload_config.get('transfer_mode', 'stream')
+                if temp_video_path and transfer_mode == 'stream':
+                    video_file_to_send = temp_video_path # Se sube desde el archivo al enviar el payload final
+                elif temp_video_path:
+                    try:
+                        with stage_timer.measure("base64"), open(temp_video_path, "rb") as video_file:
+                            video_base64 = base64.b64encode(video_file.read()).decode('utf-8')
+                        if debug_mode: print(f"    [JOB_WORKER] Video codificado a Base64 (longitud: {len(video_base64)}).")
+                    except Exception as e_b64:
+                        print(f"    [JOB_WORKER] Error codificando video a Base64: {e_b64}")
+                    output_video_writer.remove_file()
+
+        # Finalización del procesamiento de los frames del job
+        if processed_successfully and streaming_emission:
+            payloads = tire_counter.flush_all_vehicles(job_name) # Vehículos aún activos al terminar la fuente
+            send_vehicle_payloads(payloads, api_client, job_name, debug_mode, stage_timer)
+            vehicles_emitted += len(payloads)
+        elif processed_successfully:
+            final_payload = tire_counter.finalize_job_and_prepare_payload(job_source_name=job_name)
+            if final_payload and api_client:
+                if debug_mode:print(f"  [JOB_WORKER] Enviando resultado final para '{job_name}'...")
+                if video_file_to_send: output_video_writer.release_file() # El cliente lo sube y lo elimina
+                with stage_timer.measure(api_client.delivery_stage):
+                    api_client.send_vehicle_data(
+                        final_payload, 
+                        video_base64_to_send=video_base64, # Nuevo argumento
+                        job_source_name=job_name,
+                        video_file_path=video_file_to_send
+                    )
+                vehicles_emitted = 1
+
+    except Exception as e_job: # Mover job_input_ctrl.release() al finally del job
+        processed_successfully = False # El resumen (y /metrics, y el pool) debe contarlo como fallido
+        print(f"  [JOB_WORKER] ERROR CRÍTICO procesando el trabajo para '{job_name}': {e_job}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        if 'job_input_ctrl' in locals() and job_input_ctrl: job_input_ctrl.release()
+        if tracker_session_id: detector.destroy_tracker_session(tracker_session_id)
+        if output_video_writer: output_video_writer.abort() # No-op si ya se finalizó y eliminó (o se cedió al cliente)
+        if visualization_active_for_this_job:
+            try: cv2.destroyWindow(display_window_title)
+            except: pass
+    if debug_mode: print(f"[JOB_WORKER] Procesamiento de trabajo '{job_name}' finalizado.")
+
+    sampling_stats = sampler.get_stats() if sampler else None
+    if sampling_stats:
+        print(f"[JOB_WORKER] Muestreo adaptativo '{job_name}': {sampling_stats['frames_inferred']}/{sampling_stats['frames_total']} frames inferidos "
+              f"({sampling_stats['frames_skipped_static']} estáticos y {sampling_stats['frames_skipped_stride']} por paso saltados).")
+    return {"job_name": job_name, "frames": frame_idx_job, "wall_seconds": time.perf_counter() - t_job_start,
+            "success": processed_successfully,
+            "vehicles_emitted": vehicles_emitted, "frames_skipped": sampling_stats['frames_skipped'] if sampling_stats else 0,
+            "terminated_early_at_frame": terminated_early_at_frame, "frame_sampling": sampling_stats}
@@ -1,25 +1,29 @@
 import cv2
 import time
-from pathlib import Path
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, send_from_directory
 import threading
 import argparse
 import datetime
-import json
-import base64 # Para codificar el video
-import os
 
 from config_loader import AppConfig
-from utils import draw_vehicle_tire_counts
-from input_handler import JobInputController
 from detector import ObjectDetector
 from tracker_logic import TireCounterLogic
 from api_client import APIClient
+from job_processing import process_job
+from worker_pool import JobWorkerPool
+from multi_stream import MultiStreamProcessor
+from roi import RegionOfInterest
+from metrics import ProcessingMetrics
+from profiling import ProfilingController
 
 # --- Variables Globales para Componentes Compartidos (Cargados una vez) ---
 cfg_global = None
 detector_global = None
 api_client_global = None
+worker_pool_global = None # JobWorkerPool si 'processing.worker_pool.enabled' (procesos en lugar de hilos)
+multi_stream_global = None # MultiStreamProcessor si 'source.multi_stream.enabled' (varias cámaras RTSP)
+metrics_global = None # ProcessingMetrics si 'command_server.metrics.enabled' (endpoint /metrics)
+profiling_global = None # ProfilingController si 'command_server.profiling.enabled' (endpoints /profiling/*)
 
 # --- Servidor Flask para Comandos ---
 flask_app = Flask(__name__) # Nombre de la aplicación Flask
@@ -34,15 +38,34 @@ def initialize_global_components():
     Returns:
         bool: True si la inicialización fue exitosa, False en caso contrario.
     """
-    global detector_global, api_client_global, cfg_global
+    global detector_global, api_client_global, cfg_global, metrics_global, profiling_global
     print("[MAIN] Inicializando componentes globales (Config, Detector YOLO, API Client)...")
     try:
         cfg_global = AppConfig(config_path_str="config.yaml") # Cargar configuración
+        if cfg_global.get('command_server.metrics.enabled', False):
+            metrics_global = ProcessingMetrics(fps_window_seconds=cfg_global.get('command_server.metrics.fps_window_seconds', 60))
+            metrics_global.register_gauge("job_queue_depth", "Trabajos en cola pendientes de procesar.", queued_jobs_count)
+        if cfg_global.get('command_server.profiling.enabled', False):
+            if cfg_global.get('processing.worker_pool.enabled', False):
+                print("[MAIN] ADVERTENCIA: El perfilado bajo demanda no está disponible con 'processing.worker_pool' (los trabajos corren en otros procesos).")
+            else:
+                profiling_global = ProfilingController(cfg_global.get('command_server.profiling.output_dir', "profiles"),
+                                                       sampling_interval_ms=cfg_global.get('command_server.profiling.sampling_interval_ms', 5),
+                                                       top_functions=cfg_global.get('command_server.profiling.summary_top_functions', 40))
+        if cfg_global.get('processing.worker_pool.enabled', False):
+            # Con pool de procesos cada worker carga su propio modelo; el proceso principal solo despacha
+            print("[MAIN] Pool de procesos habilitado: el modelo se cargará en cada proceso trabajador.")
+            return True
         detector_global = ObjectDetector(cfg_global) # Cargar modelo YOLO
 
         # Inicializar cliente API solo si está habilitado en la configuración
         if cfg_global.get('external_server.enabled'):
-            api_client_global = APIClient(cfg_global)
+            api_client_global = APIClient(cfg_global, instance_name="main", active_instances=["main"]) # Recupera spools de workers
+            if metrics_global is not None:
+                metrics_global.register_gauge("delivery_queue_depth", "Resultados en cola pendientes de envío al servidor externo.",
+                                              lambda: api_client_global.get_stats()["queue_depth"])
+                metrics_global.register_gauge("delivery_spool_pending_batches", "Lotes de resultados en el spool pendientes de entrega.",
+                                              lambda: api_client_global.get_stats()["spool_pending_batches"])
         print("[MAIN] Componentes globales inicializados.")
         return True
     except Exception as e:
@@ -80,14 +103,29 @@ def queue_process_request():
     if not job_source_type or not job_source_path:
         return jsonify({"status": "error", "message": "Faltan 'source_type' o 'source_path'"}), 400
 
+    new_job = {'type': job_source_type, 'path': job_source_path, 'received_at': timestamp_recepcion}
+    if data.get('roi'): # Región de interés propia del trabajo (si no, se usa source.roi)
+        try:
+            new_job['roi'] = RegionOfInterest.from_spec(data['roi']).to_spec()
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+
     # Añadir el trabajo a la cola de forma segura (thread-safe)
     with processing_lock:
-        job_queue.append({'type': job_source_type, 'path': job_source_path, 'received_at': timestamp_recepcion})
+        job_queue.append(new_job)
     
     if cfg_global and cfg_global.get('processing.debug_mode'):
         print(f"  Trabajo para '{job_source_path}' (Tipo: {job_source_type}) añadido a la cola. Trabajos pendientes: {len(job_queue)}")
     return jsonify({"status": "success", "message": f"Trabajo para '{job_source_path}' encolado."}), 202
 
+def queued_jobs_count():
+    """Trabajos recibidos que aún no empezaron (cola de `main.py` más la del pool de procesos)."""
+    with processing_lock: pending = len(job_queue)
+    if worker_pool_global is not None:
+        pool_stats = worker_pool_global.get_stats()
+        pending += max(0, worker_pool_global.pending_jobs() - len(pool_stats["jobs_in_flight"]))
+    return pending
+
 def job_processor_worker():
     """
     Hilo trabajador que continuamente toma trabajos de `job_queue` y los procesa.
@@ -107,151 +145,116 @@ def job_processor_worker():
             if job_queue: current_job = job_queue.pop(0) # Tomar el primer trabajo (FIFO)
         
         if current_job: # Si se obtuvo un trabajo de la cola
-            job_type, job_path = current_job['type'], current_job['path']
-            job_name = str(Path(job_path).name)
-            display_window_title = f"Procesando Job: {job_name}"
-            visualization_active_for_this_job = False
-            
-            print(f"\n[JOB_WORKER] Iniciando procesado para: '{job_name}' (Tipo: {job_type})")
-
-            # --- Preparación para Video de Salida ---
-            processed_frames_for_video = [] # Lista para guardar los frames anotados
-            video_payload_config = cfg_global.get('processing.payload_video', {})
-            create_video_output = video_payload_config.get('include_processed_video', False)
-
+            if metrics_global: metrics_global.job_started()
+            stage_timer = metrics_global.job_timer() if metrics_global else None
+            # Perfilado bajo demanda: sin petición activa solo se consulta `armed`
+            profiling_session = None
+            if profiling_global is not None and profiling_global.armed:
+                profiling_session = profiling_global.begin_job(str(current_job['path']))
+                if profiling_session: stage_timer = profiling_session.stage_timer(stage_timer)
             try:
-                job_input_ctrl = JobInputController(job_type, job_path, cfg_global)
-                tire_counter_worker.reset_state_for_new_job() # Resetear estado para este job
-                frame_idx_job = 0
-                processed_successfully = True # Asumir éxito hasta que se interrumpa o falle
-
-                while True: # Bucle para procesar frames del job actual
-                    ret, frame, current_file_name_api = job_input_ctrl.read_frame()
-                    if not ret: break
-                    
-                    frame_idx_job += 1
-                    yolo_results = detector_global.track_objects(frame.copy())
-
-                    # Lógica de conteo de llantas
-                    current_vehicle_detections_this_frame = tire_counter_worker.process_job_detections(
-                        yolo_results, frame_idx_job, frame.shape
-                    )
-
-                    output_frame_for_display_and_video = frame.copy()
-                    if yolo_results: # Dibujar siempre para el video si está habilitado, y para display si está habilitado
-                        plot_options = cfg_global.get('processing.visualization_plot_options', {})
-                        plot_args = { "conf": plot_options.get('show_conf',True), "line_width": plot_options.get('line_width',1), "font_size": plot_options.get('font_size',0.4), "labels": plot_options.get('show_labels',True) }
-                        output_frame_for_display_and_video = yolo_results.plot(**plot_args)
-                    
-                    # Dibujar nuestras etiquetas personalizadas sobre el frame que ya tiene las de YOLO
-                    output_frame_for_display_and_video = draw_vehicle_tire_counts(
-                        output_frame_for_display_and_video, 
-                        current_vehicle_detections_this_frame, 
-                        tire_counter_worker.vehicle_physical_tires_current_job,
-                        cfg_global
-                    )
-
-                    if create_video_output: # Guardar frame para el video
-                        # Redimensionar frame para el video de salida si es necesario
-                        vid_w = video_payload_config.get('output_video_frame_max_width', 0)
-                        vid_h = video_payload_config.get('output_video_frame_max_height', 0)
-                        frame_to_write = output_frame_for_display_and_video
-                        if vid_w > 0 and vid_h > 0:
-                            current_h, current_w = frame_to_write.shape[:2]
-                            if current_w != vid_w or current_h != vid_h: # Solo redimensionar si es diferente
-                                frame_to_write = cv2.resize(frame_to_write, (vid_w, vid_h), interpolation=cv2.INTER_AREA)
-                        processed_frames_for_video.append(frame_to_write)
-
-                    # Visualización (si está habilitada)
-                    if cfg_global.get('processing.show_visualization_per_job'):
-                        visualization_active_for_this_job = True
-                        cv2.imshow(display_window_title, output_frame_for_display_and_video)
-                        key_press = cv2.waitKey(cfg_global.get('processing.visualization_wait_key',1)) & 0xFF
-                        if key_press == ord('q'):
-                            processed_successfully = False; break
-                
-                if visualization_active_for_this_job:
-                    try: cv2.destroyWindow(display_window_title)
-                    except: pass
-                
-                video_base64 = None
-                if processed_successfully and create_video_output and processed_frames_for_video:
-                    if cfg_global.get('processing.debug_mode'): print(f"  [JOB_WORKER] Creando video de salida para '{job_name}' con {len(processed_frames_for_video)} frames.")
-
-                    first_processed_frame = processed_frames_for_video[0]
-                    height, width, _ = first_processed_frame.shape # Usar dimensiones del frame (redimensionado para el video)
-
-                    # Leer codec y extensión de la configuración
-                    codec_str = video_payload_config.get('output_video_codec', 'mp4v') # Leerá 'avc1'
-                    video_ext = video_payload_config.get('output_video_extension', '.mp4') # Leerá '.mp4'
-
-                    temp_video_filename = f"temp_output_{job_name.replace(' ', '_').replace('.', '_')}{video_ext}" # Asegurar que el nombre sea seguro
-
-                    # Aplicar el FourCC leído de la config
-                    fourcc = cv2.VideoWriter_fourcc(*codec_str) # Ej: cv2.VideoWriter_fourcc(*'avc1')
-
-                    out_video_fps = video_payload_config.get('output_video_fps', 10)
-
-                    if cfg_global.get('processing.debug_mode'):
-                        print(f"    Creando video con: filename='{temp_video_filename}', fourcc='{codec_str}', fps={out_video_fps}, size=({width}x{height})")
-
-                    video_writer = cv2.VideoWriter(temp_video_filename, fourcc, out_video_fps, (width, height))
-
-                    if not video_writer.isOpened():
-                        print(f"    [JOB_WORKER] ERROR: No se pudo abrir VideoWriter para '{temp_video_filename}' con codec '{codec_str}'. ¿Está soportado?")
-                    else:
-                        for proc_frame in processed_frames_for_video:
-                            video_writer.write(proc_frame)
-                        video_writer.release()
-                        if cfg_global.get('processing.debug_mode'): print(f"    [JOB_WORKER] Video temporal '{temp_video_filename}' CREADO y cerrado.")
-
-                        try:
-                            with open(temp_video_filename, "rb") as video_file:
-                                video_base64 = base64.b64encode(video_file.read()).decode('utf-8')
-                            if cfg_global.get('processing.debug_mode'): print(f"    [JOB_WORKER] Video codificado a Base64 (longitud: {len(video_base64)}).")
-                        except Exception as e_b64:
-                            print(f"    [JOB_WORKER] Error codificando video a Base64: {e_b64}")
-                        finally:
-                            try:
-                                if os.path.exists(temp_video_filename): # Verificar antes de borrar
-                                    os.remove(temp_video_filename)
-                                    if cfg_global.get('processing.debug_mode'): print(f"    [JOB_WORKER] Video temporal '{temp_video_filename}' eliminado.")
-                            except Exception as e_del:
-                                if cfg_global.get('processing.debug_mode'):print(f"    [JOB_WORKER] No se pudo eliminar el video temporal '{temp_video_filename}': {e_del}")
-
-                # Finalización del procesamiento de los frames del job
-                if processed_successfully:
-                    final_payload = tire_counter_worker.finalize_job_and_prepare_payload(job_source_name=job_name)
-                    if final_payload and api_client_global:
-                        if cfg_global.get('processing.debug_mode'):print(f"  [JOB_WORKER] Enviando resultado final para '{job_name}'...")
-                        api_client_global.send_vehicle_data(
-                            final_payload, 
-                            video_base64_to_send=video_base64, # Nuevo argumento
-                            job_source_name=job_name
-                        )
-
-            except Exception as e_job: # Mover job_input_ctrl.release() al finally del job
-                print(f"  [JOB_WORKER] ERROR CRÍTICO procesando el trabajo para '{job_name}': {e_job}")
-                import traceback
-                traceback.print_exc()
+                job_summary = process_job(current_job, cfg_global, detector_global, tire_counter_worker, api_client_global,
+                                          stage_timer=stage_timer)
             finally:
-                if 'job_input_ctrl' in locals() and job_input_ctrl: job_input_ctrl.release()
-                if visualization_active_for_this_job:
-                    try: cv2.destroyWindow(display_window_title)
-                    except: pass
-            if cfg_global.get('processing.debug_mode'): print(f"[JOB_WORKER] Procesamiento de trabajo '{job_name}' finalizado.")
+                if profiling_session: profiling_global.end_job(profiling_session)
+            if metrics_global: metrics_global.job_finished(job_summary)
         else:
             time.sleep(0.05) # Espera corta si no hay jobs
 
+def pool_dispatcher_worker():
+    """
+    Hilo que traslada los trabajos de `job_queue` al pool de procesos (modo 'processing.worker_pool').
+    Mantiene la misma cola de entrada que el modo con hilos.
+    """
+    print("[JOB_DISPATCHER] Hilo despachador hacia el pool de procesos iniciado.")
+    while True:
+        current_job = None
+        with processing_lock:
+            if job_queue: current_job = job_queue.pop(0)
+        if current_job:
+            worker_pool_global.submit(current_job)
+        else:
+            time.sleep(0.05)
+
+@flask_app.route('/worker_pool/status', methods=['GET'])
+def worker_pool_status():
+    """Estado del pool de procesos: workers, trabajos en curso y jobs por minuto agregados."""
+    if worker_pool_global is None:
+        return jsonify({"status": "error", "message": "Pool de procesos no habilitado"}), 404
+    return jsonify(worker_pool_global.get_stats()), 200
+
+@flask_app.route('/multi_stream/status', methods=['GET'])
+def multi_stream_status():
+    """Estado del modo multi-stream: FPS, frames descartados y latencia por cámara, y carga de la inferencia."""
+    if multi_stream_global is None:
+        return jsonify({"status": "error", "message": "Modo multi-stream no habilitado"}), 404
+    return jsonify(multi_stream_global.get_stats()), 200
+
+@flask_app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Métricas en formato Prometheus: latencia por etapa, duración de trabajos, cola, trabajos en curso y FPS."""
+    if metrics_global is None:
+        return jsonify({"status": "error", "message": "Métricas no habilitadas"}), 404
+    return Response(metrics_global.render_prometheus(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+@flask_app.route('/profiling/start', methods=['POST'])
+def profiling_start():
+    """
+    Activa el perfilado de los próximos N trabajos o frames de `job_processor_worker`.
+    Payload JSON: {"mode": "cprofile"|"sampling", "jobs": N} o {"mode": ..., "frames": N},
+    con "sampling_interval_ms" opcional para el modo por muestreo.
+    """
+    if profiling_global is None:
+        return jsonify({"status": "error", "message": "Perfilado no habilitado"}), 404
+    data = request.get_json(silent=True) or {}
+    try:
+        status = profiling_global.start(mode=data.get('mode', "cprofile"), jobs=data.get('jobs'), frames=data.get('frames'),
+                                        sampling_interval_ms=data.get('sampling_interval_ms'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    return jsonify(status), 202
+
+@flask_app.route('/profiling/status', methods=['GET'])
+def profiling_status():
+    """Perfilado en curso, perfiles terminados y archivos descargables."""
+    if profiling_global is None:
+        return jsonify({"status": "error", "message": "Perfilado no habilitado"}), 404
+    return jsonify(profiling_global.get_status()), 200
+
+@flask_app.route('/profiling/files/<path:filename>', methods=['GET'])
+def profiling_download(filename):
+    """Descarga un perfil (.prof / .collapsed) o su resumen por función (_summary.txt)."""
+    if profiling_global is None:
+        return jsonify({"status": "error", "message": "Perfilado no habilitado"}), 404
+    return send_from_directory(profiling_global.output_dir.resolve(), filename, as_attachment=True)
 
 if __name__ == '__main__':
     # Cargar configuración e inicializar componentes globales UNA SOLA VEZ
     if not initialize_global_components():
         exit()
 
-    # Iniciar el hilo procesador de trabajos (daemon=True para que termine con el principal)
-    processor_thread = threading.Thread(target=job_processor_worker, daemon=True)
-    processor_thread.start()
+    if cfg_global.get('processing.worker_pool.enabled', False):
+        # Pool de procesos: cada proceso con su propio detector y lógica de llantas
+        worker_pool_global = JobWorkerPool(cfg_global, config_path_str="config.yaml", metrics=metrics_global)
+        worker_pool_global.start()
+        threading.Thread(target=pool_dispatcher_worker, daemon=True).start()
+    else:
+        # Iniciar el hilo procesador de trabajos (daemon=True para que termine con el principal)
+        # Varios hilos pueden compartir el mismo detector: cada job usa su propia sesión de tracking
+        num_worker_threads = max(1, int(cfg_global.get('processing.num_worker_threads', 1)))
+        for _ in range(num_worker_threads):
+            processor_thread = threading.Thread(target=job_processor_worker, daemon=True)
+            processor_thread.start()
+
+    if cfg_global.get('source.multi_stream.enabled', False):
+        # Varias cámaras RTSP en paralelo, con inferencia por lotes sobre el detector compartido
+        if detector_global is None:
+            print("[MAIN] ADVERTENCIA: El modo multi-stream requiere el detector en el proceso principal (desactive 'processing.worker_pool').")
+        else:
+            multi_stream_global = MultiStreamProcessor(cfg_global, detector_global, api_client_global)
+            if not multi_stream_global.start(): multi_stream_global = None
 
     flask_server_enabled = cfg_global.get('command_server.enabled', False)
     
@@ -273,7 +276,8 @@ if __name__ == '__main__':
             while True:
                 time.sleep(1)
                 with processing_lock:
-                    if not job_queue: # Suponiendo que el worker lo toma y lo quita rápidamente
+                    pool_busy = worker_pool_global is not None and worker_pool_global.pending_jobs() > 0
+                    if not job_queue and not pool_busy: # Suponiendo que el worker lo toma y lo quita rápidamente
                         # Podríamos necesitar un chequeo más robusto o una señal del worker
                         print("[MAIN] Cola de trabajos vacía. Asumiendo que el job de --process_folder ha terminado.")
                         break
@@ -288,6 +292,11 @@ if __name__ == '__main__':
             flask_app.run(host=server_host, port=server_port, debug=cfg_global.get('processing.debug_mode', False), use_reloader=False)
         except KeyboardInterrupt: print("\n[MAIN] Servidor Flask detenido por el usuario.")
         except Exception as e_flask: print(f"[MAIN] Error en servidor Flask: {e_flask}")
+    elif multi_stream_global is not None and not args.process_folder:
+        print("[MAIN] Servidor Flask DESHABILITADO. Procesando streams hasta que finalicen (Ctrl+C para detener)...")
+        try:
+            while multi_stream_global.is_running(): time.sleep(1)
+        except KeyboardInterrupt: print("\n[MAIN] Multi-stream detenido por el usuario.")
     elif not args.process_folder: # Si Flask está deshabilitado Y no se pasó --process_folder
         print("[MAIN] Servidor de comandos Flask DESHABILITADO y no se especificó --process_folder.")
         print("La aplicación se cerrará. Para mantenerla activa, habilita el servidor de comandos o procesa una carpeta.")
@@ -296,6 +305,12 @@ if __name__ == '__main__':
     # El hilo worker es daemon, así que terminará cuando el hilo principal (Flask o el bucle de espera) termine.
     # Si queremos un cierre diferente del worker, se necesitaría un evento de parada.
 
+    if worker_pool_global is not None: worker_pool_global.shutdown()
+    if multi_stream_global is not None:
+        multi_stream_global.stop()
+        multi_stream_global.print_stats()
+    if api_client_global is not None: api_client_global.close() # Vacía la cola de envíos pendientes
+
     print("[MAIN] Aplicación finalizada.")
     # Cerrar todas las ventanas de OpenCV al final si se usó visualización
     if cfg_global and cfg_global.get('processing.show_visualization_per_job'):
@@ -0,0 +1,158 @@
+# metrics.py
+import bisect
+import threading
+import time
+from collections import deque
+
+from stage_timing import FRAME_STAGE, JOB_STAGES, StageTimer
+
+# Límites (segundos) de los histogramas de latencia por etapa y de duración de trabajos
+STAGE_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+JOB_DURATION_BUCKETS = (1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+METRIC_PREFIX = "vehicle_counter"
+
+class LatencyHistogram:
+    """Histograma de límites fijos (acumulativo al exportar, como los de Prometheus). No es thread-safe."""
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # El último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def merge(self, counts, total):
+        """Suma los conteos (no acumulativos) y el total de otro histograma con los mismos límites."""
+        for i, c in enumerate(counts): self.counts[i] += c
+        self.sum += total
+        self.count += sum(counts)
+
+    def export(self):
+        return {"counts": list(self.counts), "sum": self.sum}
+
+class _MetricsStageTimer(StageTimer):
+    """`StageTimer` de un trabajo que vuelca cada muestra en los histogramas en lugar de guardarla."""
+    def __init__(self, metrics):
+        super().__init__()
+        self.metrics = metrics
+
+    def add(self, stage, seconds):
+        with self._lock: self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+        self.metrics.observe_stage(stage, seconds)
+
+class ProcessingMetrics:
+    """
+    Métricas del procesado de trabajos para el endpoint `/metrics` (formato de texto de Prometheus):
+    histogramas de latencia por etapa y de duración por trabajo, trabajos terminados por resultado,
+    trabajos en curso, frames procesados y FPS en una ventana deslizante, más los gauges que
+    registre `main.py` (p. ej. profundidad de la cola). El registro de una muestra es O(1) bajo un lock.
+    """
+    def __init__(self, fps_window_seconds=60.0):
+        """
+        Args:
+            fps_window_seconds (float, optional): Ventana para calcular los frames por segundo.
+        """
+        self.fps_window_seconds = fps_window_seconds
+        self._lock = threading.Lock()
+        self.stage_histograms = {} # etapa -> LatencyHistogram
+        self.job_histogram = LatencyHistogram(JOB_DURATION_BUCKETS)
+        self.jobs_total = {"success": 0, "failed": 0}
+        self.jobs_in_flight = 0
+        self.frames_total = 0
+        self._frames_per_second_slot = deque() # [segundo, frames] de la ventana de FPS
+        self._gauges = [] # (nombre, ayuda, callable)
+
+    def job_timer(self):
+        """Temporizador de etapas para un trabajo (se pasa a `process_job` como `stage_timer`)."""
+        return _MetricsStageTimer(self)
+
+    def register_gauge(self, name, help_text, value_fn):
+        """Registra un gauge cuyo valor se lee (`value_fn()`) al exportar."""
+        self._gauges.append((name, help_text, value_fn))
+
+    def _count_frames(self, frames, now):
+        second = int(now)
+        if self._frames_per_second_slot and self._frames_per_second_slot[-1][0] == second:
+            self._frames_per_second_slot[-1][1] += frames
+        else:
+            self._frames_per_second_slot.append([second, frames])
+        self.frames_total += frames
+
+    def observe_stage(self, stage, seconds):
+        with self._lock:
+            histogram = self.stage_histograms.get(stage)
+            if histogram is None: histogram = self.stage_histograms[stage] = LatencyHistogram(STAGE_LATENCY_BUCKETS)
+            histogram.observe(seconds)
+            if stage == FRAME_STAGE: self._count_frames(1, time.monotonic())
+
+    def job_started(self):
+        with self._lock: self.jobs_in_flight += 1
+
+    def job_finished(self, summary):
+        """
+        Registra el resumen de `process_job`. Si incluye 'stage_histograms' (trabajos de un proceso
+        del pool), sus histogramas se suman a los de este proceso.
+        """
+        with self._lock:
+            self.jobs_in_flight = max(0, self.jobs_in_flight - 1)
+            self.jobs_total["success" if summary.get("success") else "failed"] += 1
+            self.job_histogram.observe(summary.get("wall_seconds", 0.0))
+            for stage, data in (summary.get("stage_histograms") or {}).items():
+                histogram = self.stage_histograms.get(stage)
+                if histogram is None: histogram = self.stage_histograms[stage] = LatencyHistogram(STAGE_LATENCY_BUCKETS)
+                histogram.merge(data["counts"], data["sum"])
+                if stage == FRAME_STAGE: self._count_frames(sum(data["counts"]), time.monotonic())
+
+    def export_stage_histograms(self):
+        """Histogramas por etapa serializables (para enviarlos desde un proceso del pool)."""
+        with self._lock: return {stage: h.export() for stage, h in self.stage_histograms.items()}
+
+    def frames_per_second(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._frames_per_second_slot and now - self._frames_per_second_slot[0][0] > self.fps_window_seconds:
+                self._frames_per_second_slot.popleft()
+            frames = sum(count for _, count in self._frames_per_second_slot)
+        return frames / self.fps_window_seconds
+
+    @staticmethod
+    def _histogram_lines(name, histogram, labels=""):
+        lines, cumulative = [], 0
+        for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+        label_block = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{label_block} {histogram.sum}")
+        lines.append(f"{name}_count{label_block} {histogram.count}")
+        return lines
+
+    def render_prometheus(self):
+        """Todas las métricas en formato de texto de Prometheus (versión 0.0.4)."""
+        fps = self.frames_per_second()
+        stage_name, job_name = f"{METRIC_PREFIX}_stage_duration_seconds", f"{METRIC_PREFIX}_job_duration_seconds"
+        lines = [f"# HELP {stage_name} Duración de cada etapa del procesado de trabajos.", f"# TYPE {stage_name} histogram"]
+        with self._lock:
+            stages = [s for s in JOB_STAGES if s in self.stage_histograms] + sorted(s for s in self.stage_histograms if s not in JOB_STAGES)
+            for stage in stages:
+                lines.extend(self._histogram_lines(stage_name, self.stage_histograms[stage], f'stage="{stage}"'))
+            lines += [f"# HELP {job_name} Tiempo total (pared) de cada trabajo.", f"# TYPE {job_name} histogram"]
+            lines.extend(self._histogram_lines(job_name, self.job_histogram))
+            lines += [f"# HELP {METRIC_PREFIX}_jobs_total Trabajos terminados por resultado.", f"# TYPE {METRIC_PREFIX}_jobs_total counter"]
+            lines += [f'{METRIC_PREFIX}_jobs_total{{result="{result}"}} {count}' for result, count in self.jobs_total.items()]
+            lines += [f"# HELP {METRIC_PREFIX}_frames_total Frames procesados.", f"# TYPE {METRIC_PREFIX}_frames_total counter",
+                      f"{METRIC_PREFIX}_frames_total {self.frames_total}",
+                      f"# HELP {METRIC_PREFIX}_jobs_in_flight Trabajos en curso.", f"# TYPE {METRIC_PREFIX}_jobs_in_flight gauge",
+                      f"{METRIC_PREFIX}_jobs_in_flight {self.jobs_in_flight}"]
+        lines += [f"# HELP {METRIC_PREFIX}_frames_per_second Frames procesados por segundo en los últimos {self.fps_window_seconds:g}s.",
+                  f"# TYPE {METRIC_PREFIX}_frames_per_second gauge", f"{METRIC_PREFIX}_frames_per_second {fps:.3f}"]
+        for name, help_text, value_fn in self._gauges:
+            try:
+                value = value_fn()
+            except Exception: # Un gauge roto no debe tumbar la exportación
+                continue
+            lines += [f"# HELP {METRIC_PREFIX}_{name} {help_text}", f"# TYPE {METRIC_PREFIX}_{name} gauge", f"{METRIC_PREFIX}_{name} {value}"]
+        return "\n".join(lines) + "\n"
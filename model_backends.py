@@ -0,0 +1,181 @@
+# model_backends.py
+import hashlib
+import json
+import shutil
+import tempfile
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# Backends soportados para la inferencia del modelo YOLO
+SUPPORTED_BACKENDS = ("pytorch", "onnx", "openvino")
+
+def _list_calibration_images(calibration_folder, max_images):
+    """Devuelve hasta `max_images` rutas de imágenes de la carpeta de calibración (orden alfabético)."""
+    folder = Path(calibration_folder)
+    if not folder.is_dir():
+        raise NotADirectoryError(f"Carpeta de calibración no encontrada: {calibration_folder}")
+    images = sorted(p for p in folder.iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png", ".bmp"))
+    if not images:
+        raise FileNotFoundError(f"No hay imágenes de calibración en: {calibration_folder}")
+    return [str(p) for p in images[:max_images]]
+
+def _letterbox_for_onnx(image, imgsz):
+    """Preprocesa una imagen BGR como lo hace YOLO: letterbox a imgsz, RGB, NCHW float32 en [0,1]."""
+    h, w = image.shape[:2]
+    scale = min(imgsz / h, imgsz / w)
+    new_w, new_h = int(round(w * scale)), int(round(h * scale))
+    resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top, left = (imgsz - new_h) // 2, (imgsz - new_w) // 2
+    canvas[top:top + new_h, left:left + new_w] = resized
+    return np.ascontiguousarray(canvas[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+
+def _quantize_onnx_int8(fp32_path, int8_path, calibration_folder, imgsz, max_images, debug_mode):
+    """Cuantización estática INT8 (post-entrenamiento) de un modelo ONNX con ONNX Runtime."""
+    try:
+        import onnxruntime
+        from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    except ImportError as e:
+        raise RuntimeError(f"La cuantización INT8 de ONNX requiere 'onnxruntime': {e}")
+
+    input_name = onnxruntime.InferenceSession(fp32_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    image_paths = _list_calibration_images(calibration_folder, max_images)
+
+    class _FolderCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self.paths = iter(image_paths)
+
+        def get_next(self):
+            for path in self.paths:
+                image = cv2.imread(path)
+                if image is not None:
+                    return {input_name: _letterbox_for_onnx(image, imgsz)}
+            return None
+
+    if debug_mode: print(f"[MODEL_BACKENDS] Cuantizando a INT8 con {len(image_paths)} imágenes de calibración...")
+    quantize_static(fp32_path, int8_path, _FolderCalibrationReader(),
+                    quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+def _write_calibration_dataset_yaml(calibration_folder, class_names):
+    """Crea un YAML de dataset temporal para que ultralytics calibre OpenVINO INT8 con una carpeta de imágenes."""
+    folder = Path(calibration_folder).resolve()
+    if not folder.is_dir():
+        raise NotADirectoryError(f"Carpeta de calibración no encontrada: {calibration_folder}")
+    names_yaml = "\n".join(f"  {i}: {name}" for i, name in enumerate(class_names))
+    tmp = tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False, encoding="utf-8")
+    tmp.write(f"path: {folder.as_posix()}\ntrain: .\nval: .\nnames:\n{names_yaml}\n")
+    tmp.close()
+    return tmp.name
+
+def get_exported_model_path(pt_path, backend, int8=False):
+    """
+    Ruta donde se cachea el modelo exportado para un backend.
+    ONNX: `best.onnx` / `best_int8.onnx`. OpenVINO: `best_openvino_model/` / `best_int8_openvino_model/`
+    (nombres que usa ultralytics al exportar).
+    """
+    pt = Path(pt_path)
+    if backend == "onnx":
+        return pt.with_name(f"{pt.stem}_int8.onnx" if int8 else f"{pt.stem}.onnx")
+    if backend == "openvino":
+        return pt.with_name(f"{pt.stem}_int8_openvino_model" if int8 else f"{pt.stem}_openvino_model")
+    return pt
+
+def _export_metadata_path(exported_path):
+    """Archivo junto al export (`best.onnx.export.json`, `best_openvino_model.export.json`) con sus parámetros."""
+    return exported_path.with_name(exported_path.name + ".export.json")
+
+def _calibration_fingerprint(calibration_folder):
+    """Huella de las imágenes de calibración (nombre, tamaño y fecha), para detectar cambios en la carpeta."""
+    folder = Path(calibration_folder)
+    if not folder.is_dir(): return None
+    digest = hashlib.sha1()
+    for p in sorted(folder.iterdir()):
+        if p.suffix.lower() in (".jpg", ".jpeg", ".png", ".bmp"):
+            stat = p.stat()
+            digest.update(f"{p.name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def _export_params(imgsz, int8=False, calibration_folder=None, calibration_max_images=None):
+    """Parámetros que fijan el export (entrada estática y calibración INT8): si cambian, hay que regenerarlo."""
+    params = {"imgsz": int(imgsz), "batch": 1, "int8": bool(int8)}
+    if int8:
+        params.update({"calibration_folder": str(Path(calibration_folder).resolve()),
+                       "calibration_max_images": int(calibration_max_images),
+                       "calibration_fingerprint": _calibration_fingerprint(calibration_folder)})
+    return params
+
+def _write_export_metadata(exported_path, params):
+    with open(_export_metadata_path(exported_path), "w", encoding="utf-8") as f: json.dump(params, f, indent=2)
+
+def _is_cache_fresh(exported_path, pt_path, params):
+    """
+    El export cacheado es válido si existe, es posterior al .pt del que proviene y se generó con los
+    mismos parámetros (imgsz, INT8 y su calibración), guardados en su archivo `.export.json`.
+    """
+    if not exported_path.exists(): return False
+    if exported_path.stat().st_mtime < Path(pt_path).stat().st_mtime: return False
+    try:
+        with open(_export_metadata_path(exported_path), "r", encoding="utf-8") as f: return json.load(f) == params
+    except (OSError, ValueError):
+        return False # Export sin metadatos (versión anterior): se regenera
+
+def prepare_model_for_backend(pt_path, backend="pytorch", int8=False, calibration_folder=None,
+                              imgsz=640, class_names=None, calibration_max_images=300, debug_mode=False):
+    """
+    Devuelve la ruta del modelo a cargar con `YOLO(...)` para el backend pedido,
+    exportando y cacheando `best.pt` a ONNX u OpenVINO IR si hace falta.
+
+    Args:
+        pt_path (str): Ruta del modelo PyTorch (.pt).
+        backend (str): "pytorch", "onnx" u "openvino".
+        int8 (bool): Aplicar cuantización INT8 post-entrenamiento (requiere `calibration_folder`).
+        calibration_folder (str, optional): Carpeta con imágenes representativas para calibrar INT8.
+        imgsz (int): Tamaño de entrada fijo del modelo exportado.
+        class_names (list, optional): Nombres de clase (necesarios para calibrar OpenVINO).
+        calibration_max_images (int): Máximo de imágenes usadas en la calibración.
+        debug_mode (bool): Si es True, imprime mensajes de depuración.
+
+    Returns:
+        str: Ruta del modelo listo para `YOLO(...)`.
+    """
+    if backend not in SUPPORTED_BACKENDS:
+        raise ValueError(f"Backend de modelo no soportado: '{backend}'. Opciones: {SUPPORTED_BACKENDS}")
+    if backend == "pytorch": return str(pt_path)
+    if int8 and not calibration_folder:
+        raise ValueError("La cuantización INT8 requiere 'model.int8_calibration_folder'.")
+
+    exported_path = get_exported_model_path(pt_path, backend, int8)
+    export_params = _export_params(imgsz, int8, calibration_folder, calibration_max_images)
+    if _is_cache_fresh(exported_path, pt_path, export_params):
+        if debug_mode: print(f"[MODEL_BACKENDS] Usando modelo exportado en caché: {exported_path}")
+        return str(exported_path)
+
+    from ultralytics import YOLO
+    if debug_mode: print(f"[MODEL_BACKENDS] Exportando '{pt_path}' a {backend}{' INT8' if int8 else ''} (imgsz={imgsz})...")
+    if backend == "onnx":
+        fp32_path = get_exported_model_path(pt_path, "onnx", int8=False)
+        fp32_params = _export_params(imgsz)
+        if not _is_cache_fresh(fp32_path, pt_path, fp32_params):
+            fp32_path = Path(YOLO(str(pt_path)).export(format="onnx", imgsz=imgsz, batch=1, dynamic=False, simplify=True))
+            _write_export_metadata(fp32_path, fp32_params)
+        if int8:
+            _quantize_onnx_int8(str(fp32_path), str(exported_path), calibration_folder, imgsz, calibration_max_images, debug_mode)
+    else: # openvino
+        export_args = {"format": "openvino", "imgsz": imgsz, "batch": 1}
+        data_yaml = None
+        if int8:
+            data_yaml = _write_calibration_dataset_yaml(calibration_folder, class_names or [])
+            export_args.update({"int8": True, "data": data_yaml, "fraction": 1.0})
+        try:
+            exported = Path(YOLO(str(pt_path)).export(**export_args))
+        finally:
+            if data_yaml: Path(data_yaml).unlink(missing_ok=True)
+        if exported.resolve() != exported_path.resolve() and exported.exists():
+            if exported_path.exists(): shutil.rmtree(exported_path) # Export anterior obsoleto
+            exported.replace(exported_path)
+    _write_export_metadata(exported_path, export_params)
+
+    if debug_mode: print(f"[MODEL_BACKENDS] Modelo exportado y cacheado en: {exported_path}")
+    return str(exported_path)
@@ -0,0 +1,274 @@
+# multi_stream.py
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from input_handler import JobInputController
+from roi import RegionOfInterest
+from job_processing import send_vehicle_payloads
+from tracker_logic import TireCounterLogic
+
+class _StreamChannel:
+    """
+    Una cámara del modo multi-stream: hilo lector propio que conserva solo el último frame,
+    sesión de tracking y `TireCounterLogic` propios, y estadísticas del stream.
+    """
+    def __init__(self, name, url, config, detector, api_client, stats_window_seconds, roi=None):
+        self.name = name
+        self.url = url
+        self.roi = roi # RegionOfInterest de la cámara (o None)
+        self.config = config
+        self.detector = detector
+        self.api_client = api_client
+        self.debug_mode = config.get('processing.debug_mode', False)
+        self.stats_window_seconds = stats_window_seconds
+
+        self.job_input_ctrl = None
+        self.tire_counter = TireCounterLogic(config, api_client_instance=api_client)
+        self.tracker_session_id = None
+        self.frame_idx = 0 # Frames procesados del stream (índice para la ventana de pérdida de tracks)
+        self.status = "pending" # pending -> running -> ended / error
+        self.finished = False # Vehículos restantes ya emitidos y sesión liberada
+
+        self._lock = threading.Lock()
+        self._latest = None # (frame, original_shape, t_capture) aún no consumido por la inferencia
+        self._reader_thread = None
+
+        self.frames_captured = 0
+        self.frames_dropped = 0 # Frames sustituidos por uno más nuevo antes de llegar a la inferencia
+        self.frames_processed = 0
+        self.vehicles_emitted = 0
+        self.capture_times = deque() # time.perf_counter() de frames capturados en la ventana
+        self.processed_times = deque() # time.perf_counter() de frames procesados en la ventana
+        self.latencies_ms = deque(maxlen=500) # Captura -> resultado de la lógica de llantas
+
+    def open(self, stop_event):
+        try:
+            self.job_input_ctrl = JobInputController("rtsp", self.url, self.config)
+        except Exception as e:
+            print(f"[MULTI_STREAM] ERROR abriendo stream '{self.name}' ({self.url}): {e}")
+            self.status = "error"
+            return False
+        self.tire_counter.reset_state_for_new_job()
+        self.tracker_session_id = self.detector.create_tracker_session(f"stream_{self.name}")
+        self.status = "running"
+        self._reader_thread = threading.Thread(target=self._reader_loop, args=(stop_event,),
+                                               name=f"stream_reader_{self.name}", daemon=True)
+        self._reader_thread.start()
+        return True
+
+    def _reader_loop(self, stop_event):
+        while not stop_event.is_set():
+            ret, frame, _ = self.job_input_ctrl.read_frame()
+            if not ret:
+                print(f"[MULTI_STREAM] Stream '{self.name}' sin frames: finalizado.")
+                self.status = "ended"
+                return
+            t_capture = time.perf_counter()
+            original_shape = self.job_input_ctrl.get_original_frame_shape(frame)
+            with self._lock:
+                if self._latest is not None: self.frames_dropped += 1
+                self._latest = (frame, original_shape, t_capture)
+                self.frames_captured += 1
+                self.capture_times.append(t_capture)
+
+    def take_latest(self):
+        """Devuelve el último frame capturado no procesado (o None) y lo marca como consumido."""
+        with self._lock:
+            item, self._latest = self._latest, None
+        return item
+
+    def process_result(self, yolo_results, original_shape, t_capture):
+        """Lógica de llantas y emisión de vehículos perdidos para un frame ya inferido del stream."""
+        self.frame_idx += 1
+        self.tire_counter.process_job_detections(yolo_results, self.frame_idx, original_shape)
+        payloads = self.tire_counter.evict_lost_vehicles(self.frame_idx, self.name)
+        if payloads:
+            send_vehicle_payloads(payloads, self.api_client, self.name, self.debug_mode)
+            self.vehicles_emitted += len(payloads)
+        now = time.perf_counter()
+        with self._lock:
+            self.frames_processed += 1
+            self.processed_times.append(now)
+            self.latencies_ms.append((now - t_capture) * 1000.0)
+
+    def finish(self):
+        """Emite los vehículos aún activos y libera el stream y su sesión de tracking."""
+        if self.finished: return
+        self.finished = True
+        if self.tracker_session_id is not None:
+            payloads = self.tire_counter.flush_all_vehicles(self.name)
+            send_vehicle_payloads(payloads, self.api_client, self.name, self.debug_mode)
+            self.vehicles_emitted += len(payloads)
+            self.detector.destroy_tracker_session(self.tracker_session_id)
+        if self.job_input_ctrl: self.job_input_ctrl.release()
+
+    def is_exhausted(self):
+        return self.status in ("ended", "error") and self._latest is None
+
+    def _trim_window(self, times, now):
+        while times and now - times[0] > self.stats_window_seconds:
+            times.popleft()
+
+    def get_stats(self):
+        now = time.perf_counter()
+        with self._lock:
+            self._trim_window(self.capture_times, now)
+            self._trim_window(self.processed_times, now)
+            latencies = np.array(self.latencies_ms) if self.latencies_ms else None
+            return {
+                "url": self.url,
+                "status": self.status,
+                "frames_captured": self.frames_captured,
+                "frames_processed": self.frames_processed,
+                "frames_dropped": self.frames_dropped,
+                "capture_fps": round(len(self.capture_times) / self.stats_window_seconds, 2),
+                "processed_fps": round(len(self.processed_times) / self.stats_window_seconds, 2),
+                "latency_ms_p50": round(float(np.percentile(latencies, 50)), 1) if latencies is not None else None,
+                "latency_ms_p95": round(float(np.percentile(latencies, 95)), 1) if latencies is not None else None,
+                "latency_ms_max": round(float(latencies.max()), 1) if latencies is not None else None,
+                "active_vehicles": len(self.tire_counter.tracked_vehicles_info_current_job),
+                "vehicles_emitted": self.vehicles_emitted,
+                "capture": self.job_input_ctrl.get_capture_stats() if self.job_input_ctrl else None,
+            }
+
+class MultiStreamProcessor:
+    """
+    Procesa varias cámaras RTSP a la vez con un único modelo. Cada stream tiene su hilo lector
+    (se queda siempre con el frame más reciente), su sesión de tracking y su `TireCounterLogic`.
+    En cada ciclo, el bucle de inferencia recoge el último frame de cada stream en orden rotatorio
+    (round-robin), los detecta en un solo lote y aplica a cada uno el tracking y la lógica de su stream.
+    Los vehículos se emiten al perder su track (misma lógica que `processing.streaming_emission`).
+    """
+    def __init__(self, config, detector, api_client=None):
+        """
+        Args:
+            config (AppConfig): Configuración (sección 'source.multi_stream').
+            detector (ObjectDetector): Detector compartido (una sola copia del modelo).
+            api_client (APIClient, optional): Cliente para enviar los payloads de vehículos.
+        """
+        self.config = config
+        self.detector = detector
+        self.debug_mode = config.get('processing.debug_mode', False)
+        self.max_batch_size = int(config.get('source.multi_stream.max_batch_size', 0)) # 0 = todos los streams
+        self.idle_sleep_seconds = config.get('source.multi_stream.idle_sleep_ms', 5) / 1000.0
+        self.stats_log_interval_seconds = config.get('source.multi_stream.stats_log_interval_seconds', 30)
+        stats_window_seconds = config.get('source.multi_stream.stats_window_seconds', 10)
+
+        self.channels = []
+        for idx, stream_cfg in enumerate(config.get('source.multi_stream.streams', []) or []):
+            name = stream_cfg.get('name') or f"cam{idx + 1}"
+            roi = RegionOfInterest.from_spec(stream_cfg.get('roi') or config.get('source.roi'))
+            self.channels.append(_StreamChannel(name, stream_cfg.get('url'), config, detector, api_client, stats_window_seconds, roi))
+
+        self.stop_event = threading.Event()
+        self._loop_thread = None
+        self._rr_offset = 0
+        self.started_at = None
+        self.ticks = 0
+        self.frames_inferred = 0
+        self.inference_seconds = 0.0
+        self.loop_busy_seconds = 0.0
+
+    def start(self):
+        """Abre los streams y arranca el bucle de inferencia en un hilo propio."""
+        if not self.channels:
+            print("[MULTI_STREAM] No hay streams configurados en 'source.multi_stream.streams'.")
+            return False
+        opened = sum(1 for channel in self.channels if channel.open(self.stop_event))
+        if opened == 0:
+            print("[MULTI_STREAM] No se pudo abrir ningún stream.")
+            return False
+        self.started_at = time.perf_counter()
+        self._loop_thread = threading.Thread(target=self._inference_loop, name="multi_stream_inference", daemon=True)
+        self._loop_thread.start()
+        print(f"[MULTI_STREAM] {opened}/{len(self.channels)} streams abiertos. Lote máximo: {self.max_batch_size or 'todos'}.")
+        return True
+
+    def is_running(self):
+        """True mientras el bucle de inferencia siga activo (hasta que se detenga o terminen todos los streams)."""
+        return self._loop_thread is not None and self._loop_thread.is_alive()
+
+    def stop(self, timeout=5.0):
+        """Detiene el bucle y los lectores, emite los vehículos activos y libera los streams."""
+        self.stop_event.set()
+        if self._loop_thread: self._loop_thread.join(timeout=timeout)
+        for channel in self.channels:
+            if channel._reader_thread: channel._reader_thread.join(timeout=timeout)
+            channel.finish()
+
+    def _collect_batch(self):
+        """Último frame de cada stream, empezando por el siguiente al último atendido (round-robin)."""
+        batch = []
+        num_channels = len(self.channels)
+        next_offset = self._rr_offset
+        for i in range(num_channels):
+            pos = (self._rr_offset + i) % num_channels
+            item = self.channels[pos].take_latest()
+            if item is None: continue
+            batch.append((self.channels[pos], item))
+            next_offset = (pos + 1) % num_channels
+            if self.max_batch_size and len(batch) >= self.max_batch_size: break
+        self._rr_offset = next_offset
+        return batch
+
+    def _inference_loop(self):
+        last_stats_log = time.perf_counter()
+        while not self.stop_event.is_set():
+            for channel in self.channels:
+                if not channel.finished and channel.is_exhausted(): channel.finish()
+            batch = self._collect_batch()
+            if not batch:
+                if all(channel.finished for channel in self.channels):
+                    print("[MULTI_STREAM] Todos los streams han finalizado.")
+                    return
+                time.sleep(self.idle_sleep_seconds)
+                continue
+
+            t_tick = time.perf_counter()
+            frames = [frame for _, (frame, _, _) in batch]
+            session_ids = [channel.tracker_session_id for channel, _ in batch]
+            original_shapes = [original_shape for _, (_, original_shape, _) in batch]
+            rois = [channel.roi for channel, _ in batch]
+            results = self.detector.track_batch_sessions(frames, session_ids, original_shapes, rois)
+            t_inferred = time.perf_counter()
+            for (channel, (_, original_shape, t_capture)), yolo_results in zip(batch, results):
+                channel.process_result(yolo_results, original_shape, t_capture)
+
+            self.ticks += 1
+            self.frames_inferred += len(batch)
+            self.inference_seconds += t_inferred - t_tick
+            self.loop_busy_seconds += time.perf_counter() - t_tick
+            if self.stats_log_interval_seconds and time.perf_counter() - last_stats_log >= self.stats_log_interval_seconds:
+                last_stats_log = time.perf_counter()
+                self.print_stats()
+
+    def get_stats(self):
+        """
+        Estadísticas por stream (FPS de captura y procesado, frames descartados, latencia extremo a extremo)
+        y del bucle de inferencia (lotes, tiempo de inferencia por ciclo y fracción de tiempo ocupado).
+        """
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        return {
+            "streams": {channel.name: channel.get_stats() for channel in self.channels},
+            "inference": {
+                "ticks": self.ticks,
+                "frames_inferred": self.frames_inferred,
+                "mean_batch_size": round(self.frames_inferred / self.ticks, 2) if self.ticks else 0.0,
+                "mean_inference_ms_per_tick": round(self.inference_seconds * 1000.0 / self.ticks, 2) if self.ticks else 0.0,
+                "total_inferred_fps": round(self.frames_inferred / elapsed, 2) if elapsed > 0 else 0.0,
+                "loop_busy_fraction": round(self.loop_busy_seconds / elapsed, 3) if elapsed > 0 else 0.0,
+            },
+        }
+
+    def print_stats(self):
+        stats = self.get_stats()
+        inference = stats["inference"]
+        print(f"[MULTI_STREAM] Lote medio {inference['mean_batch_size']}, {inference['mean_inference_ms_per_tick']} ms/ciclo, "
+              f"{inference['total_inferred_fps']} fps totales, bucle ocupado {inference['loop_busy_fraction']:.0%}")
+        for name, s in stats["streams"].items():
+            print(f"  [{name}] {s['status']}: captura {s['capture_fps']} fps, procesado {s['processed_fps']} fps, "
+                  f"descartados {s['frames_dropped']}, latencia p50/p95 {s['latency_ms_p50']}/{s['latency_ms_p95']} ms, "
+                  f"vehículos emitidos {s['vehicles_emitted']}")
@@ -0,0 +1,198 @@
+# param_sweep.py
+"""
+Barrido de parámetros de `tire_logic` y umbrales de confianza sobre detecciones grabadas.
+
+Dos pasos:
+  1. `record`: pasa el modelo y el tracker UNA vez por cada secuencia etiquetada y guarda sus
+     detecciones con IDs de tracking (un .npz columnar por secuencia). Usa la caché de detecciones
+     si está habilitada.
+  2. `run`: reproduce `TireCounterLogic` sobre las grabaciones para cada combinación de la rejilla,
+     en paralelo con todos los núcleos, sin volver a ejecutar el modelo, y ordena las combinaciones
+     por exactitud del conteo de llantas (y de la clase del vehículo).
+
+Etiquetas (JSON): lista de {"source_type", "source_path", "tire_count", "vehicle_class"(opcional), "roi"(opcional)}.
+Rejilla (YAML/JSON): ruta de clave -> lista de valores, p. ej.
+    tire_logic.iou_threshold_same_physical_tire: [0.3, 0.4, 0.5]
+    tire_logic.vehicle_box_expansion_x_percent: [0.0, 0.03, 0.06]
+    confidence_thresholds.per_class.Tire: [0.4, 0.5, 0.6]
+
+Uso:
+    python param_sweep.py record --labels etiquetas.json --recordings grabaciones/
+    python param_sweep.py run --recordings grabaciones/ --grid rejilla.yaml --output barrido.json
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import multiprocessing
+import time
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+from config_loader import AppConfig
+from worker_pool import _available_cpu_ids
+
+_INDEX_FILE = "recordings.json"
+
+def _record(args):
+    from detector import ObjectDetector
+    from input_handler import JobInputController
+    from job_processing import iter_job_frames
+    from roi import RegionOfInterest
+
+    cfg = AppConfig(config_path_str=args.config)
+    with open(args.labels, "r", encoding="utf-8") as f: labels = json.load(f)
+    detector = ObjectDetector(cfg)
+    out_dir = Path(args.recordings)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    index = []
+    for seq_idx, label in enumerate(labels):
+        job_path = label["source_path"]
+        seq_name = f"{seq_idx:04d}_{Path(job_path).name}"
+        roi = RegionOfInterest.from_spec(label.get("roi") or cfg.get('source.roi'))
+        job_input_ctrl = JobInputController(label["source_type"], job_path, cfg)
+        session_id = detector.create_tracker_session(seq_name, use_detection_cache=label["source_type"] != "rtsp")
+        counts, shapes, xyxy, conf, cls, track_ids = [], [], [], [], [], []
+        t0 = time.perf_counter()
+        try:
+            for _, original_shape, result in detector.iter_tracked_frames(iter_job_frames(job_input_ctrl), session_id=session_id, roi=roi):
+                shapes.append(original_shape[:2])
+                boxes = result.boxes if result is not None else None
+                if boxes is None or boxes.id is None or len(boxes) == 0: # Sin IDs: TireCounterLogic ignora el frame
+                    counts.append(0)
+                    continue
+                counts.append(len(boxes))
+                xyxy.append(boxes.xyxy.cpu().numpy()); conf.append(boxes.conf.cpu().numpy())
+                cls.append(boxes.cls.cpu().numpy()); track_ids.append(boxes.id.cpu().numpy())
+        finally:
+            job_input_ctrl.release()
+            detector.destroy_tracker_session(session_id)
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        np.savez_compressed(out_dir / f"{seq_name}.npz", offsets=offsets, frame_shapes=np.array(shapes, dtype=np.int32).reshape(-1, 2),
+                            xyxy=np.concatenate(xyxy).astype(np.float32) if xyxy else np.zeros((0, 4), np.float32),
+                            conf=np.concatenate(conf).astype(np.float32) if conf else np.zeros(0, np.float32),
+                            cls=np.concatenate(cls).astype(np.float32) if cls else np.zeros(0, np.float32),
+                            track_ids=np.concatenate(track_ids).astype(np.float32) if track_ids else np.zeros(0, np.float32))
+        index.append({**label, "recording": f"{seq_name}.npz", "frames": len(counts)})
+        print(f"[PARAM_SWEEP] Grabada '{seq_name}': {len(counts)} frames en {time.perf_counter() - t0:.1f}s")
+
+    with open(out_dir / _INDEX_FILE, "w", encoding="utf-8") as f: json.dump(index, f, indent=2, ensure_ascii=False)
+    print(f"[PARAM_SWEEP] {len(index)} secuencias grabadas en: {out_dir}")
+
+# --- Reproducción en los procesos del pool ---
+
+_worker_state = {}
+
+def _load_recording(path):
+    """Frames de una grabación como lista de (FrameDetections, shape original)."""
+    from detections import FrameDetections
+    dummy_img = np.zeros((1, 1, 3), dtype=np.uint8) # TireCounterLogic no usa la imagen
+    with np.load(path) as data:
+        offsets, frame_shapes = data["offsets"], data["frame_shapes"]
+        xyxy, conf, cls, track_ids = data["xyxy"], data["conf"], data["cls"], data["track_ids"]
+    frames = []
+    for i in range(len(frame_shapes)):
+        start, end = offsets[i], offsets[i + 1]
+        shape = (int(frame_shapes[i][0]), int(frame_shapes[i][1]))
+        frames.append((FrameDetections(dummy_img, xyxy[start:end], conf[start:end], cls[start:end],
+                                       track_ids=track_ids[start:end], orig_shape=shape), shape))
+    return frames
+
+def _init_worker(config_path_str, recordings_dir, index):
+    with contextlib.redirect_stdout(io.StringIO()):
+        base_cfg = AppConfig(config_path_str=config_path_str).with_overrides({'processing.debug_mode': False})
+    _worker_state["base_cfg"] = base_cfg
+    _worker_state["sequences"] = [(entry, _load_recording(Path(recordings_dir) / entry["recording"])) for entry in index]
+
+def _evaluate(combo):
+    """Reproduce todas las secuencias con una combinación de parámetros y calcula sus métricas."""
+    from tracker_logic import TireCounterLogic
+    overrides = dict(combo)
+    with contextlib.redirect_stdout(io.StringIO()): # Advertencias de configuración repetidas por combinación
+        cfg = _worker_state["base_cfg"].with_overrides(overrides)
+        tire_counter = TireCounterLogic(cfg)
+    tire_ok = class_ok = both_ok = 0
+    abs_errors, per_sequence = [], []
+    for entry, frames in _worker_state["sequences"]:
+        tire_counter.reset_state_for_new_job()
+        for frame_idx, (detections, shape) in enumerate(frames, start=1):
+            tire_counter.process_job_detections(detections, frame_idx, shape)
+        payload = tire_counter.finalize_job_and_prepare_payload(job_source_name=entry["recording"]) or {}
+        tire_count, vehicle_class = payload.get("tire_count", 0), payload.get("vehicle_class")
+        tire_match = tire_count == entry["tire_count"]
+        class_match = entry.get("vehicle_class") is None or vehicle_class == entry["vehicle_class"]
+        tire_ok += tire_match; class_ok += class_match; both_ok += tire_match and class_match
+        abs_errors.append(abs(tire_count - entry["tire_count"]))
+        per_sequence.append({"recording": entry["recording"], "tire_count": tire_count, "vehicle_class": vehicle_class})
+    n = len(_worker_state["sequences"])
+    return {"params": overrides,
+            "accuracy": round(both_ok / n, 4), "tire_count_accuracy": round(tire_ok / n, 4),
+            "class_accuracy": round(class_ok / n, 4), "mean_abs_tire_error": round(float(np.mean(abs_errors)), 4),
+            "per_sequence": per_sequence}
+
+def _load_grid(grid_path):
+    with open(grid_path, "r", encoding="utf-8") as f: grid = yaml.safe_load(f) # YAML también lee JSON
+    if not isinstance(grid, dict) or not grid:
+        raise ValueError(f"La rejilla '{grid_path}' debe ser un mapa 'clave: [valores]'.")
+    keys = list(grid.keys())
+    values = [v if isinstance(v, list) else [v] for v in grid.values()]
+    return [tuple(zip(keys, combo)) for combo in itertools.product(*values)]
+
+def _run(args):
+    recordings_dir = Path(args.recordings)
+    with open(recordings_dir / _INDEX_FILE, "r", encoding="utf-8") as f: index = json.load(f)
+    if not index:
+        print("[PARAM_SWEEP] No hay secuencias grabadas.")
+        return
+    combos = _load_grid(args.grid)
+    base_cfg = AppConfig(config_path_str=args.config)
+    for key, _ in combos[0]:
+        if base_cfg.get(key) is None: print(f"[PARAM_SWEEP] ADVERTENCIA: '{key}' no existe en {args.config} (se añadirá igualmente).")
+
+    num_processes = args.processes or len(_available_cpu_ids())
+    print(f"[PARAM_SWEEP] {len(combos)} combinaciones x {len(index)} secuencias con {num_processes} procesos...")
+    t0 = time.perf_counter()
+    mp_context = multiprocessing.get_context("spawn")
+    results = []
+    with mp_context.Pool(num_processes, initializer=_init_worker, initargs=(args.config, str(recordings_dir), index)) as pool:
+        chunksize = max(1, len(combos) // (num_processes * 8))
+        for done, result in enumerate(pool.imap_unordered(_evaluate, combos, chunksize=chunksize), start=1):
+            results.append(result)
+            if done % max(1, len(combos) // 10) == 0: print(f"  {done}/{len(combos)} combinaciones evaluadas...")
+    elapsed = time.perf_counter() - t0
+
+    results.sort(key=lambda r: (-r["accuracy"], -r["tire_count_accuracy"], r["mean_abs_tire_error"]))
+    print(f"[PARAM_SWEEP] Barrido completado en {elapsed:.1f}s ({len(combos) / elapsed:.1f} combinaciones/s). Mejores:")
+    for rank, result in enumerate(results[:args.top], start=1):
+        print(f"  {rank:>3}. exactitud={result['accuracy']:.3f} llantas={result['tire_count_accuracy']:.3f} "
+              f"clase={result['class_accuracy']:.3f} error medio={result['mean_abs_tire_error']:.2f} {result['params']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"sequences": len(index), "combinations": len(combos), "seconds": round(elapsed, 2), "ranking": results},
+                      f, indent=2, ensure_ascii=False)
+        print(f"[PARAM_SWEEP] Reporte guardado en: {args.output}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Barrido de parámetros de tire_logic sobre detecciones grabadas.")
+    parser.add_argument("--config", type=str, default="config.yaml", help="Configuración base.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record_parser = subparsers.add_parser("record", help="Graba las detecciones con tracking de las secuencias etiquetadas.")
+    record_parser.add_argument("--labels", type=str, required=True, help="JSON con las secuencias etiquetadas.")
+    record_parser.add_argument("--recordings", type=str, required=True, help="Carpeta de salida de las grabaciones.")
+    run_parser = subparsers.add_parser("run", help="Evalúa la rejilla de parámetros sobre las grabaciones.")
+    run_parser.add_argument("--recordings", type=str, required=True, help="Carpeta con las grabaciones (paso 'record').")
+    run_parser.add_argument("--grid", type=str, required=True, help="YAML/JSON con la rejilla de parámetros.")
+    run_parser.add_argument("--processes", type=int, default=0, help="Procesos en paralelo (0 = todos los núcleos).")
+    run_parser.add_argument("--top", type=int, default=10, help="Combinaciones a mostrar.")
+    run_parser.add_argument("--output", type=str, default=None, help="Archivo JSON con el ranking completo.")
+    args = parser.parse_args()
+    if args.command == "record": _record(args)
+    else: _run(args)
+
+if __name__ == '__main__':
+    main()
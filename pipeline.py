@@ -0,0 +1,268 @@
+# pipeline.py
+import cv2
+import queue
+import threading
+import time
+
+from utils import annotate_frame
+from stage_timing import NULL_STAGE_TIMER
+
+_END_OF_STREAM = object() # Marcador de fin de secuencia entre etapas
+
+class _StageStats:
+    """Acumula tiempos de una etapa (trabajo útil vs. espera en colas)."""
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0 # Tiempo haciendo trabajo real
+        self.wait_input_seconds = 0.0 # Tiempo esperando datos de la etapa anterior
+        self.wait_output_seconds = 0.0 # Tiempo bloqueado porque la etapa siguiente va lenta (backpressure)
+
+    def as_dict(self, wall_seconds):
+        return {
+            "items": self.items,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "wait_input_seconds": round(self.wait_input_seconds, 3),
+            "wait_output_seconds": round(self.wait_output_seconds, 3),
+            "busy_fraction": round(self.busy_seconds / wall_seconds, 3) if wall_seconds > 0 else 0.0,
+        }
+
+class _StageQueue:
+    """
+    Cola acotada entre dos etapas. Registra la ocupación en cada operación
+    para poder reportar qué tan llena estuvo en promedio.
+    """
+    def __init__(self, name, maxsize, stop_event):
+        self.name = name
+        self.maxsize = max(1, int(maxsize))
+        self.q = queue.Queue(maxsize=self.maxsize)
+        self.stop_event = stop_event
+        self.occupancy_sum = 0
+        self.occupancy_samples = 0
+        self.max_occupancy = 0
+
+    def _sample(self):
+        size = self.q.qsize()
+        self.occupancy_sum += size
+        self.occupancy_samples += 1
+        if size > self.max_occupancy: self.max_occupancy = size
+
+    def put(self, item):
+        """Encola respetando el límite (bloquea si está llena). Devuelve False si se pidió parar."""
+        self._sample()
+        while not self.stop_event.is_set():
+            try:
+                self.q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self):
+        """Desencola (bloquea si está vacía). Devuelve _END_OF_STREAM si se pidió parar."""
+        self._sample()
+        while not self.stop_event.is_set():
+            try:
+                return self.q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END_OF_STREAM
+
+    def as_dict(self):
+        avg = self.occupancy_sum / self.occupancy_samples if self.occupancy_samples else 0.0
+        return {
+            "maxsize": self.maxsize,
+            "avg_occupancy": round(avg, 2),
+            "avg_fill_fraction": round(avg / self.maxsize, 3),
+            "max_occupancy": self.max_occupancy,
+        }
+
+class JobPipeline:
+    """
+    Procesa los frames de un trabajo en tres etapas solapadas:
+      1. Decodificación (hilo propio): `JobInputController.read_frame` adelantándose a la inferencia.
+      2. Inferencia y tracking (hilo que llama a `run`): `track_objects` (o detección por lotes) en la
+         sesión de tracking del trabajo + `process_job_detections`, estrictamente en orden de frame.
+      3. Anotación y codificación (hilo propio): `plot`, etiquetas, escritura de video y visualización.
+    Las colas acotadas entre etapas aplican backpressure: si una etapa va lenta, la anterior se bloquea
+    en lugar de acumular frames sin límite.
+    """
+    def __init__(self, config, detector, tire_counter, video_writer=None, display_window_title=None,
+                 tracker_session_id=None, batch_inference=False, on_frame_processed=None, sampler=None,
+                 stop_condition=None, roi=None, stage_timer=None):
+        """
+        Args:
+            config (AppConfig): Instancia de configuración.
+            detector (ObjectDetector): Detector compartido.
+            tire_counter (TireCounterLogic): Lógica de conteo (ya reseteada para el trabajo).
+            video_writer (IncrementalVideoWriter, optional): Writer del video de salida del trabajo.
+            display_window_title (str, optional): Título de la ventana de visualización.
+            tracker_session_id (str, optional): Sesión de tracking del trabajo en el detector.
+            batch_inference (bool, optional): Detectar en lotes (`processing.batch_inference`); requiere sesión.
+            on_frame_processed (callable, optional): Se llama con el índice de frame tras `process_job_detections`,
+                                                     en el hilo de inferencia (p. ej. emisión streaming de vehículos).
+            sampler (AdaptiveFrameSampler, optional): Compuerta de muestreo adaptativo previa a la inferencia.
+            stop_condition (callable, optional): Se llama con el índice de frame tras `on_frame_processed`; si
+                                                 devuelve True, el trabajo termina con ese frame (terminación temprana).
+            roi (RegionOfInterest, optional): Región de interés a la que se recortan los frames antes de inferir.
+            stage_timer (StageTimer, optional): Registra la duración de cada etapa por frame (decode, inference,
+                                                tire_logic, plot; el writer mide resize y video_write).
+        """
+        self.config = config
+        self.detector = detector
+        self.tire_counter = tire_counter
+        self.video_writer = video_writer
+        self.display_window_title = display_window_title
+        self.tracker_session_id = tracker_session_id
+        self.batch_inference = batch_inference
+        self.on_frame_processed = on_frame_processed
+        self.sampler = sampler
+        self.stop_condition = stop_condition
+        self.roi = roi
+        self.stage_timer = stage_timer or NULL_STAGE_TIMER
+        self.debug_mode = config.get('processing.debug_mode', False)
+        self.show_visualization = config.get('processing.show_visualization_per_job', False)
+        self.visualization_wait_key = config.get('processing.visualization_wait_key', 1)
+
+        self.stop_event = threading.Event()
+        self.decode_queue = _StageQueue("decode->inference", config.get('processing.pipeline.decode_queue_size', 8), self.stop_event)
+        self.annotate_queue = _StageQueue("inference->annotate", config.get('processing.pipeline.annotate_queue_size', 8), self.stop_event)
+        self.stage_stats = {name: _StageStats(name) for name in ("decode", "inference", "annotate")}
+
+        self.aborted_by_user = False
+        self.visualization_active = False
+        self.thread_errors = []
+        self.wall_seconds = 0.0
+
+    def _decode_stage(self, job_input_ctrl):
+        stats = self.stage_stats["decode"]
+        try:
+            while not self.stop_event.is_set():
+                t0 = time.perf_counter()
+                ret, frame, _ = job_input_ctrl.read_frame()
+                elapsed = time.perf_counter() - t0
+                stats.busy_seconds += elapsed
+                self.stage_timer.add("decode", elapsed)
+                if not ret: break
+                stats.items += 1
+                t0 = time.perf_counter()
+                if not self.decode_queue.put(frame): break
+                stats.wait_output_seconds += time.perf_counter() - t0
+        except Exception as e:
+            self.thread_errors.append(e)
+            self.stop_event.set()
+        finally:
+            self.decode_queue.put(_END_OF_STREAM)
+
+    def _annotate_stage(self):
+        stats = self.stage_stats["annotate"]
+        try:
+            while True:
+                t0 = time.perf_counter()
+                item = self.annotate_queue.get()
+                stats.wait_input_seconds += time.perf_counter() - t0
+                if item is _END_OF_STREAM: break
+
+                frame, yolo_results, vehicle_detections, tires_snapshot = item
+                t0 = time.perf_counter()
+                with self.stage_timer.measure("plot"):
+                    output_frame = annotate_frame(frame, yolo_results, vehicle_detections, tires_snapshot, self.config)
+                if self.video_writer: self.video_writer.write(output_frame)
+                if self.show_visualization:
+                    self.visualization_active = True
+                    cv2.imshow(self.display_window_title, output_frame)
+                    key_press = cv2.waitKey(self.visualization_wait_key) & 0xFF
+                    if key_press == ord('q'):
+                        self.aborted_by_user = True
+                        self.stop_event.set()
+                stats.busy_seconds += time.perf_counter() - t0
+                stats.items += 1
+        except Exception as e:
+            self.thread_errors.append(e)
+            self.stop_event.set()
+
+    def _iter_decoded_frames(self, job_input_ctrl):
+        """Fuente de frames de la etapa de inferencia: consume la cola de decodificación hasta el fin."""
+        stats = self.stage_stats["inference"]
+        while True:
+            t0 = time.perf_counter()
+            frame = self.decode_queue.get()
+            stats.wait_input_seconds += time.perf_counter() - t0
+            if frame is _END_OF_STREAM: return
+            yield frame, job_input_ctrl.get_original_frame_shape(frame)
+
+    def run(self, job_input_ctrl):
+        """
+        Ejecuta el pipeline completo para un trabajo.
+
+        Args:
+            job_input_ctrl (JobInputController): Fuente de frames del trabajo.
+
+        Returns:
+            bool: True si el trabajo se procesó completo, False si el usuario lo interrumpió.
+        """
+        t_start = time.perf_counter()
+        decode_thread = threading.Thread(target=self._decode_stage, args=(job_input_ctrl,), daemon=True)
+        annotate_thread = threading.Thread(target=self._annotate_stage, daemon=True)
+        decode_thread.start()
+        annotate_thread.start()
+
+        stats = self.stage_stats["inference"]
+        batch_size = 1
+        if self.batch_inference:
+            batch_size = self.config.get('processing.batch_inference.batch_size', 8)
+        frame_idx_job = 0
+        t_loop_start = time.perf_counter()
+        try:
+            # Inferencia por frame = tiempo de cada paso del generador menos la espera en la cola de decodificación
+            tracked_frames = self.stage_timer.timed_iter(self.detector.iter_tracked_frames(
+                    self._iter_decoded_frames(job_input_ctrl), batch_size=batch_size, session_id=self.tracker_session_id, sampler=self.sampler, roi=self.roi),
+                "inference", excluded_seconds=lambda: stats.wait_input_seconds)
+            for frame, original_frame_shape, yolo_results in tracked_frames:
+                frame_idx_job += 1
+                with self.stage_timer.measure("tire_logic"):
+                    vehicle_detections = self.tire_counter.process_job_detections(yolo_results, frame_idx_job, original_frame_shape)
+                if self.on_frame_processed: self.on_frame_processed(frame_idx_job)
+                # Instantánea de las ranuras de llantas: el estado sigue mutando mientras se anota este frame
+                tires_snapshot = {v_id: tuple(slots.keys()) for v_id, slots in self.tire_counter.vehicle_physical_tires_current_job.items()}
+                stats.items += 1
+
+                t0 = time.perf_counter()
+                if not self.annotate_queue.put((frame, yolo_results, vehicle_detections, tires_snapshot)): break
+                stats.wait_output_seconds += time.perf_counter() - t0
+                if self.stop_condition and self.stop_condition(frame_idx_job): break
+            # Tiempo ocupado = tiempo del bucle menos las esperas en ambas colas
+            stats.busy_seconds = time.perf_counter() - t_loop_start - stats.wait_input_seconds - stats.wait_output_seconds
+        except Exception:
+            self.stop_event.set()
+            raise
+        finally:
+            self.annotate_queue.put(_END_OF_STREAM)
+            annotate_thread.join()
+            self.stop_event.set() # Desbloquear el decodificador si aún espera espacio en su cola
+            decode_thread.join()
+            self.wall_seconds = time.perf_counter() - t_start
+
+        if self.thread_errors: raise self.thread_errors[0]
+        if self.debug_mode: self.print_stats_summary()
+        return not self.aborted_by_user
+
+    def get_stats_summary(self):
+        """
+        Devuelve las estadísticas de ocupación por etapa y por cola.
+        Una cola con ocupación media cercana a su máximo indica que la etapa que la consume
+        es el cuello de botella; una cola casi vacía indica que lo es la etapa que la llena.
+        """
+        return {
+            "wall_seconds": round(self.wall_seconds, 3),
+            "stages": {name: s.as_dict(self.wall_seconds) for name, s in self.stage_stats.items()},
+            "queues": {q.name: q.as_dict() for q in (self.decode_queue, self.annotate_queue)},
+        }
+
+    def print_stats_summary(self):
+        summary = self.get_stats_summary()
+        print(f"  [PIPELINE] Tiempo total: {summary['wall_seconds']:.2f}s")
+        for name, s in summary["stages"].items():
+            print(f"    Etapa '{name}': items={s['items']}, ocupada={s['busy_fraction']*100:.0f}%, espera entrada={s['wait_input_seconds']:.2f}s, espera salida={s['wait_output_seconds']:.2f}s")
+        for name, q in summary["queues"].items():
+            print(f"    Cola '{name}': ocupación media={q['avg_occupancy']}/{q['maxsize']} ({q['avg_fill_fraction']*100:.0f}%), máx={q['max_occupancy']}")
@@ -0,0 +1,322 @@
+# pipeline_benchmark.py
+"""
+Benchmark reproducible de extremo a extremo del procesado de trabajos (`process_job`, el mismo
+bucle de `job_processor_worker`), ejecutable sin `best.pt`.
+
+Genera secuencias sintéticas (carpetas de imágenes y/o videos) a las resoluciones y densidades de
+objetos indicadas y las procesa con un detector sustituto determinista (`StubObjectDetector`, que
+devuelve las cajas reales de la escena con una latencia fija opcional) o con el modelo real
+(`--detector model`). Mide cada etapa por frame o por trabajo: decode, inference, tire_logic, plot,
+resize, video_write, base64 (con `--video_transfer base64`) y send (HTTP a un receptor local en
+proceso, o a `--receptor_url`; incluye la subida del video en modo 'stream').
+
+El reporte JSON (`--output`) incluye el entorno (versiones, CPU, commit) y, por escenario, FPS y
+latencias por etapa (media, p50, p95, máx). Con `--baseline` se compara contra un reporte anterior
+y el proceso termina con código 1 si algún escenario pierde más de `--tolerance` de FPS.
+
+Uso:
+    python pipeline_benchmark.py --resolutions 1280x720 1920x1080 --vehicles 1 4 --output bench.json
+    python pipeline_benchmark.py --baseline bench_v1.json --output bench_v2.json
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from api_client import APIClient
+from config_loader import AppConfig
+from detections import FrameDetections
+from job_processing import process_job
+from stage_timing import JOB_STAGES, StageTimer
+from tracker_logic import TireCounterLogic
+
+# --- Secuencias sintéticas ---
+
+def _scene_geometry(width, height, num_vehicles, tires_per_vehicle, num_frames, frame_idx):
+    """Vehículos (uno por carril horizontal) y sus llantas en un frame. Devuelve [(caja, [cajas de llanta])]."""
+    lane_h = height / num_vehicles
+    veh_w = width * 0.4
+    progress = frame_idx / max(1, num_frames - 1)
+    vehicles = []
+    for v in range(num_vehicles):
+        phase = (progress + v * 0.37) % 1.0 # Carriles desfasados para que no se muevan en bloque
+        x1 = width * 0.02 + phase * (width * 0.96 - veh_w)
+        y1, y2 = v * lane_h + lane_h * 0.15, v * lane_h + lane_h * 0.8
+        radius = min(veh_w / (2 * (tires_per_vehicle + 1)), (y2 - y1) * 0.12)
+        tires = []
+        for t in range(tires_per_vehicle):
+            cx = x1 + (t + 0.5) * veh_w / tires_per_vehicle
+            cy = y2 - radius * 0.6
+            tires.append((cx - radius, cy - radius, cx + radius, cy + radius))
+        vehicles.append(((x1, y1, x1 + veh_w, y2), tires))
+    return vehicles
+
+def make_synthetic_job(job_path, source_type, width, height, num_vehicles, tires_per_vehicle, num_frames,
+                       vehicle_class_id, tire_class_id, seed=0):
+    """
+    Escribe una secuencia sintética (carpeta de JPG o video MP4) y devuelve la verdad de terreno.
+
+    Returns:
+        list: Por frame, (xyxy, cls, track_ids) en coordenadas del frame original.
+    """
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(60, 140, (height, width, 3), dtype=np.uint8), (0, 0), 3)
+    cv2.rectangle(background, (0, int(height * 0.9)), (width, height), (70, 70, 70), -1) # Calzada
+    video_writer = None
+    if source_type == "video_file":
+        video_writer = cv2.VideoWriter(str(job_path), cv2.VideoWriter_fourcc(*"mp4v"), 10, (width, height))
+        if not video_writer.isOpened(): raise RuntimeError(f"No se pudo crear el video sintético '{job_path}'.")
+    else:
+        Path(job_path).mkdir(parents=True, exist_ok=True)
+
+    scene = []
+    for frame_idx in range(num_frames):
+        frame = cv2.add(background, rng.integers(0, 8, background.shape, dtype=np.uint8)) # Ruido de sensor
+        xyxy, cls, ids = [], [], []
+        for v, (v_box, tires) in enumerate(_scene_geometry(width, height, num_vehicles, tires_per_vehicle, num_frames, frame_idx)):
+            cv2.rectangle(frame, (int(v_box[0]), int(v_box[1])), (int(v_box[2]), int(v_box[3])), (40 + 50 * v % 200, 90, 200), -1)
+            xyxy.append(v_box); cls.append(vehicle_class_id); ids.append(v + 1)
+            for t, t_box in enumerate(tires):
+                center = (int((t_box[0] + t_box[2]) / 2), int((t_box[1] + t_box[3]) / 2))
+                cv2.circle(frame, center, int((t_box[2] - t_box[0]) / 2), (20, 20, 20), -1)
+                xyxy.append(t_box); cls.append(tire_class_id); ids.append(1000 + v * tires_per_vehicle + t)
+        if video_writer is not None: video_writer.write(frame)
+        else: cv2.imwrite(str(Path(job_path) / f"frame_{frame_idx:05d}.jpg"), frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        scene.append((np.array(xyxy, dtype=np.float32), np.array(cls, dtype=np.float32), np.array(ids, dtype=np.float32)))
+    if video_writer is not None: video_writer.release()
+    return scene
+
+# --- Detector sustituto ---
+
+class StubObjectDetector:
+    """
+    Sustituto determinista de `ObjectDetector` para medir sin modelo: devuelve las cajas reales de la
+    escena sintética de cada trabajo (con IDs de tracking estables) tras una latencia fija opcional
+    que simula la inferencia. Implementa la parte de la interfaz que usa `process_job`
+    (sesiones de tracking e `iter_tracked_frames`); ignora lotes y ROI.
+    """
+    def __init__(self, config, scenes, latency_ms=0.0):
+        """
+        Args:
+            config (AppConfig): Configuración (nombres de clase).
+            scenes (dict): Nombre del trabajo -> verdad de terreno de `make_synthetic_job`.
+            latency_ms (float, optional): Latencia simulada por frame inferido.
+        """
+        self.scenes = scenes
+        self.latency_seconds = latency_ms / 1000.0
+        self.names = dict(enumerate(config.get('classes.names', [])))
+        self.debug_mode = False
+        self._sessions = {} # session_id -> [nombre del trabajo, índice del próximo frame]
+        self._session_counter = itertools.count(1)
+
+    def create_tracker_session(self, name="job", use_detection_cache=False):
+        session_id = f"{name}#{next(self._session_counter)}"
+        self._sessions[session_id] = [name, 0]
+        return session_id
+
+    def destroy_tracker_session(self, session_id):
+        self._sessions.pop(session_id, None)
+
+    def iter_tracked_frames(self, frame_source, batch_size=1, session_id=None, sampler=None, roi=None):
+        session = self._sessions[session_id]
+        scene = self.scenes[session[0]]
+        for frame, original_shape in frame_source:
+            frame_idx = session[1]
+            session[1] += 1
+            if sampler is not None and not sampler.should_infer(frame):
+                yield frame, original_shape, sampler.reuse_result(frame)
+                continue
+            if self.latency_seconds: time.sleep(self.latency_seconds)
+            xyxy, cls, ids = scene[min(frame_idx, len(scene) - 1)]
+            result = FrameDetections(frame, xyxy, np.full(len(xyxy), 0.9, dtype=np.float32), cls, track_ids=ids,
+                                     names=self.names, orig_shape=original_shape[:2])
+            if sampler is not None: sampler.observe(result)
+            yield frame, original_shape, result
+
+# --- Receptor HTTP local ---
+
+class _ReceptorHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        remaining = int(self.headers.get('Content-Length', 0))
+        if "/vehicle_video/" in self.path: # Video binario: se lee por bloques y se descarta
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                if not chunk: break
+                remaining -= len(chunk)
+            body = b""
+        else:
+            body = self.rfile.read(remaining)
+        try:
+            if body:
+                payload = json.loads(body)
+                self.server.received[payload.get('source_id')] = payload.get('tire_count')
+        except ValueError:
+            pass
+        response = b'{"status": "success"}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+def _start_local_receptor():
+    """Receptor mínimo en un hilo: lee el payload completo y responde 200, como `server_receptor.py`."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ReceptorHandler)
+    server.received = {} # source_id -> tire_count recibido
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api/vehicle_processed_data"
+
+# --- Ejecución ---
+
+def _environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=Path(__file__).resolve().parent, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor(),
+            "cpu_count": os.cpu_count(), "opencv": cv2.__version__, "numpy": np.__version__, "git_commit": commit}
+
+def _scenario_key(scenario):
+    return f"{scenario['source_type']}_{scenario['resolution']}_v{scenario['vehicles']}_t{scenario['tires_per_vehicle']}"
+
+def _compare_with_baseline(report, baseline_path, tolerance):
+    """Imprime la variación de FPS por escenario. Devuelve las claves con regresión."""
+    with open(baseline_path, "r", encoding="utf-8") as f: baseline = json.load(f)
+    baseline_fps = {s["key"]: s["fps"] for s in baseline.get("scenarios", [])}
+    regressions = []
+    print(f"[PIPELINE_BENCH] Comparación con '{baseline_path}' (tolerancia {tolerance:.0%}):")
+    for scenario in report["scenarios"]:
+        base = baseline_fps.get(scenario["key"])
+        if not base: continue
+        change = scenario["fps"] / base - 1.0
+        regressed = change < -tolerance
+        if regressed: regressions.append(scenario["key"])
+        print(f"  {scenario['key']:<40} {base:>8.1f} -> {scenario['fps']:>8.1f} FPS ({change:+.1%}){'  REGRESIÓN' if regressed else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo del procesado de trabajos con secuencias sintéticas.")
+    parser.add_argument("--config", type=str, default="config.yaml", help="Configuración base.")
+    parser.add_argument("--detector", choices=["stub", "model"], default="stub", help="Detector sustituto o modelo real.")
+    parser.add_argument("--stub_latency_ms", type=float, default=0.0, help="Latencia simulada por frame del detector sustituto.")
+    parser.add_argument("--sources", nargs="+", default=["image_folder", "video_file"], choices=["image_folder", "video_file"])
+    parser.add_argument("--resolutions", nargs="+", default=["1280x720", "1920x1080"], help="Resoluciones ANCHOxALTO.")
+    parser.add_argument("--vehicles", type=int, nargs="+", default=[1, 4], help="Vehículos por frame (densidad).")
+    parser.add_argument("--tires_per_vehicle", type=int, default=6, help="Llantas por vehículo.")
+    parser.add_argument("--frames", type=int, default=120, help="Frames por secuencia.")
+    parser.add_argument("--repeats", type=int, default=1, help="Repeticiones por escenario (se reporta la más rápida).")
+    parser.add_argument("--pipeline", action="store_true", help="Usar el modo pipeline (processing.pipeline) en lugar del bucle en serie.")
+    parser.add_argument("--no_video", action="store_true", help="No generar el video anotado del payload.")
+    parser.add_argument("--video_codec", type=str, default=None, help="Codec del video anotado (por defecto, el de la configuración).")
+    parser.add_argument("--video_transfer", choices=("stream", "base64"), default=None,
+                        help="Envío del video anotado (por defecto, 'processing.payload_video.transfer_mode').")
+    parser.add_argument("--receptor_url", type=str, default=None, help="URL de un receptor real (por defecto, receptor local en proceso).")
+    parser.add_argument("--no_send", action="store_true", help="No enviar los resultados por HTTP.")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla de las secuencias sintéticas.")
+    parser.add_argument("--work_dir", type=str, default=None, help="Carpeta para las secuencias (por defecto, temporal).")
+    parser.add_argument("--output", type=str, default=None, help="Archivo JSON donde guardar el reporte.")
+    parser.add_argument("--baseline", type=str, default=None, help="Reporte JSON anterior con el que comparar.")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Pérdida de FPS tolerada frente a la línea base.")
+    args = parser.parse_args()
+
+    receptor, receptor_url = None, args.receptor_url
+    if not args.no_send and not receptor_url: receptor, receptor_url = _start_local_receptor()
+    overrides = {
+        'processing.debug_mode': False, 'processing.show_visualization_per_job': False,
+        'processing.pipeline.enabled': args.pipeline, 'processing.batch_inference.enabled': False,
+        'processing.streaming_emission.enabled': False, 'processing.early_termination.enabled': False,
+        'processing.frame_sampling.enabled': False, 'model.detection_cache.enabled': False,
+        'processing.payload_video.include_processed_video': not args.no_video,
+        'external_server.enabled': not args.no_send, 'external_server.url': receptor_url,
+        'external_server.video_upload_url': None, # Derivada de la URL del receptor
+        'external_server.delivery.async_enabled': False, # 'send' mide la entrega completa (y el receptor ya tiene el conteo)
+        'external_server.batching.enabled': False,
+        'source.image_folder_glob': "*.jpg", 'source.roi': {},
+    }
+    if args.video_codec: overrides['processing.payload_video.output_video_codec'] = args.video_codec
+    if args.video_transfer: overrides['processing.payload_video.transfer_mode'] = args.video_transfer
+    cfg = AppConfig(config_path_str=args.config).with_overrides(overrides)
+    if cfg.tire_class_id == -1 or not cfg.vehicle_class_ids:
+        print("[PIPELINE_BENCH] La configuración no define clases de llanta/vehículo.")
+        return
+    class_names = cfg.get('classes.names', [])
+    vehicle_class_id = class_names.index("Truck") if "Truck" in class_names else cfg.vehicle_class_ids[0]
+
+    scenarios = [{"source_type": source_type, "resolution": resolution, "vehicles": vehicles, "tires_per_vehicle": args.tires_per_vehicle}
+                 for source_type in args.sources for resolution in args.resolutions for vehicles in args.vehicles]
+    work_dir_ctx = tempfile.TemporaryDirectory(prefix="pipeline_bench_") if not args.work_dir else None
+    work_dir = Path(args.work_dir or work_dir_ctx.name)
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    print(f"[PIPELINE_BENCH] Generando {len(scenarios)} secuencias sintéticas de {args.frames} frames en {work_dir}...")
+    scenes = {}
+    for scenario in scenarios:
+        scenario["key"] = _scenario_key(scenario)
+        width, height = (int(v) for v in scenario["resolution"].lower().split("x"))
+        job_path = work_dir / (scenario["key"] + (".mp4" if scenario["source_type"] == "video_file" else ""))
+        scenes[job_path.name] = make_synthetic_job(job_path, scenario["source_type"], width, height, scenario["vehicles"],
+                                                   args.tires_per_vehicle, args.frames, vehicle_class_id, cfg.tire_class_id, args.seed)
+        scenario["job_path"] = str(job_path)
+
+    if args.detector == "model":
+        from detector import ObjectDetector # Requiere ultralytics y el modelo configurado
+        detector = ObjectDetector(cfg)
+    else:
+        detector = StubObjectDetector(cfg, scenes, latency_ms=args.stub_latency_ms)
+    tire_counter = TireCounterLogic(cfg)
+    api_client = APIClient(cfg) if not args.no_send else None
+
+    report = {"benchmark": "pipeline", "created_at": datetime.datetime.now().isoformat(), "environment": _environment(),
+              "settings": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "work_dir")}, "scenarios": []}
+    try:
+        for scenario in scenarios:
+            best = None
+            for _ in range(args.repeats):
+                stage_timer = StageTimer()
+                summary = process_job({'type': scenario["source_type"], 'path': scenario["job_path"]}, cfg, detector, tire_counter,
+                                      api_client, stage_timer=stage_timer)
+                if best is None or summary["wall_seconds"] < best[0]["wall_seconds"]: best = (summary, stage_timer)
+            summary, stage_timer = best
+            row = {"key": scenario["key"], "source_type": scenario["source_type"], "resolution": scenario["resolution"],
+                   "vehicles": scenario["vehicles"], "tires_per_vehicle": scenario["tires_per_vehicle"],
+                   "frames": summary["frames"], "success": summary["success"],
+                   "wall_seconds": round(summary["wall_seconds"], 3),
+                   "fps": round(summary["frames"] / summary["wall_seconds"], 2) if summary["wall_seconds"] > 0 else 0.0,
+                   "expected_tire_count": scenario["tires_per_vehicle"],
+                   "tire_count": receptor.received.get(Path(scenario["job_path"]).name) if receptor else None,
+                   "stages": stage_timer.summary()}
+            report["scenarios"].append(row)
+    finally:
+        if receptor: receptor.shutdown()
+        if work_dir_ctx: work_dir_ctx.cleanup()
+
+    print(f"\n{'escenario':<40} {'frames':>6} {'FPS':>8} " + " ".join(f"{stage[:11]:>11}" for stage in JOB_STAGES) + "   (ms medios)")
+    for row in report["scenarios"]:
+        stage_means = " ".join(f"{row['stages'][stage]['mean_ms']:>11.2f}" if stage in row["stages"] else f"{'-':>11}"
+                               for stage in JOB_STAGES)
+        print(f"{row['key']:<40} {row['frames']:>6} {row['fps']:>8.1f} {stage_means}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: json.dump(report, f, indent=2)
+        print(f"[PIPELINE_BENCH] Reporte guardado en: {args.output}")
+    if args.baseline and _compare_with_baseline(report, args.baseline, args.tolerance):
+        print("[PIPELINE_BENCH] Hay escenarios con regresión de rendimiento.")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+# profiling.py
+import cProfile
+import datetime
+import io
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from stage_timing import FRAME_STAGE, NULL_STAGE_TIMER, StageTimer
+
+PROFILING_MODES = ("cprofile", "sampling")
+
+class _SamplingProfiler:
+    """
+    Perfilador por muestreo de un hilo: cada `interval` segundos un hilo auxiliar captura la pila del
+    hilo perfilado (`sys._current_frames`). El hilo perfilado no ejecuta nada extra.
+    """
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter() # tupla de funciones (raíz -> hoja) -> muestras
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample_loop, name="sampling_profiler", daemon=True)
+        self._thread.start()
+
+    def _sample_loop(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack: self.stacks[tuple(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread: self._thread.join()
+
+class _FrameBudgetTimer(StageTimer):
+    """`StageTimer` que cuenta los frames del trabajo perfilado y delega cada muestra en el temporizador original."""
+    def __init__(self, inner, session):
+        super().__init__()
+        self.inner = inner or NULL_STAGE_TIMER
+        self.session = session
+
+    def add(self, stage, seconds):
+        with self._lock: self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+        self.inner.add(stage, seconds)
+        if stage == FRAME_STAGE: self.session.count_frame()
+
+class _JobProfilingSession:
+    """Perfilado de un trabajo dentro de una petición de perfilado (se detiene al agotar el presupuesto de frames)."""
+    def __init__(self, job_name, mode, frames_budget, sampling_interval):
+        self.job_name = job_name
+        self.mode = mode
+        self.frames_budget = frames_budget # None = todo el trabajo
+        self.frames = 0
+        self.profiler = cProfile.Profile() if mode == "cprofile" else _SamplingProfiler(threading.get_ident(), sampling_interval)
+        self.running = False
+        self.t_start = self.t_stop = None
+
+    def start(self):
+        self.t_start = time.perf_counter()
+        if self.mode == "cprofile": self.profiler.enable()
+        else: self.profiler.start()
+        self.running = True
+
+    def stop(self):
+        if not self.running: return
+        self.running = False
+        self.t_stop = time.perf_counter()
+        if self.mode == "cprofile": self.profiler.disable()
+        else: self.profiler.stop()
+
+    def count_frame(self):
+        if not self.running: return
+        self.frames += 1
+        if self.frames_budget is not None and self.frames >= self.frames_budget: self.stop()
+
+    def stage_timer(self, inner):
+        """Temporizador para `process_job` (necesario para contar frames; envuelve el de las métricas)."""
+        return _FrameBudgetTimer(inner, self)
+
+class ProfilingController:
+    """
+    Perfilado bajo demanda de `job_processor_worker` desde el servidor de comandos: se activa para los
+    próximos N trabajos o N frames, con cProfile (determinista) o por muestreo de pila (bajo coste).
+    Los resultados de todos los trabajos de la petición se agregan y se escriben en `output_dir`:
+    el perfil (`.prof` para pstats/snakeviz, o pilas `.collapsed` para flame graphs) y un resumen
+    por función (`_summary.txt`).
+    Sin petición activa el trabajador solo consulta `armed` una vez por trabajo.
+    Se perfila un trabajo a la vez: con varios hilos trabajadores, los demás siguen sin perfilar.
+    """
+    def __init__(self, output_dir="profiles", sampling_interval_ms=5, top_functions=40):
+        """
+        Args:
+            output_dir (str): Carpeta donde se guardan los perfiles.
+            sampling_interval_ms (float, optional): Intervalo por defecto del perfilador por muestreo.
+            top_functions (int, optional): Funciones listadas en los resúmenes.
+        """
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.default_sampling_interval_ms = sampling_interval_ms
+        self.top_functions = top_functions
+        self.armed = False
+        self._lock = threading.Lock()
+        self._request = None # Petición en curso (dict)
+        self._active_session = None
+        self.completed = [] # Peticiones terminadas, con sus archivos
+
+    def start(self, mode="cprofile", jobs=None, frames=None, sampling_interval_ms=None):
+        """
+        Arma el perfilado para los próximos `jobs` trabajos o `frames` frames.
+
+        Raises:
+            ValueError: Si los parámetros no son válidos.
+            RuntimeError: Si ya hay una petición de perfilado en curso.
+        """
+        if mode not in PROFILING_MODES: raise ValueError(f"'mode' debe ser uno de {PROFILING_MODES}.")
+        if (jobs is None) == (frames is None): raise ValueError("Indique 'jobs' o 'frames' (solo uno).")
+        count = jobs if jobs is not None else frames
+        if not isinstance(count, int) or isinstance(count, bool) or count <= 0:
+            raise ValueError("'jobs'/'frames' debe ser un entero positivo.")
+        interval_ms = sampling_interval_ms or self.default_sampling_interval_ms
+        if interval_ms <= 0: raise ValueError("'sampling_interval_ms' debe ser positivo.")
+        with self._lock:
+            if self._request is not None: raise RuntimeError("Ya hay un perfilado en curso.")
+            self._request = {"mode": mode, "jobs_target": jobs, "frames_target": frames,
+                             "sampling_interval_ms": interval_ms, "requested_at": datetime.datetime.now().isoformat(),
+                             "jobs_profiled": 0, "frames_profiled": 0, "job_names": [], "wall_seconds": 0.0,
+                             "profiles": [], "stacks": Counter()}
+            self.armed = True
+        print(f"[PROFILING] Perfilado {mode} armado para los próximos {count} {'trabajos' if jobs else 'frames'}.")
+        return self.get_status()
+
+    def begin_job(self, job_name):
+        """Empieza a perfilar el trabajo en el hilo actual. Devuelve la sesión o None (sin petición o ya ocupada)."""
+        with self._lock:
+            request = self._request
+            if request is None or self._active_session is not None: return None
+            frames_budget = request["frames_target"] - request["frames_profiled"] if request["frames_target"] else None
+            session = _JobProfilingSession(job_name, request["mode"], frames_budget, request["sampling_interval_ms"] / 1000.0)
+            self._active_session = session
+        session.start()
+        return session
+
+    def end_job(self, session):
+        """Termina el perfilado del trabajo; si la petición se completa, escribe los resultados."""
+        session.stop()
+        finished_request = None
+        with self._lock:
+            request = self._request
+            self._active_session = None
+            request["jobs_profiled"] += 1
+            request["frames_profiled"] += session.frames
+            request["job_names"].append(session.job_name)
+            request["wall_seconds"] += session.t_stop - session.t_start
+            if request["mode"] == "cprofile": request["profiles"].append(session.profiler)
+            else: request["stacks"].update(session.profiler.stacks)
+            done = request["jobs_profiled"] >= request["jobs_target"] if request["jobs_target"] else \
+                request["frames_profiled"] >= request["frames_target"]
+            if done:
+                finished_request, self._request, self.armed = request, None, False
+        if finished_request: self._write_results(finished_request)
+
+    def _write_results(self, request):
+        base_name = f"{datetime.datetime.now():%Y%m%d_%H%M%S}_{request['mode']}"
+        header = (f"Perfil {request['mode']} de {request['jobs_profiled']} trabajo(s), {request['frames_profiled']} frames, "
+                  f"{request['wall_seconds']:.2f}s ({', '.join(request['job_names'])})\n\n")
+        summary = io.StringIO()
+        summary.write(header)
+        if request["mode"] == "cprofile":
+            profile_file = f"{base_name}.prof"
+            stats = pstats.Stats(request["profiles"][0], stream=summary)
+            for profiler in request["profiles"][1:]: stats.add(profiler)
+            stats.dump_stats(str(self.output_dir / profile_file))
+            stats.sort_stats("cumulative").print_stats(self.top_functions)
+            stats.sort_stats("tottime").print_stats(self.top_functions)
+        else:
+            profile_file = f"{base_name}.collapsed"
+            stacks = request["stacks"]
+            with open(self.output_dir / profile_file, "w", encoding="utf-8") as f:
+                for stack, count in stacks.most_common(): f.write(f"{';'.join(stack)} {count}\n")
+            self._write_sampling_summary(summary, stacks, request["sampling_interval_ms"])
+        summary_file = f"{base_name}_summary.txt"
+        with open(self.output_dir / summary_file, "w", encoding="utf-8") as f: f.write(summary.getvalue())
+        result = {k: v for k, v in request.items() if k not in ("profiles", "stacks")}
+        result.update({"profile_file": profile_file, "summary_file": summary_file})
+        with self._lock: self.completed.append(result)
+        print(f"[PROFILING] Perfil guardado: {self.output_dir / profile_file} (resumen: {summary_file})")
+
+    def _write_sampling_summary(self, out, stacks, interval_ms):
+        total = sum(stacks.values())
+        self_counts, total_counts = Counter(), Counter()
+        for stack, count in stacks.items():
+            self_counts[stack[-1]] += count
+            for function in set(stack): total_counts[function] += count
+        out.write(f"{total} muestras cada {interval_ms} ms\n")
+        for title, counts in (("Tiempo propio (hoja de la pila)", self_counts), ("Tiempo total (en la pila)", total_counts)):
+            out.write(f"\n{title}:\n{'muestras':>9} {'%':>6}  función\n")
+            for function, count in counts.most_common(self.top_functions):
+                out.write(f"{count:>9} {100.0 * count / total if total else 0.0:>6.1f}  {function}\n")
+
+    def get_status(self):
+        """Petición en curso (si hay), peticiones terminadas y archivos descargables de `output_dir`."""
+        with self._lock:
+            current = None
+            if self._request is not None:
+                current = {k: v for k, v in self._request.items() if k not in ("profiles", "stacks")}
+            completed = list(self.completed)
+        files = sorted(p.name for p in self.output_dir.iterdir() if p.is_file())
+        return {"armed": self.armed, "current": current, "completed": completed, "files": files}
@@ -0,0 +1,223 @@
+# result_spool.py
+import datetime
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import deque
+from pathlib import Path
+
+_SEGMENT_PREFIX = "segment_"
+_SEGMENT_SUFFIX = ".jsonl"
+_ACK_FILE = "ack.json"
+_DEAD_LETTER_FILE = "dead_letter.jsonl"
+_VIDEOS_DIR = "videos"
+_DEAD_LETTER_VIDEOS_DIR = "dead_letter_videos"
+
+class ResultSpool:
+    """
+    Cola persistente (solo anexado) de lotes de resultados pendientes de entrega.
+    Cada lote es una línea JSON ({'seq', 'batch_id', 'payloads'} y, si tiene videos por subir,
+    'videos': {índice del payload: ruta}) en segmentos `segment_<seq>.jsonl`; los videos se guardan en
+    `videos/` hasta que se entrega su lote. `ack.json` guarda el último `seq` entregado (escritura atómica).
+    Los segmentos ya entregados se eliminan y los lotes que el receptor rechaza de forma permanente se
+    apartan en `dead_letter.jsonl` (con sus videos en `dead_letter_videos/`).
+    Tras un reinicio, los lotes no confirmados se vuelven a entregar en orden.
+    Cada proceso debe usar su propia carpeta.
+    """
+    def __init__(self, spool_dir, max_segment_bytes=16 * 1024 * 1024, fsync=True):
+        """
+        Args:
+            spool_dir (str): Carpeta del spool (se crea si no existe).
+            max_segment_bytes (int, optional): Tamaño a partir del cual se empieza un segmento nuevo.
+            fsync (bool, optional): Forzar cada lote a disco antes de darlo por guardado.
+        """
+        self.spool_dir = Path(spool_dir)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.max_segment_bytes = max_segment_bytes
+        self.fsync = fsync
+        self.videos_dir = self.spool_dir / _VIDEOS_DIR
+        self.videos_dir.mkdir(exist_ok=True)
+        self._lock = threading.Lock()
+        self.acked_seq = self._load_ack()
+        self._pending_seqs = deque() # `seq` legibles y sin confirmar, en orden
+        pending_videos = set()
+        last_seq = self.acked_seq
+        for segment in self._segments():
+            self._repair_segment_tail(segment)
+            if segment.stat().st_size == 0:
+                segment.unlink() # Solo contenía una escritura interrumpida
+                continue
+            last_seq = max(last_seq, self._segment_first_seq(segment))
+            for seq, record in self._read_segment(segment):
+                last_seq = max(last_seq, seq)
+                if seq > self.acked_seq:
+                    self._pending_seqs.append(seq)
+                    pending_videos.update(Path(p).name for p in (record.get("videos") or {}).values())
+        # Videos de lotes ya entregados o que nunca llegaron a guardarse (caída entre ambos pasos)
+        for video in self.videos_dir.iterdir():
+            if video.name not in pending_videos: video.unlink(missing_ok=True)
+        # Mayor que cualquier `seq` y nombre de segmento existentes: los segmentos nuevos nunca colisionan
+        self.next_seq = last_seq + 1
+        self._current_segment = None
+        self._current_size = 0
+        if self._pending_seqs: print(f"[RESULT_SPOOL] {len(self._pending_seqs)} lote(s) pendientes de una ejecución anterior en '{self.spool_dir}'.")
+
+    def _load_ack(self):
+        try:
+            with open(self.spool_dir / _ACK_FILE, "r", encoding="utf-8") as f: return int(json.load(f)["acked_seq"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0
+
+    @staticmethod
+    def _segment_first_seq(path):
+        return int(path.stem[len(_SEGMENT_PREFIX):])
+
+    def _segments(self):
+        """Segmentos ordenados por el `seq` de su primer lote."""
+        return sorted(self.spool_dir.glob(f"{_SEGMENT_PREFIX}*{_SEGMENT_SUFFIX}"), key=self._segment_first_seq)
+
+    def _repair_segment_tail(self, path):
+        """Recorta una última línea sin salto de línea (escritura interrumpida por una caída)."""
+        size = path.stat().st_size
+        if size == 0: return
+        with open(path, "rb+") as f:
+            f.seek(size - 1)
+            if f.read(1) == b"\n": return
+            # Buscar el último salto de línea hacia atrás, por bloques
+            end, block = size, 64 * 1024
+            keep = 0
+            while end > 0:
+                start = max(0, end - block)
+                f.seek(start)
+                newline_pos = f.read(end - start).rfind(b"\n")
+                if newline_pos != -1:
+                    keep = start + newline_pos + 1
+                    break
+                end = start
+            f.truncate(keep)
+        print(f"[RESULT_SPOOL] ADVERTENCIA: '{path.name}' terminaba en un lote incompleto ({size - keep} bytes); se descarta.")
+
+    @staticmethod
+    def _read_segment(path):
+        """(seq, registro) de cada lote legible del segmento."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line_number, line in enumerate(f, 1):
+                    try:
+                        record = json.loads(line)
+                        seq = int(record["seq"])
+                    except (ValueError, KeyError, TypeError):
+                        print(f"[RESULT_SPOOL] ADVERTENCIA: Línea {line_number} de '{path.name}' no válida; se ignora.")
+                        continue
+                    yield seq, record
+        except OSError:
+            return
+
+    def keep_video(self, video_path):
+        """Mueve un video a la carpeta del spool (sobrevive a un reinicio hasta entregar su lote). Devuelve la nueva ruta."""
+        target = self.videos_dir / f"{uuid.uuid4().hex[:8]}_{Path(video_path).name}"
+        shutil.move(str(video_path), str(target))
+        return str(target)
+
+    def append(self, batch_id, payloads, videos=None):
+        """Guarda un lote al final del spool (`videos`: {índice del payload: ruta de `keep_video`}). Devuelve su `seq`."""
+        with self._lock:
+            seq = self.next_seq
+            record = {"seq": seq, "batch_id": batch_id, "payloads": payloads}
+            if videos: record["videos"] = {str(index): path for index, path in videos.items()}
+            line = json.dumps(record, ensure_ascii=False) + "\n"
+            data = line.encode("utf-8")
+            if self._current_segment is None or self._current_size + len(data) > self.max_segment_bytes:
+                self._current_segment = self.spool_dir / f"{_SEGMENT_PREFIX}{seq:012d}{_SEGMENT_SUFFIX}"
+                self._current_size = 0
+            with open(self._current_segment, "ab") as f:
+                f.write(data)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._current_size += len(data)
+            self._pending_seqs.append(seq)
+            self.next_seq = seq + 1
+            return seq
+
+    @staticmethod
+    def is_spool_dir(path):
+        """True si la carpeta contiene un spool (segmentos o `ack.json`)."""
+        path = Path(path)
+        return path.is_dir() and ((path / _ACK_FILE).exists() or any(path.glob(f"{_SEGMENT_PREFIX}*{_SEGMENT_SUFFIX}")))
+
+    def adopt(self, other_dir):
+        """
+        Pasa a este spool (en orden, con sus videos) los lotes pendientes de otra carpeta, p. ej. de un
+        worker que ya no existe, y la elimina si no guarda descartes. Los lotes conservan su `batch_id`:
+        si se interrumpe a medias, el receptor ignora los que se envíen dos veces. Devuelve cuántos pasó.
+        """
+        other = ResultSpool(other_dir, max_segment_bytes=self.max_segment_bytes, fsync=self.fsync)
+        adopted = 0
+        for seq, record in other.iter_pending():
+            videos = {int(index): self.keep_video(path) for index, path in (record.get("videos") or {}).items()
+                      if os.path.exists(path)}
+            self.append(record["batch_id"], record["payloads"], videos)
+            other.ack(seq)
+            adopted += 1
+        if not (other.spool_dir / _DEAD_LETTER_FILE).exists(): shutil.rmtree(other.spool_dir, ignore_errors=True)
+        return adopted
+
+    def iter_pending(self):
+        """Recorre en orden los lotes aún no confirmados: (seq, registro)."""
+        for segment in self._segments():
+            for seq, record in self._read_segment(segment):
+                if seq > self.acked_seq: yield seq, record
+
+    def pending_count(self):
+        """Lotes legibles pendientes de confirmar (los que `iter_pending` puede entregar)."""
+        with self._lock: return len(self._pending_seqs)
+
+    def dead_letter(self, record, reason):
+        """
+        Aparta en `dead_letter.jsonl` un lote rechazado de forma permanente, con sus videos en
+        `dead_letter_videos/` (luego hay que confirmarlo con `ack`).
+        """
+        entry = {"dead_lettered_at": datetime.datetime.now().isoformat(), "reason": reason, **record}
+        if record.get("videos"):
+            dead_videos_dir = self.spool_dir / _DEAD_LETTER_VIDEOS_DIR
+            dead_videos_dir.mkdir(exist_ok=True)
+            entry["videos"] = {}
+            for index, path in record["videos"].items():
+                target = dead_videos_dir / Path(path).name
+                try:
+                    shutil.move(path, str(target))
+                    entry["videos"][index] = str(target)
+                except OSError:
+                    entry["videos"][index] = None # Ya no existe
+        with self._lock, open(self.spool_dir / _DEAD_LETTER_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def ack(self, seq):
+        """Marca como entregados los lotes hasta `seq` (incluido) y elimina los segmentos ya entregados."""
+        with self._lock:
+            if seq <= self.acked_seq: return
+            self.acked_seq = seq
+            while self._pending_seqs and self._pending_seqs[0] <= seq: self._pending_seqs.popleft()
+            tmp_path = self.spool_dir / (_ACK_FILE + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"acked_seq": seq}, f)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, self.spool_dir / _ACK_FILE)
+            segments = self._segments()
+            for i, segment in enumerate(segments):
+                # Un segmento está entregado si el siguiente empieza después de lo confirmado (o si todo está confirmado)
+                next_first_seq = self._segment_first_seq(segments[i + 1]) if i + 1 < len(segments) else self.next_seq
+                if next_first_seq - 1 > seq: break
+                try:
+                    segment.unlink()
+                except OSError:
+                    break
+                if segment == self._current_segment: self._current_segment = None
@@ -0,0 +1,125 @@
+# roi.py
+import cv2
+import numpy as np
+
+from detections import FrameDetections
+
+class RegionOfInterest:
+    """
+    Región de interés de una cámara fija (polígono o rectángulo, en píxeles del frame original).
+    Antes de la inferencia el frame se recorta al rectángulo que contiene la región y, si es un
+    polígono, se enmascara (negro) todo lo que queda fuera. Las cajas detectadas en el recorte se
+    devuelven en coordenadas del frame completo, de modo que `TireCounterLogic` y el video anotado
+    no notan la diferencia.
+    """
+    def __init__(self, polygon, is_rect=False):
+        """
+        Args:
+            polygon (array-like): Vértices (N, 2) en coordenadas del frame original.
+            is_rect (bool, optional): La región es un rectángulo (no requiere máscara).
+        """
+        self.polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+        self.is_rect = is_rect
+        self._cache_key = None
+        self._cached_window = None # (x1, y1, x2, y2) en coordenadas del frame recibido
+        self._cached_mask = None # Máscara uint8 del recorte (None para rectángulos)
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Construye la región a partir de la configuración o del payload de un trabajo.
+
+        Args:
+            spec (dict): {"rect": [x1, y1, x2, y2]} o {"polygon": [[x, y], [x, y], ...]}.
+
+        Returns:
+            RegionOfInterest or None: None si `spec` está vacío.
+
+        Raises:
+            ValueError: Si la especificación no es válida.
+        """
+        if not spec: return None
+        if not isinstance(spec, dict):
+            raise ValueError("La ROI debe ser un objeto con 'rect' o 'polygon'.")
+        try:
+            if spec.get('rect') is not None:
+                x1, y1, x2, y2 = (float(v) for v in spec['rect'])
+                if x2 <= x1 or y2 <= y1: raise ValueError("'rect' debe cumplir x1 < x2 e y1 < y2.")
+                return cls([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], is_rect=True)
+            if spec.get('polygon') is not None:
+                polygon = np.asarray(spec['polygon'], dtype=np.float64)
+                if polygon.ndim != 2 or polygon.shape[1] != 2 or len(polygon) < 3:
+                    raise ValueError("'polygon' debe ser una lista de al menos 3 puntos [x, y].")
+                return cls(polygon)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"ROI inválida: {e}")
+        raise ValueError("La ROI debe definir 'rect' o 'polygon'.")
+
+    def to_spec(self):
+        """Especificación serializable (JSON) de la región."""
+        if self.is_rect:
+            return {"rect": [float(v) for v in (*self.polygon.min(axis=0), *self.polygon.max(axis=0))]}
+        return {"polygon": self.polygon.tolist()}
+
+    def _prepare_geometry(self, frame_shape, original_shape):
+        """Ventana de recorte y máscara para un tamaño de frame (cacheadas: la cámara no cambia)."""
+        key = (tuple(frame_shape[:2]), tuple(original_shape[:2]))
+        if key == self._cache_key: return
+        fh, fw = frame_shape[:2]
+        oh, ow = original_shape[:2]
+        # La región está en píxeles del frame original; el frame puede venir decodificado a escala reducida
+        points = self.polygon * np.array([fw / ow, fh / oh])
+        x1, y1 = np.floor(points.min(axis=0)).astype(int)
+        x2, y2 = np.ceil(points.max(axis=0)).astype(int)
+        x1, y1, x2, y2 = max(0, x1), max(0, y1), min(fw, x2), min(fh, y2)
+        if x2 <= x1 or y2 <= y1: # Región fuera del frame: se procesa el frame completo
+            print(f"[ROI] ADVERTENCIA: la ROI {self.to_spec()} no intersecta el frame {fw}x{fh}. Se ignora.")
+            x1, y1, x2, y2 = 0, 0, fw, fh
+            mask = None
+        elif self.is_rect:
+            mask = None
+        else:
+            mask = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+            cv2.fillPoly(mask, [np.round(points - [x1, y1]).astype(np.int32)], 255)
+        self._cache_key, self._cached_window, self._cached_mask = key, (x1, y1, x2, y2), mask
+
+    def apply(self, frame, original_shape=None):
+        """
+        Recorta (y enmascara) el frame a la región.
+
+        Args:
+            frame (numpy.ndarray): Frame recibido (posiblemente a escala reducida).
+            original_shape (tuple, optional): Shape del frame original. Por defecto, la del frame.
+
+        Returns:
+            numpy.ndarray: Imagen de la región, lista para la inferencia.
+        """
+        self._prepare_geometry(frame.shape, original_shape or frame.shape)
+        x1, y1, x2, y2 = self._cached_window
+        crop = frame[y1:y2, x1:x2]
+        if self._cached_mask is None: return np.ascontiguousarray(crop)
+        return cv2.bitwise_and(crop, crop, mask=self._cached_mask)
+
+    def map_result(self, result, frame, original_shape=None):
+        """
+        Lleva un resultado obtenido sobre `apply(frame)` al espacio del frame original.
+
+        Args:
+            result (Results or FrameDetections or None): Resultado sobre la imagen de la región.
+            frame (numpy.ndarray): Frame completo (se asocia al resultado para dibujar).
+            original_shape (tuple, optional): Shape del frame original. Por defecto, la del frame.
+
+        Returns:
+            FrameDetections or None: Detecciones en coordenadas del frame original.
+        """
+        if result is None: return None
+        original_shape = original_shape or frame.shape
+        self._prepare_geometry(frame.shape, original_shape)
+        x1, y1, _, _ = self._cached_window
+        scale_x, scale_y = original_shape[1] / frame.shape[1], original_shape[0] / frame.shape[0]
+        detections = FrameDetections.from_yolo_results(result)
+        xyxy = (detections.boxes.xyxy.numpy() + np.array([x1, y1, x1, y1], dtype=np.float32)) \
+            * np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        track_ids = detections.boxes.id.numpy() if detections.boxes.id is not None else None
+        return FrameDetections(frame, xyxy, detections.boxes.conf.numpy(), detections.boxes.cls.numpy(),
+                               track_ids=track_ids, names=detections.names, orig_shape=original_shape[:2])
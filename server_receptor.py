@@ -3,12 +3,23 @@ import datetime
 import json
 import os
 import base64
+import gzip
+import io
+import threading
 from pathlib import Path # Para manejo de rutas
 
+try: # Opcional: lotes comprimidos con zstd
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # --- Configuración e Inicialización ---
 SERVER_DEBUG_MODE = True # Default, se intentará sobreescribir con config
 VIDEO_CODEC_CONFIG = 'mp4v' # Default
 VIDEO_EXTENSION_CONFIG = '.mp4' # Default
+VIDEO_UPLOAD_CHUNK_BYTES = 1024 * 1024 # Default: bloques de 1 MB al escribir videos subidos
+VIDEO_UPLOAD_MAX_BYTES = 2048 * 1024 * 1024 # Default: 2 GB por video subido
+BATCH_MAX_DECOMPRESSED_BYTES = 256 * 1024 * 1024 # Default: 256 MB por lote descomprimido
 
 try:
     # Asumimos que config_loader.py y config.yaml están accesibles
@@ -21,6 +32,9 @@ try:
     payload_video_config = cfg_receptor_app.get('processing.payload_video', {})
     VIDEO_CODEC_CONFIG = payload_video_config.get('output_video_codec', 'mp4v')
     VIDEO_EXTENSION_CONFIG = payload_video_config.get('output_video_extension', '.mp4')
+    VIDEO_UPLOAD_CHUNK_BYTES = int(cfg_receptor_app.get('external_server.receptor_video_chunk_kb', 1024)) * 1024
+    VIDEO_UPLOAD_MAX_BYTES = int(cfg_receptor_app.get('external_server.receptor_max_video_mb', 2048)) * 1024 * 1024
+    BATCH_MAX_DECOMPRESSED_BYTES = int(cfg_receptor_app.get('external_server.receptor_max_batch_mb', 256)) * 1024 * 1024
     print(f"[SERVER_RECEPTOR] debug_mode: {SERVER_DEBUG_MODE}, video_codec_config: {VIDEO_CODEC_CONFIG}, video_ext_config: {VIDEO_EXTENSION_CONFIG}")
 except ImportError:
     print("[SERVER_RECEPTOR] ADVERTENCIA: No se pudo importar AppConfig de config_loader. Usando SERVER_DEBUG_MODE=True y codecs/extensión por defecto.")
@@ -32,7 +46,7 @@ except Exception as e_cfg_load:
 app = Flask(__name__) # Crear instancia de la aplicación Flask
 # Guardar nuestro debug_mode en la config de Flask para acceso en endpoints
 app.config['SERVER_DEBUG_MODE'] = SERVER_DEBUG_MODE #
-app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024 # Límite de 64MB para el payload
+app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024 # Límite de 64MB para el payload (los videos subidos usan VIDEO_UPLOAD_MAX_BYTES)
 
 # --- Constantes y Variables Globales para el Servidor Receptor ---
 LOG_FILE = "received_vehicle_data_detailed.log" # Log detallado con JSON completo
@@ -62,6 +76,17 @@ if not os.path.exists(SUMMARY_LOG_FILE):
 MAX_LOG_ENTRIES_IN_MEMORY = 100
 recent_log_entries = [] # Lista de strings (cada entrada es un JSON del payload original)
 
+# Videos subidos por /api/vehicle_video/<vehicle_unique_id> a la espera de su payload JSON
+MAX_PENDING_UPLOADED_VIDEOS = 100
+g_uploaded_videos = {} # vehicle_unique_id -> nombre del archivo guardado (orden de llegada)
+g_uploaded_videos_lock = threading.Lock()
+
+# Últimos lotes recibidos (X-Batch-Id) -> payloads ya procesados (en orden), para ignorar reenvíos
+# del spool del cliente y, si un lote falló a medias, continuar donde se quedó
+MAX_REMEMBERED_BATCH_IDS = 10000
+g_received_batch_ids = {}
+g_received_batch_ids_lock = threading.Lock()
+
 # Plantilla HTML para mostrar la información del último vehículo procesado
 # (Incluye CSS para mejor apariencia)
 IMAGE_DISPLAY_PAGE_TEMPLATE = """
@@ -109,6 +134,8 @@ IMAGE_DISPLAY_PAGE_TEMPLATE = """
                         <source src="{{ data_for_template.processed_video_url_path }}" type="video/mp4">
                         Tu navegador no soporta la etiqueta de video o el formato MP4 (codec esperado: {{ video_codec_info_for_template }}).
                     </video>
+                {% elif data_for_template.get('video_sent_status') in ('upload_failed', 'streamed_but_missing') %}
+                    <p>El cliente no pudo subir el video de este vehículo.</p>
                 {% elif data_for_template.get('video_sent_status') == 'included_but_failed_to_save' %}
                     <p>Se recibió el video, pero hubo un error al guardarlo en el servidor.</p>
                 {% elif data_for_template.get('video_sent_status') == 'configured_but_not_provided' %}
@@ -138,15 +165,155 @@ g_last_vehicle_data_for_template = None
 g_last_reception_time_for_template = None
 g_last_raw_json_str_for_template = None
 
+def _safe_filename_part(text):
+    return "".join(c if c.isalnum() or c in ('_','-') else '_' for c in text)
+
+@app.route('/api/vehicle_video/<path:vehicle_id>', methods=['POST', 'PUT'])
+def receive_vehicle_video(vehicle_id):
+    """
+    Recibe el video procesado de un vehículo como cuerpo binario y lo escribe a disco por bloques
+    de VIDEO_UPLOAD_CHUNK_BYTES (sin cargarlo entero en memoria ni decodificar Base64).
+    Queda asociado a `vehicle_id` hasta que llega su payload JSON con video_sent_status 'streamed'.
+    """
+    current_server_debug_mode = app.config.get('SERVER_DEBUG_MODE', True)
+    request.max_content_length = VIDEO_UPLOAD_MAX_BYTES # Este endpoint no usa el límite de los payloads JSON
+    if request.content_length is not None and request.content_length > VIDEO_UPLOAD_MAX_BYTES:
+        return jsonify({"status": "error", "message": f"Video mayor que el máximo permitido ({VIDEO_UPLOAD_MAX_BYTES} bytes)"}), 413
+
+    video_filename = f"{_safe_filename_part(vehicle_id)}_{int(datetime.datetime.now().timestamp())}{VIDEO_EXTENSION_CONFIG}"
+    video_save_path = PROCESSED_VIDEOS_ABSOLUTE_PATH / video_filename
+    partial_path = video_save_path.with_name(video_filename + ".part") # No se sirve hasta completarse
+    bytes_written = 0
+    try:
+        with open(partial_path, "wb") as vf:
+            while True:
+                chunk = request.stream.read(VIDEO_UPLOAD_CHUNK_BYTES)
+                if not chunk: break
+                vf.write(chunk)
+                bytes_written += len(chunk)
+                if bytes_written > VIDEO_UPLOAD_MAX_BYTES: raise ValueError("Video mayor que el máximo permitido")
+        if request.content_length is not None and bytes_written != request.content_length:
+            raise ValueError(f"Subida incompleta ({bytes_written} de {request.content_length} bytes)")
+        os.replace(partial_path, video_save_path)
+    except Exception as e_upload:
+        print(f"  ERROR al guardar video subido para '{vehicle_id}': {e_upload}")
+        try: os.remove(partial_path)
+        except OSError: pass
+        return jsonify({"status": "error", "message": f"No se pudo guardar el video: {e_upload}"}), 500
+
+    with g_uploaded_videos_lock:
+        g_uploaded_videos.pop(vehicle_id, None)
+        g_uploaded_videos[vehicle_id] = video_filename
+        while len(g_uploaded_videos) > MAX_PENDING_UPLOADED_VIDEOS: # Videos cuyo payload nunca llegó
+            g_uploaded_videos.pop(next(iter(g_uploaded_videos)))
+    if current_server_debug_mode: print(f"  Video de '{vehicle_id}' recibido ({bytes_written} bytes) y guardado como: {video_save_path}")
+    return jsonify({"status": "success", "video_filename": video_filename, "bytes": bytes_written}), 200
+
+def _ingest_vehicle_payload(data_recibida_original, timestamp_recepcion_servidor, current_server_debug_mode):
+    """
+    Procesa un payload de vehículo (asocia o guarda su video y actualiza la página principal).
+
+    Returns:
+        tuple: (entrada del log detallado, fila del CSV de resumen).
+    """
+    global g_last_vehicle_data_for_template, g_last_reception_time_for_template, g_last_raw_json_str_for_template
+    # Crear una copia para modificarla para la visualización y logs de preview
+    data_para_template_y_log_preview = data_recibida_original.copy()
+
+    video_filename_saved_for_csv = data_recibida_original.get('video_sent_status', 'not_included')
+
+    # Video subido aparte (transfer_mode 'stream'): asociarlo por vehicle_unique_id
+    if data_recibida_original.get('video_sent_status') == 'streamed':
+        with g_uploaded_videos_lock:
+            video_filename = g_uploaded_videos.pop(data_recibida_original.get('vehicle_unique_id'), None)
+        if video_filename:
+            data_para_template_y_log_preview['processed_video_url_path'] = url_for('serve_processed_video', filename=video_filename, _external=False)
+            data_para_template_y_log_preview['processed_video_filename'] = video_filename
+            video_filename_saved_for_csv = video_filename
+        else:
+            if current_server_debug_mode: print("  ADVERTENCIA: El payload indica video subido, pero no se recibió.")
+            data_para_template_y_log_preview['video_sent_status'] = 'streamed_but_missing'
+            video_filename_saved_for_csv = 'streamed_but_missing'
+
+    # Procesar y guardar el video si está presente en el payload (transfer_mode 'base64')
+    elif 'processed_video_base64' in data_recibida_original and data_recibida_original['processed_video_base64']:
+        video_b64_data = data_recibida_original['processed_video_base64']
+        
+        # Crear nombre de archivo sin espacios y más seguro
+        job_id_part = data_recibida_original.get('vehicle_unique_id', 'video')
+        job_id_part_safe = _safe_filename_part(job_id_part) # Limpiar nombre
+        
+        video_filename = f"{job_id_part_safe}_{int(datetime.datetime.now().timestamp())}{VIDEO_EXTENSION_CONFIG}"
+        video_save_path = PROCESSED_VIDEOS_ABSOLUTE_PATH / video_filename
+        
+        try:
+            video_binary_data = base64.b64decode(video_b64_data)
+            with open(video_save_path, "wb") as vf:
+                vf.write(video_binary_data)
+            
+            video_url = url_for('serve_processed_video', filename=video_filename, _external=False)
+            data_para_template_y_log_preview['processed_video_url_path'] = video_url
+            data_para_template_y_log_preview['processed_video_filename'] = video_filename
+            video_filename_saved_for_csv = video_filename # Para el CSV
+            if current_server_debug_mode: print(f"  Video decodificado y guardado como: {video_save_path}. URL: {video_url}")
+        except Exception as e_vid_save:
+            print(f"  ERROR al guardar video decodificado: {e_vid_save}")
+            data_para_template_y_log_preview['video_sent_status'] = 'included_but_failed_to_save'
+            video_filename_saved_for_csv = 'error_al_guardar'
+    
+    # Eliminar el Base64 del diccionario que se va a mostrar en <pre> y el que se guarda para la página
+    if 'processed_video_base64' in data_para_template_y_log_preview:
+        data_para_template_y_log_preview['processed_video_base64'] = f"Presente (longitud: {len(data_recibida_original['processed_video_base64'])})"
+    
+    # Actualizar variables globales para la página principal
+    g_last_vehicle_data_for_template = data_para_template_y_log_preview
+    g_last_reception_time_for_template = timestamp_recepcion_servidor
+    g_last_raw_json_str_for_template = json.dumps(data_para_template_y_log_preview, indent=2, ensure_ascii=False)
+
+    if current_server_debug_mode:
+        print(f"  Datos para Vehículo Job ID: {data_recibida_original.get('vehicle_unique_id', 'N/A')}")
+        print(f"  Payload procesado para display/log: {g_last_raw_json_str_for_template}")
+
+    log_entry_file = {"timestamp_recepcion_servidor": timestamp_recepcion_servidor, "datos_payload_original": data_recibida_original}
+    csv_row = [
+        timestamp_recepcion_servidor,
+        data_recibida_original.get('job_source_name', ''),
+        data_recibida_original.get('vehicle_unique_id', ''),
+        data_recibida_original.get('vehicle_class', ''),
+        data_recibida_original.get('tire_count', 0),
+        data_recibida_original.get('source_id', ''), # Este es el 'job_source_name' del cliente
+        data_recibida_original.get('timestamp_event', ''),
+        video_filename_saved_for_csv 
+    ]
+    return log_entry_file, csv_row
+
+def _append_reception_logs(log_entries, csv_rows, current_server_debug_mode):
+    """Escribe las recepciones en el log detallado y en el CSV de resumen (una apertura de cada archivo)."""
+    # Log detallado en archivo (con el payload original completo, incluyendo B64 si venía)
+    try:
+        with open(LOG_FILE, "a", encoding="utf-8") as f:
+            for log_entry_file in log_entries: f.write(json.dumps(log_entry_file, ensure_ascii=False) + "\n")
+        if current_server_debug_mode: print(f"  Datos detallados guardados en {LOG_FILE}")
+    except Exception as e: print(f"  Error guardando en log detallado: {e}")
+
+    # Log resumido en CSV
+    try:
+        with open(SUMMARY_LOG_FILE, "a", encoding="utf-8", newline='') as f_csv:
+            import csv; writer = csv.writer(f_csv)
+            writer.writerows(csv_rows)
+        if current_server_debug_mode: print(f"  Resumen guardado en {SUMMARY_LOG_FILE}")
+    except Exception as e: print(f"  Error guardando en CSV resumen: {e}")
+
+    for log_entry_file in log_entries[-MAX_LOG_ENTRIES_IN_MEMORY:]:
+        recent_log_entries.append(json.dumps(log_entry_file, indent=2, ensure_ascii=False))
+    del recent_log_entries[:-MAX_LOG_ENTRIES_IN_MEMORY]
+
 @app.route('/api/vehicle_processed_data', methods=['POST'])
 def receive_vehicle_data():
     """
     Endpoint para recibir los datos de los vehículos procesados.
-    Decodifica y guarda el video si se incluye, y actualiza los logs.
+    Asocia el video subido por /api/vehicle_video (o decodifica y guarda el Base64 si se incluye) y actualiza los logs.
     """
-    global g_last_vehicle_data_for_template, g_last_reception_time_for_template 
-    global g_last_raw_json_str_for_template, recent_log_entries
-    
     current_server_debug_mode = app.config.get('SERVER_DEBUG_MODE', True) # Obtener de la config de Flask
     timestamp_recepcion_servidor = datetime.datetime.now().isoformat()
     
@@ -158,83 +325,74 @@ def receive_vehicle_data():
 
     try:
         data_recibida_original = request.get_json() # Payload original del cliente
-        # Crear una copia para modificarla para la visualización y logs de preview
-        data_para_template_y_log_preview = data_recibida_original.copy()
-
-        video_filename_saved_for_csv = data_recibida_original.get('video_sent_status', 'not_included')
-
-        # Procesar y guardar el video si está presente en el payload
-        if 'processed_video_base64' in data_recibida_original and data_recibida_original['processed_video_base64']:
-            video_b64_data = data_recibida_original['processed_video_base64']
-            
-            # Crear nombre de archivo sin espacios y más seguro
-            job_id_part = data_recibida_original.get('vehicle_unique_id', 'video')
-            job_id_part_safe = "".join(c if c.isalnum() or c in ('_','-') else '_' for c in job_id_part) # Limpiar nombre
-            
-            video_filename = f"{job_id_part_safe}_{int(datetime.datetime.now().timestamp())}{VIDEO_EXTENSION_CONFIG}"
-            video_save_path = PROCESSED_VIDEOS_ABSOLUTE_PATH / video_filename
-            
-            try:
-                video_binary_data = base64.b64decode(video_b64_data)
-                with open(video_save_path, "wb") as vf:
-                    vf.write(video_binary_data)
-                
-                video_url = url_for('serve_processed_video', filename=video_filename, _external=False)
-                data_para_template_y_log_preview['processed_video_url_path'] = video_url
-                data_para_template_y_log_preview['processed_video_filename'] = video_filename
-                video_filename_saved_for_csv = video_filename # Para el CSV
-                if current_server_debug_mode: print(f"  Video decodificado y guardado como: {video_save_path}. URL: {video_url}")
-            except Exception as e_vid_save:
-                print(f"  ERROR al guardar video decodificado: {e_vid_save}")
-                data_para_template_y_log_preview['video_sent_status'] = 'included_but_failed_to_save'
-                video_filename_saved_for_csv = 'error_al_guardar'
-        
-        # Eliminar el Base64 del diccionario que se va a mostrar en <pre> y el que se guarda para la página
-        if 'processed_video_base64' in data_para_template_y_log_preview:
-            data_para_template_y_log_preview['processed_video_base64'] = f"Presente (longitud: {len(data_recibida_original['processed_video_base64'])})"
-        
-        # Actualizar variables globales para la página principal
-        g_last_vehicle_data_for_template = data_para_template_y_log_preview
-        g_last_reception_time_for_template = timestamp_recepcion_servidor
-        g_last_raw_json_str_for_template = json.dumps(data_para_template_y_log_preview, indent=2, ensure_ascii=False)
+        log_entry_file, csv_row = _ingest_vehicle_payload(data_recibida_original, timestamp_recepcion_servidor, current_server_debug_mode)
+        _append_reception_logs([log_entry_file], [csv_row], current_server_debug_mode)
+        return jsonify({"status": "success", "message": "Datos recibidos y video procesado (si aplica)"}), 200
 
-        if current_server_debug_mode:
-            print(f"  Datos para Vehículo Job ID: {data_recibida_original.get('vehicle_unique_id', 'N/A')}")
-            print(f"  Payload procesado para display/log: {g_last_raw_json_str_for_template}")
+    except Exception as e:
+        print(f"  Error crítico al procesar JSON o datos: {e}")
+        import traceback; traceback.print_exc()
+        return jsonify({"status": "error", "message": f"Error interno del servidor: {e}"}), 500
 
-        # Log detallado en archivo (con el payload original completo, incluyendo B64 si venía)
-        log_entry_file = {"timestamp_recepcion_servidor": timestamp_recepcion_servidor, "datos_payload_original": data_recibida_original}
-        try:
-            with open(LOG_FILE, "a", encoding="utf-8") as f: f.write(json.dumps(log_entry_file, ensure_ascii=False) + "\n")
-            if current_server_debug_mode: print(f"  Datos detallados guardados en {LOG_FILE}")
-        except Exception as e: print(f"  Error guardando en log detallado: {e}")
+def _decompress_limited(data, encoding, max_bytes):
+    """Descomprime el cuerpo de un lote ('gzip', 'zstd' o sin codificar) sin pasar de `max_bytes`."""
+    if encoding in (None, "", "identity"): reader = io.BytesIO(data)
+    elif encoding == "gzip": reader = gzip.GzipFile(fileobj=io.BytesIO(data))
+    elif encoding == "zstd":
+        if zstandard is None: raise LookupError("zstd no soportado en el receptor (falta 'zstandard')")
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+    else: raise LookupError(f"Content-Encoding '{encoding}' no soportado")
+    raw = reader.read(max_bytes + 1)
+    if len(raw) > max_bytes: raise ValueError(f"Lote descomprimido mayor que el máximo ({max_bytes} bytes)")
+    return raw
 
-        # Log resumido en CSV
-        try:
-            with open(SUMMARY_LOG_FILE, "a", encoding="utf-8", newline='') as f_csv:
-                import csv; writer = csv.writer(f_csv)
-                writer.writerow([
-                    timestamp_recepcion_servidor,
-                    data_recibida_original.get('job_source_name', ''),
-                    data_recibida_original.get('vehicle_unique_id', ''),
-                    data_recibida_original.get('vehicle_class', ''),
-                    data_recibida_original.get('tire_count', 0),
-                    data_recibida_original.get('source_id', ''), # Este es el 'job_source_name' del cliente
-                    data_recibida_original.get('timestamp_event', ''),
-                    video_filename_saved_for_csv 
-                ])
-            if current_server_debug_mode: print(f"  Resumen guardado en {SUMMARY_LOG_FILE}")
-        except Exception as e: print(f"  Error guardando en CSV resumen: {e}")
-        
-        recent_log_entries.append(json.dumps(log_entry_file, indent=2, ensure_ascii=False))
-        if len(recent_log_entries) > MAX_LOG_ENTRIES_IN_MEMORY: recent_log_entries.pop(0)
+@app.route('/api/vehicle_processed_data/batch', methods=['POST'])
+def receive_vehicle_data_batch():
+    """
+    Endpoint para recibir lotes de payloads: array JSON, comprimido con gzip o zstd (Content-Encoding).
+    Los lotes ya recibidos (mismo X-Batch-Id, p. ej. reenviados desde el spool del cliente) se ignoran;
+    si un lote falló a medias, su reenvío solo procesa los payloads que faltaban.
+    """
+    request.max_content_length = BATCH_MAX_DECOMPRESSED_BYTES # Un lote puede superar el límite de los payloads sueltos
+    current_server_debug_mode = app.config.get('SERVER_DEBUG_MODE', True)
+    timestamp_recepcion_servidor = datetime.datetime.now().isoformat()
+    batch_id = request.headers.get('X-Batch-Id')
+    with g_received_batch_ids_lock:
+        already_ingested = g_received_batch_ids.get(batch_id, 0) if batch_id else 0
+    try:
+        raw = _decompress_limited(request.get_data(), request.headers.get('Content-Encoding'), BATCH_MAX_DECOMPRESSED_BYTES)
+        payloads = json.loads(raw)
+        if not isinstance(payloads, list) or not all(isinstance(p, dict) for p in payloads): raise ValueError("El lote debe ser un array JSON de objetos")
+    except LookupError as e_enc:
+        return jsonify({"status": "error", "message": str(e_enc)}), 415
+    except (OSError, ValueError, EOFError) as e_batch: # Incluye gzip/zstd corruptos y JSON inválido
+        if current_server_debug_mode: print(f"  Error: Lote no válido: {e_batch}")
+        return jsonify({"status": "error", "message": f"Lote no válido: {e_batch}"}), 400
 
-        return jsonify({"status": "success", "message": "Datos recibidos y video procesado (si aplica)"}), 200
+    if already_ingested >= len(payloads):
+        return jsonify({"status": "success", "message": "Lote ya recibido", "duplicate": True}), 200
 
+    # Los payloads ya procesados (videos asociados, logs escritos) no se repiten aunque el lote falle después
+    log_entries, csv_rows, error = [], [], None
+    try:
+        for data_recibida_original in payloads[already_ingested:]:
+            log_entry_file, csv_row = _ingest_vehicle_payload(data_recibida_original, timestamp_recepcion_servidor, current_server_debug_mode)
+            log_entries.append(log_entry_file); csv_rows.append(csv_row)
     except Exception as e:
-        print(f"  Error crítico al procesar JSON o datos: {e}")
+        error = e
+        print(f"  Error crítico al procesar lote (payload {already_ingested + len(log_entries) + 1} de {len(payloads)}): {e}")
         import traceback; traceback.print_exc()
-        return jsonify({"status": "error", "message": f"Error interno del servidor: {e}"}), 500
+    if log_entries: _append_reception_logs(log_entries, csv_rows, current_server_debug_mode)
+
+    if batch_id:
+        with g_received_batch_ids_lock:
+            g_received_batch_ids.pop(batch_id, None) # Reinsertar al final: es el más reciente
+            g_received_batch_ids[batch_id] = already_ingested + len(log_entries)
+            while len(g_received_batch_ids) > MAX_REMEMBERED_BATCH_IDS: g_received_batch_ids.pop(next(iter(g_received_batch_ids)))
+    if error is not None:
+        return jsonify({"status": "error", "message": f"Error interno del servidor: {error}"}), 500
+    if current_server_debug_mode: print(f"[{timestamp_recepcion_servidor}] Lote {batch_id} recibido: {len(payloads)} payload(s), {len(request.get_data())} bytes ({request.headers.get('Content-Encoding') or 'sin comprimir'}).")
+    return jsonify({"status": "success", "message": f"{len(payloads)} payload(s) recibidos", "count": len(payloads)}), 200
 
 @app.route('/', methods=['GET'])
 def show_last_vehicle_page():
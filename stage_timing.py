@@ -0,0 +1,102 @@
+# stage_timing.py
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+# Etapas del bucle de procesado de un trabajo, en orden
+# 'send' mide la entrega HTTP completa (cliente síncrono); 'send_enqueue' solo la entrega al hilo de envío
+# de `APIClient` (modo asíncrono o por lotes). Son etapas distintas para no comparar una con la otra.
+JOB_STAGES = ("decode", "inference", "tire_logic", "plot", "resize", "video_write", "base64", "send", "send_enqueue")
+# Etapa con una muestra por frame procesado (serie y pipeline): sirve para contar frames
+FRAME_STAGE = "tire_logic"
+
+class StageTimer:
+    """
+    Registra la duración de cada etapa del procesado de un trabajo (decodificación, inferencia,
+    lógica de llantas, dibujo, redimensionado, escritura de video, base64 y envío).
+    Es seguro entre hilos: en modo pipeline las etapas se miden en hilos distintos.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {} # etapa -> lista de duraciones (segundos)
+        self.totals = {} # etapa -> suma de duraciones (segundos)
+
+    def add(self, stage, seconds):
+        """Registra una duración (en segundos) para la etapa."""
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+            self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def measure(self, stage):
+        """Context manager que mide el bloque como una muestra de la etapa."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - t0)
+
+    def total_seconds(self, stage):
+        with self._lock: return self.totals.get(stage, 0.0)
+
+    def timed_iter(self, iterable, stage, excluded_seconds=None):
+        """
+        Recorre `iterable` midiendo cada `next()` como una muestra de la etapa. Sirve para
+        generadores que encadenan etapas (p. ej. la inferencia tira de la decodificación).
+
+        Args:
+            iterable (iterable): Fuente a recorrer.
+            stage (str): Etapa a la que se atribuye el tiempo de cada `next()`.
+            excluded_seconds (callable, optional): Devuelve un acumulado de segundos que pertenecen a
+                                                   otras etapas (o a esperas); lo que crezca durante
+                                                   un `next()` se descuenta de la muestra.
+        """
+        iterator = iter(iterable)
+        while True:
+            excluded_before = excluded_seconds() if excluded_seconds else 0.0
+            t0 = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            elapsed = time.perf_counter() - t0
+            if excluded_seconds: elapsed -= excluded_seconds() - excluded_before
+            self.add(stage, max(0.0, elapsed))
+            yield item
+
+    def summary(self):
+        """Por etapa: muestras, total y latencia media / p50 / p95 / máxima en milisegundos."""
+        with self._lock: samples = {stage: list(values) for stage, values in self.samples.items()}
+        ordered = [s for s in JOB_STAGES if s in samples] + sorted(s for s in samples if s not in JOB_STAGES)
+        summary = {}
+        for stage in ordered:
+            values_ms = np.array(samples[stage]) * 1000.0
+            summary[stage] = {
+                "count": len(values_ms),
+                "total_ms": round(float(values_ms.sum()), 3),
+                "mean_ms": round(float(values_ms.mean()), 3),
+                "p50_ms": round(float(np.percentile(values_ms, 50)), 3),
+                "p95_ms": round(float(np.percentile(values_ms, 95)), 3),
+                "max_ms": round(float(values_ms.max()), 3),
+            }
+        return summary
+
+class _NullStageTimer:
+    """Temporizador inactivo (por defecto): misma interfaz que `StageTimer`, sin coste de medición."""
+    _NULL_CONTEXT = nullcontext()
+
+    def add(self, stage, seconds):
+        pass
+
+    def measure(self, stage):
+        return self._NULL_CONTEXT
+
+    def total_seconds(self, stage):
+        return 0.0
+
+    def timed_iter(self, iterable, stage, excluded_seconds=None):
+        return iterable
+
+NULL_STAGE_TIMER = _NullStageTimer()
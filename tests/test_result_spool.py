@@ -0,0 +1,109 @@
+# tests/test_result_spool.py
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from result_spool import ResultSpool
+
+
+def _segments(spool_dir):
+    return sorted(p.name for p in Path(spool_dir).glob("segment_*.jsonl"))
+
+
+def test_reinicio_tras_linea_truncada(tmp_path):
+    spool = ResultSpool(tmp_path, fsync=False)
+    spool.append("a", [{"id": 1}])
+    segment = tmp_path / _segments(tmp_path)[0]
+    # Simular una caída a mitad de escritura del segundo lote
+    with open(segment, "ab") as f: f.write(b'{"seq": 2, "batch_id": "b", "payl')
+
+    spool = ResultSpool(tmp_path, fsync=False)
+    assert spool.pending_count() == 1
+    assert segment.read_bytes().endswith(b"\n")
+    spool.append("c", [{"id": 3}])
+
+    pending = [(seq, record["batch_id"]) for seq, record in spool.iter_pending()]
+    assert pending == [(1, "a"), (2, "c")]
+    assert spool.pending_count() == 2
+
+    spool.ack(2)
+    assert spool.pending_count() == 0
+    assert list(spool.iter_pending()) == []
+    assert _segments(tmp_path) == []
+
+
+def test_segmento_solo_con_escritura_incompleta(tmp_path):
+    spool = ResultSpool(tmp_path, fsync=False)
+    spool.append("a", [])
+    spool.ack(1)
+    # Segmento nuevo cuya única línea quedó a medias
+    (tmp_path / "segment_000000000002.jsonl").write_bytes(b'{"seq": 2, "bat')
+
+    spool = ResultSpool(tmp_path, fsync=False)
+    assert spool.pending_count() == 0
+    assert _segments(tmp_path) == []
+    # El lote incompleto nunca llegó a guardarse: su `seq` se reutiliza en un segmento nuevo
+    assert spool.append("b", []) == 2
+    assert [(seq, record["batch_id"]) for seq, record in spool.iter_pending()] == [(2, "b")]
+
+
+def test_segmento_nuevo_no_colisiona_con_existente(tmp_path):
+    spool = ResultSpool(tmp_path, fsync=False)
+    spool.append("a", [])
+    spool.append("b", [])
+    spool.ack(1) # El segmento sigue existiendo porque contiene el lote 2
+
+    spool = ResultSpool(tmp_path, fsync=False)
+    assert spool.append("c", []) == 3
+    assert _segments(tmp_path) == ["segment_000000000001.jsonl", "segment_000000000003.jsonl"]
+    assert [record["batch_id"] for _, record in spool.iter_pending()] == ["b", "c"]
+
+
+def test_dead_letter_aparta_el_lote(tmp_path):
+    spool = ResultSpool(tmp_path, fsync=False)
+    spool.append("a", [{"id": 1}])
+    spool.append("b", [{"id": 2}])
+    seq, record = next(spool.iter_pending())
+    spool.dead_letter(record, "HTTP 400 Bad Request")
+    spool.ack(seq)
+
+    assert [r["batch_id"] for _, r in spool.iter_pending()] == ["b"]
+    dead = [json.loads(line) for line in (tmp_path / "dead_letter.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert [(d["batch_id"], d["reason"], d["payloads"]) for d in dead] == [("a", "HTTP 400 Bad Request", [{"id": 1}])]
+
+
+def test_videos_del_lote_sobreviven_al_reinicio(tmp_path):
+    spool_dir, video = tmp_path / "spool", tmp_path / "v1.mp4"
+    video.write_bytes(b"video")
+    spool = ResultSpool(spool_dir, fsync=False)
+    kept = spool.keep_video(video)
+    spool.append("a", [{"id": 1}], {0: kept})
+    orphan = Path(spool.keep_video(_write(tmp_path / "v2.mp4"))) # Caída antes de guardar su lote
+
+    spool = ResultSpool(spool_dir, fsync=False)
+    assert not video.exists() and Path(kept).read_bytes() == b"video"
+    assert not orphan.exists()
+    assert [record["videos"] for _, record in spool.iter_pending()] == [{"0": kept}]
+
+
+def _write(path):
+    path.write_bytes(b"video")
+    return path
+
+
+def test_adopt_pasa_los_lotes_de_otro_spool(tmp_path):
+    orphan = ResultSpool(tmp_path / "worker_1", fsync=False)
+    orphan.append("a", [{"id": 1}], {0: orphan.keep_video(_write(tmp_path / "v1.mp4"))})
+    orphan.append("b", [{"id": 2}])
+    orphan.ack(1)
+    orphan.append("c", [{"id": 3}])
+    spool = ResultSpool(tmp_path / "worker_0", fsync=False)
+    spool.append("x", [])
+
+    assert ResultSpool.is_spool_dir(tmp_path / "worker_1")
+    assert spool.adopt(tmp_path / "worker_1") == 2
+    assert [record["batch_id"] for _, record in spool.iter_pending()] == ["x", "b", "c"]
+    assert spool.pending_count() == 3
+    assert not (tmp_path / "worker_1").exists()
@@ -0,0 +1,178 @@
+# tire_logic_benchmark.py
+"""
+Micro-benchmark de la asociación llanta-vehículo de `TireCounterLogic`.
+
+Compara la implementación vectorizada actual (`_associate_tires_to_vehicles`) con la versión
+escalar original (bucle vehículo x llanta x ranura con `compute_iou`) sobre secuencias sintéticas
+con un número creciente de vehículos y llantas por frame. Antes de medir, verifica que ambas
+producen exactamente las mismas ranuras (anchors, cajas, áreas, IDs y frames) en cada escenario.
+
+Uso:
+    python tire_logic_benchmark.py --frames 300 --vehicles 1 2 4 8 --tires_per_vehicle 4 8 12
+"""
+import argparse
+import contextlib
+import io
+import json
+import time
+
+import numpy as np
+
+from config_loader import AppConfig
+from detections import FrameDetections
+from tracker_logic import TireCounterLogic, TireSlot
+from utils import compute_iou
+
+class _ScalarTireCounterLogic(TireCounterLogic):
+    """Asociación escalar original, conservada como referencia de resultados y de tiempos."""
+    def _associate_tires_to_vehicles(self, vehicle_detections, tire_boxes, tire_track_ids, current_frame_idx_in_job, frame_shape):
+        for v_track_id, v_data_in_frame in vehicle_detections.items():
+            v_box_for_tire_assoc, v_height_for_tire_assoc = self._get_vehicle_assoc_box(v_data_in_frame['box'], frame_shape)
+
+            if self.debug_mode and len(tire_boxes):
+                v_cname = self.class_names[v_data_in_frame['class_id']]
+                print(f"  FRAME_JOB {current_frame_idx_in_job}, Veh {v_track_id} ({v_cname}): Caja Asoc: {v_box_for_tire_assoc.astype(int)}")
+
+            current_vehicle_tire_slots = self.vehicle_physical_tires_current_job.get(v_track_id,{})
+            for slot in current_vehicle_tire_slots.values(): slot.updated_this_frame = False
+
+            for t_id_current_frame, t_box in zip(tire_track_ids, tire_boxes):
+                tcx, tcy = (t_box[0]+t_box[2])/2, (t_box[1]+t_box[3])/2
+                x_ok = (v_box_for_tire_assoc[0] <= tcx <= v_box_for_tire_assoc[2])
+                min_y, max_y = (v_box_for_tire_assoc[1] + v_height_for_tire_assoc * self.y_min_frac), \
+                               (v_box_for_tire_assoc[3] + v_height_for_tire_assoc * self.y_max_ext)
+                y_ok = (min_y <= tcy <= max_y)
+                if not (x_ok and y_ok): continue
+
+                matched = False
+                for anchor, slot in current_vehicle_tire_slots.items():
+                    iou = compute_iou(t_box, slot.box)
+                    if iou > self.iou_thresh_same_tire:
+                        slot.update(t_id_current_frame, t_box, current_frame_idx_in_job)
+                        matched = True; break
+                if matched: continue
+
+                t_area = (t_box[2]-t_box[0])*(t_box[3]-t_box[1])
+                if t_area < self.min_abs_tire_area: continue
+                size_ok = True
+                if current_vehicle_tire_slots:
+                    s_areas, n_exist = sum(s.area for s in current_vehicle_tire_slots.values()), len(current_vehicle_tire_slots)
+                    if n_exist > 0:
+                        avg_a = s_areas/n_exist
+                        if not (avg_a/self.area_ratio_tol <= t_area <= avg_a*self.area_ratio_tol): size_ok=False
+                if not size_ok:
+                    if self.debug_mode: print(f"    Llanta TrackID {t_id_current_frame} RECHAZADA (TAMAÑO REL) para Veh {v_track_id}.")
+                    continue
+
+                if t_id_current_frame not in current_vehicle_tire_slots:
+                    current_vehicle_tire_slots[t_id_current_frame] = TireSlot(t_id_current_frame, t_box, t_area, current_frame_idx_in_job)
+                    if self.debug_mode: print(f"    NUEVA LLANTA FÍSICA (Anchor {t_id_current_frame}) para Veh {v_track_id}. Área: {t_area:.0f}")
+                elif self.debug_mode:
+                     current_vehicle_tire_slots[t_id_current_frame].update(t_id_current_frame, t_box, current_frame_idx_in_job, area=t_area)
+
+def _make_sequence(num_frames, num_vehicles, tires_per_vehicle, vehicle_class_id, tire_class_id, frame_shape, seed):
+    """
+    Secuencia sintética: vehículos en fila con sus llantas en la franja inferior, cajas con ruido,
+    IDs de llanta que se renuevan de vez en cuando (como al perder el track) y llantas espurias.
+    """
+    rng = np.random.default_rng(seed)
+    fh, fw = frame_shape[:2]
+    veh_w = fw / max(1, num_vehicles)
+    frames = []
+    next_tire_id = 10000
+    tire_ids = [[next_tire_id + v * tires_per_vehicle + t for t in range(tires_per_vehicle)] for v in range(num_vehicles)]
+    next_tire_id += num_vehicles * tires_per_vehicle
+    for frame_idx in range(num_frames):
+        xyxy, conf, cls, ids = [], [], [], []
+        for v in range(num_vehicles):
+            x1 = v * veh_w + rng.uniform(0, 4)
+            v_box = [x1, fh * 0.3 + rng.uniform(-3, 3), x1 + veh_w * 0.95, fh * 0.8 + rng.uniform(-3, 3)]
+            xyxy.append(v_box); conf.append(0.9); cls.append(vehicle_class_id); ids.append(v + 1)
+            tire_size = min(veh_w * 0.95 / (tires_per_vehicle + 1), fh * 0.12)
+            for t in range(tires_per_vehicle):
+                if rng.random() < 0.02: # Track perdido: la llanta reaparece con otro ID
+                    tire_ids[v][t] = next_tire_id; next_tire_id += 1
+                tx = x1 + (t + 0.5) * veh_w * 0.95 / tires_per_vehicle + rng.uniform(-2, 2)
+                ty = v_box[3] - tire_size * 0.6 + rng.uniform(-2, 2)
+                size = tire_size * rng.uniform(0.85, 1.15)
+                xyxy.append([tx - size / 2, ty - size / 2, tx + size / 2, ty + size / 2])
+                conf.append(rng.uniform(0.6, 0.99)); cls.append(tire_class_id); ids.append(tire_ids[v][t])
+        for _ in range(rng.integers(0, 3)): # Llantas espurias en cualquier parte
+            cx, cy, size = rng.uniform(0, fw), rng.uniform(0, fh), rng.uniform(5, 60)
+            xyxy.append([cx - size / 2, cy - size / 2, cx + size / 2, cy + size / 2])
+            conf.append(rng.uniform(0.7, 0.99)); cls.append(tire_class_id); ids.append(next_tire_id); next_tire_id += 1
+        frames.append(FrameDetections(np.zeros((1, 1, 3), dtype=np.uint8), xyxy, conf, cls, track_ids=ids,
+                                      orig_shape=frame_shape[:2]))
+    return frames
+
+def _run(counter, frames, frame_shape):
+    counter.reset_state_for_new_job()
+    t0 = time.perf_counter()
+    for frame_idx, detections in enumerate(frames):
+        counter.process_job_detections(detections, frame_idx, frame_shape)
+    return time.perf_counter() - t0
+
+def _slots_equal(slots_a, slots_b):
+    if list(slots_a.keys()) != list(slots_b.keys()): return False
+    for v_id in slots_a:
+        if list(slots_a[v_id].keys()) != list(slots_b[v_id].keys()): return False
+        for anchor, slot_a in slots_a[v_id].items():
+            slot_b = slots_b[v_id][anchor]
+            for attr in TireSlot.__slots__:
+                value_a, value_b = getattr(slot_a, attr), getattr(slot_b, attr)
+                equal = np.array_equal(value_a, value_b) if attr == 'box' else value_a == value_b
+                if not equal: return False
+    return True
+
+def _check_equivalence(cfg, frames, frame_shape, debug_mode):
+    vectorized, scalar = TireCounterLogic(cfg), _ScalarTireCounterLogic(cfg)
+    vectorized.debug_mode = scalar.debug_mode = debug_mode
+    with contextlib.redirect_stdout(io.StringIO()):
+        _run(vectorized, frames, frame_shape)
+        _run(scalar, frames, frame_shape)
+    return _slots_equal(vectorized.vehicle_physical_tires_current_job, scalar.vehicle_physical_tires_current_job)
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark de la asociación llanta-vehículo (vectorizada vs escalar).")
+    parser.add_argument("--frames", type=int, default=300, help="Frames por escenario.")
+    parser.add_argument("--vehicles", type=int, nargs="+", default=[1, 2, 4, 8], help="Vehículos por frame a evaluar.")
+    parser.add_argument("--tires_per_vehicle", type=int, nargs="+", default=[4, 8, 12], help="Llantas por vehículo a evaluar.")
+    parser.add_argument("--repeats", type=int, default=3, help="Repeticiones por escenario (se toma la mejor).")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla de las secuencias sintéticas.")
+    parser.add_argument("--output", type=str, default=None, help="Archivo JSON donde guardar el reporte.")
+    args = parser.parse_args()
+
+    cfg = AppConfig(config_path_str="config.yaml")
+    if cfg.tire_class_id == -1 or not cfg.vehicle_class_ids:
+        print("[TIRE_BENCH] La configuración no define clases de llanta/vehículo.")
+        return
+    frame_shape = (1080, 1920, 3)
+    vectorized, scalar = TireCounterLogic(cfg), _ScalarTireCounterLogic(cfg)
+    vectorized.debug_mode = scalar.debug_mode = False
+
+    report = []
+    print(f"{'vehículos':>9} {'llantas/frame':>13} {'escalar ms/frame':>17} {'vectorizada ms/frame':>21} {'speedup':>8} {'iguales':>8}")
+    for num_vehicles in args.vehicles:
+        for tires_per_vehicle in args.tires_per_vehicle:
+            frames = _make_sequence(args.frames, num_vehicles, tires_per_vehicle, cfg.vehicle_class_ids[0],
+                                    cfg.tire_class_id, frame_shape, args.seed)
+            identical = all(_check_equivalence(cfg, frames, frame_shape, debug) for debug in (False, True))
+            scalar_s = min(_run(scalar, frames, frame_shape) for _ in range(args.repeats))
+            vectorized_s = min(_run(vectorized, frames, frame_shape) for _ in range(args.repeats))
+            row = {"vehicles": num_vehicles, "tires_per_frame": num_vehicles * tires_per_vehicle,
+                   "scalar_ms_per_frame": round(scalar_s * 1000.0 / args.frames, 4),
+                   "vectorized_ms_per_frame": round(vectorized_s * 1000.0 / args.frames, 4),
+                   "speedup": round(scalar_s / vectorized_s, 2) if vectorized_s > 0 else None,
+                   "identical_slots": identical}
+            report.append(row)
+            print(f"{row['vehicles']:>9} {row['tires_per_frame']:>13} {row['scalar_ms_per_frame']:>17.3f} "
+                  f"{row['vectorized_ms_per_frame']:>21.3f} {row['speedup']:>8} {str(identical):>8}")
+
+    if not all(row["identical_slots"] for row in report):
+        print("[TIRE_BENCH] ERROR: la versión vectorizada no reproduce las ranuras de la versión escalar.")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: json.dump(report, f, indent=2)
+        print(f"[TIRE_BENCH] Reporte guardado en: {args.output}")
+
+if __name__ == '__main__':
+    main()
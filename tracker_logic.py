@@ -1,8 +1,132 @@
 # tracker_logic.py
-from utils import compute_iou 
+from utils import compute_iou_matrix
 import numpy as np
 from collections import Counter
 
+def get_vehicle_assoc_box(v_box_orig, frame_shape, exp_x_perc, exp_y_perc):
+    """Caja del vehículo (expandida y recortada al frame si se configura) usada para asociar llantas, y su alto."""
+    v_box_for_tire_assoc, v_height_for_tire_assoc = v_box_orig, (v_box_orig[3] - v_box_orig[1])
+    if exp_x_perc > 0 or exp_y_perc > 0:
+        orig_v_w, orig_v_h = (v_box_orig[2]-v_box_orig[0]), (v_box_orig[3]-v_box_orig[1])
+        exp_px_x, exp_px_y = orig_v_w*exp_x_perc, orig_v_h*exp_y_perc
+        x1,y1,x2,y2 = v_box_orig[0]-exp_px_x, v_box_orig[1]-exp_px_y, v_box_orig[2]+exp_px_x, v_box_orig[3]+exp_px_y
+        if frame_shape:
+            fh,fw = frame_shape[:2]
+            x1,y1,x2,y2 = max(0,x1),max(0,y1),min(fw,x2),min(fh,y2)
+        v_box_for_tire_assoc = np.array([x1,y1,x2,y2])
+        v_height_for_tire_assoc = v_box_for_tire_assoc[3]-v_box_for_tire_assoc[1]
+    if v_height_for_tire_assoc <=0: v_height_for_tire_assoc = 1
+    return v_box_for_tire_assoc, v_height_for_tire_assoc
+
+def get_tire_search_region(v_box_orig, frame_shape, exp_x_perc, exp_y_perc, y_min_frac, y_max_ext):
+    """
+    Región (x1, y1, x2, y2) en la que `TireCounterLogic` acepta el centro de una llanta para el
+    vehículo: caja de asociación en X y, en Y, desde `y_min_frac` del alto hasta `y_max_ext` bajo la caja.
+    """
+    assoc_box, assoc_height = get_vehicle_assoc_box(v_box_orig, frame_shape, exp_x_perc, exp_y_perc)
+    return (assoc_box[0], assoc_box[1] + assoc_height * y_min_frac,
+            assoc_box[2], assoc_box[3] + assoc_height * y_max_ext)
+
+class VehicleTrackState:
+    """
+    Estado compacto de un vehículo trackeado dentro de un trabajo. Ocupa lo mismo durante todo el
+    trabajo: en lugar de un historial de clases (una entrada por frame) guarda un contador de votos
+    de tamaño fijo por clase y el orden en que apareció cada clase, suficiente para reproducir
+    `Counter(historial).most_common(1)` (en empate gana la clase vista primero).
+    """
+    __slots__ = ("box", "class_votes", "class_first_vote_order", "distinct_classes_voted",
+                 "first_seen_frame_in_job", "last_seen_frame_in_job", "frames_seen_count")
+
+    def __init__(self, box, class_id, num_classes, frame_idx):
+        self.box = np.array(box) # Copia: no retiene el array de detecciones del frame
+        self.class_votes = [0] * num_classes
+        self.class_first_vote_order = [0] * num_classes
+        self.distinct_classes_voted = 0
+        self.first_seen_frame_in_job = frame_idx
+        self.last_seen_frame_in_job = frame_idx
+        self.frames_seen_count = 1
+        self.add_class_vote(class_id)
+
+    def add_class_vote(self, class_id):
+        if self.class_votes[class_id] == 0:
+            self.class_first_vote_order[class_id] = self.distinct_classes_voted
+            self.distinct_classes_voted += 1
+        self.class_votes[class_id] += 1
+
+    def update(self, box, class_id, frame_idx):
+        """Registra una nueva observación del vehículo (O(1))."""
+        self.box = np.array(box)
+        self.add_class_vote(class_id)
+        self.last_seen_frame_in_job = frame_idx
+        self.frames_seen_count += 1
+
+    def class_vote_counts(self):
+        """{class_id: votos} de las clases observadas, en el orden en que aparecieron."""
+        voted = [c for c, votes in enumerate(self.class_votes) if votes]
+        return {c: self.class_votes[c] for c in sorted(voted, key=lambda c: self.class_first_vote_order[c])}
+
+    def most_common_class_id(self):
+        """Clase más votada; en empate, la observada primero. None si no hay votos."""
+        voted = [c for c, votes in enumerate(self.class_votes) if votes]
+        if not voted: return None
+        return max(voted, key=lambda c: (self.class_votes[c], -self.class_first_vote_order[c]))
+
+class TireSlot:
+    """Ranura de llanta física de un vehículo (registro compacto, actualizado en O(1))."""
+    __slots__ = ("latest_track_id", "box", "area", "first_seen_frame_in_job", "last_seen_frame_in_job", "updated_this_frame")
+
+    def __init__(self, track_id, box, area, frame_idx):
+        self.latest_track_id = track_id
+        self.box = box
+        self.area = area
+        self.first_seen_frame_in_job = frame_idx
+        self.last_seen_frame_in_job = frame_idx
+        self.updated_this_frame = True
+
+    def update(self, track_id, box, frame_idx, area=None):
+        self.box = box
+        self.latest_track_id = track_id
+        if area is not None: self.area = area
+        self.last_seen_frame_in_job = frame_idx
+        self.updated_this_frame = True
+
+class _TireSlotIndex:
+    """
+    Cajas y área acumulada de las ranuras de llanta física de un vehículo, en arrays y en el mismo
+    orden de inserción que su dict de ranuras, para asociar llantas con operaciones vectorizadas.
+    """
+    __slots__ = ("anchors", "positions", "boxes", "count", "area_sum")
+
+    def __init__(self):
+        self.anchors = [] # posición -> anchor (orden de inserción del dict de ranuras)
+        self.positions = {} # anchor -> posición en `boxes`
+        self.boxes = None
+        self.count = 0
+        self.area_sum = 0 # Misma acumulación, en el mismo orden, que sum() sobre las áreas de las ranuras
+
+    def active_boxes(self):
+        return self.boxes[:self.count]
+
+    def _match_dtype(self, box):
+        if np.result_type(self.boxes.dtype, box.dtype) != self.boxes.dtype:
+            self.boxes = self.boxes.astype(np.result_type(self.boxes.dtype, box.dtype))
+
+    def append(self, anchor, box, area):
+        if self.boxes is None:
+            self.boxes = np.empty((8, 4), dtype=box.dtype)
+        elif self.count == len(self.boxes):
+            self.boxes = np.concatenate([self.boxes, np.empty_like(self.boxes)])
+        self._match_dtype(box)
+        self.boxes[self.count] = box
+        self.anchors.append(anchor)
+        self.positions[anchor] = self.count
+        self.count += 1
+        self.area_sum = self.area_sum + area
+
+    def set_box(self, position, box):
+        self._match_dtype(box)
+        self.boxes[position] = box
+
 class TireCounterLogic:
     def __init__(self, config, api_client_instance=None):
         self.config = config
@@ -12,6 +136,8 @@ class TireCounterLogic:
         self.tire_class_id = config.tire_class_id
         self.vehicle_class_ids = config.vehicle_class_ids
         self.class_names = config.get('classes.names', [])
+        # Tamaño de los contadores de votos por clase de cada vehículo
+        self.num_class_votes = max([len(self.class_names)] + [c + 1 for c in self.vehicle_class_ids])
         
         self.per_class_thresholds = config.numeric_per_class_conf_thresholds
         self.default_conf_threshold = config.get('confidence_thresholds.default_post_filter')
@@ -24,9 +150,15 @@ class TireCounterLogic:
         self.area_ratio_tol = config.get('tire_logic.accepted_tire_area_ratio_tolerance', 3.0)
         self.min_abs_tire_area = config.get('tire_logic.min_absolute_tire_pixel_area', 50)
         self.frames_to_keep_data = config.get('processing.frames_to_keep_data_for_lost_tracks', 300)
+        self.min_frames_seen_to_emit = config.get('processing.streaming_emission.min_frames_seen_to_emit', 1)
+        # Terminación temprana: vehículo principal ausente K frames y su conteo de llantas estable M frames
+        self.early_exit_absent_frames = config.get('processing.early_termination.main_vehicle_absent_frames', 30)
+        self.early_exit_stable_frames = config.get('processing.early_termination.tire_count_stable_frames', 60)
 
-        self.vehicle_physical_tires_current_job = {}
-        self.tracked_vehicles_info_current_job = {} # Ahora almacenará una lista de class_ids
+        self.vehicle_physical_tires_current_job = {} # v_track_id -> {anchor: TireSlot}
+        self.tracked_vehicles_info_current_job = {} # v_track_id -> VehicleTrackState
+        self._tire_slot_indices = {} # v_track_id -> _TireSlotIndex (espejo en arrays de sus ranuras)
+        self._reset_convergence_tracking()
 
         if self.debug_mode: print("TireCounterLogic inicializado (Modo Servicio).")
         if self.tire_class_id == -1 or not self.vehicle_class_ids:
@@ -36,6 +168,32 @@ class TireCounterLogic:
         if self.debug_mode: print("[TRACKER_LOGIC] Reseteando estado para nuevo trabajo.")
         self.vehicle_physical_tires_current_job.clear()
         self.tracked_vehicles_info_current_job.clear()
+        self._tire_slot_indices.clear()
+        self._reset_convergence_tracking()
+
+    def _reset_convergence_tracking(self):
+        self._convergence_main_id = None # Vehículo principal observado en la última comprobación
+        self._convergence_tire_count = None # Su conteo de llantas en ese momento
+        self._convergence_changed_frame = None # Último frame en que cambió el principal o su conteo
+
+    def main_vehicle_converged(self, current_frame_idx_in_job):
+        """
+        Comprueba (una vez por frame, tras `process_job_detections`) si el trabajo puede terminarse
+        antes de agotar la fuente: el vehículo principal lleva `main_vehicle_absent_frames` frames sin
+        verse y su conteo de llantas no cambia desde hace `tire_count_stable_frames` frames.
+
+        Returns:
+            bool: True si se cumplen ambas condiciones.
+        """
+        main_id, main_state = self._get_main_vehicle_from_job_detections()
+        if main_id is None: return False
+        tire_count = len(self.vehicle_physical_tires_current_job.get(main_id, {}))
+        if main_id != self._convergence_main_id or tire_count != self._convergence_tire_count:
+            self._convergence_main_id, self._convergence_tire_count = main_id, tire_count
+            self._convergence_changed_frame = current_frame_idx_in_job
+        frames_absent = current_frame_idx_in_job - main_state.last_seen_frame_in_job
+        frames_stable = current_frame_idx_in_job - self._convergence_changed_frame
+        return frames_absent >= self.early_exit_absent_frames and frames_stable >= self.early_exit_stable_frames
 
     def _get_main_vehicle_from_job_detections(self):
         # ... (lógica para obtener main_vehicle_track_id como antes, basada en frames_seen_count o área) ...
@@ -46,7 +204,7 @@ class TireCounterLogic:
         max_frames_seen = -1
         
         for v_id, data in self.tracked_vehicles_info_current_job.items():
-            frames_seen = data.get('frames_seen_count', 0)
+            frames_seen = data.frames_seen_count
             if frames_seen > max_frames_seen:
                 max_frames_seen = frames_seen
                 main_vehicle_track_id = v_id
@@ -56,7 +214,7 @@ class TireCounterLogic:
         if main_vehicle_track_id is None and self.tracked_vehicles_info_current_job:
             largest_area = -1
             for v_id, data in self.tracked_vehicles_info_current_job.items():
-                box = data.get('box') # Última caja conocida
+                box = data.box # Última caja conocida
                 if box is not None:
                     area = (box[2]-box[0]) * (box[3]-box[1])
                     if area > largest_area:
@@ -80,7 +238,7 @@ class TireCounterLogic:
         boxes = yolo_results.boxes.xyxy.cpu().numpy()
         confidences = yolo_results.boxes.conf.cpu().numpy()
 
-        frame_all_tire_detections = []
+        frame_tire_indices = []
         for i in range(len(track_ids)):
             class_id = detected_classes[i]
             conf = confidences[i]
@@ -96,140 +254,219 @@ class TireCounterLogic:
                 current_job_vehicle_detections_this_frame[track_id] = {'box': box, 'class_id': class_id}
                 
                 if track_id not in self.tracked_vehicles_info_current_job:
-                    self.tracked_vehicles_info_current_job[track_id] = {
-                        'box': box, # Última caja vista
-                        'detected_class_ids_history': [class_id], # <--- NUEVO: Iniciar historial de clases
-                        'first_seen_frame_in_job': current_frame_idx_in_job,
-                        'last_seen_frame_in_job': current_frame_idx_in_job,
-                        'frames_seen_count': 1
-                    }
+                    self.tracked_vehicles_info_current_job[track_id] = VehicleTrackState(box, class_id, self.num_class_votes, current_frame_idx_in_job)
                     self.vehicle_physical_tires_current_job[track_id] = {}
                 else:
-                    # Añadir la clase actual al historial
-                    self.tracked_vehicles_info_current_job[track_id]['detected_class_ids_history'].append(class_id)
-                    self.tracked_vehicles_info_current_job[track_id].update({
-                        'box': box, 
-                        'last_seen_frame_in_job': current_frame_idx_in_job,
-                        'frames_seen_count': self.tracked_vehicles_info_current_job[track_id].get('frames_seen_count', 0) + 1
-                    })
-                    # Actualizar la 'class_id' en current_job_vehicle_detections_this_frame con la clase de este frame
-                    # para la visualización, pero la clase final se decidirá por moda.
-                    current_job_vehicle_detections_this_frame[track_id]['class_id'] = class_id
+                    # Sumar el voto de la clase de este frame; la clase final se decidirá por moda.
+                    self.tracked_vehicles_info_current_job[track_id].update(box, class_id, current_frame_idx_in_job)
 
 
             elif class_id == self.tire_class_id:
-                frame_all_tire_detections.append({'track_id': track_id, 'box': box, 'conf': conf})
-
-
-        for v_track_id, v_data_in_frame in current_job_vehicle_detections_this_frame.items():
-            v_box_orig = v_data_in_frame['box'] # Caja del vehículo de este frame
-            # ... (lógica de expansión de caja como la tenías, usando v_box_orig y frame_shape) ...
-            v_box_for_tire_assoc, v_height_for_tire_assoc = v_box_orig, (v_box_orig[3] - v_box_orig[1])
-            if self.veh_box_exp_x_perc > 0 or self.veh_box_exp_y_perc > 0:
-                orig_v_w, orig_v_h = (v_box_orig[2]-v_box_orig[0]), (v_box_orig[3]-v_box_orig[1])
-                exp_px_x, exp_px_y = orig_v_w*self.veh_box_exp_x_perc, orig_v_h*self.veh_box_exp_y_perc
-                x1,y1,x2,y2 = v_box_orig[0]-exp_px_x, v_box_orig[1]-exp_px_y, v_box_orig[2]+exp_px_x, v_box_orig[3]+exp_px_y
-                if frame_shape:
-                    fh,fw = frame_shape[:2]
-                    x1,y1,x2,y2 = max(0,x1),max(0,y1),min(fw,x2),min(fh,y2)
-                v_box_for_tire_assoc = np.array([x1,y1,x2,y2])
-                v_height_for_tire_assoc = v_box_for_tire_assoc[3]-v_box_for_tire_assoc[1]
-            if v_height_for_tire_assoc <=0: v_height_for_tire_assoc = 1
-
-
-            if self.debug_mode and frame_all_tire_detections:
-                v_cname = self.class_names[v_data_in_frame['class_id']]
-                print(f"  FRAME_JOB {current_frame_idx_in_job}, Veh {v_track_id} ({v_cname}): Caja Asoc: {v_box_for_tire_assoc.astype(int)}")
-
-            current_vehicle_tire_slots = self.vehicle_physical_tires_current_job.get(v_track_id,{}) # Obtener/crear
-            for anchor_key in current_vehicle_tire_slots: current_vehicle_tire_slots[anchor_key]['updated_this_frame'] = False
-
-            for tire_det_data in frame_all_tire_detections:
-                t_id_current_frame, t_box = tire_det_data['track_id'], tire_det_data['box']
-                # ... (Filtros X, Y, Fusión IoU, Filtro Tamaño, Creación Nueva Ranura como antes) ...
-                # La clave es que 'vehicle_slots_for_this_vehicle' ahora es 'current_vehicle_tire_slots'
-                # y el 'anchor_id' para una nueva ranura de llanta será 't_id_current_frame'.
-                tcx, tcy = (t_box[0]+t_box[2])/2, (t_box[1]+t_box[3])/2
-                x_ok = (v_box_for_tire_assoc[0] <= tcx <= v_box_for_tire_assoc[2])
-                min_y, max_y = (v_box_for_tire_assoc[1] + v_height_for_tire_assoc * self.y_min_frac), \
-                               (v_box_for_tire_assoc[3] + v_height_for_tire_assoc * self.y_max_ext)
-                y_ok = (min_y <= tcy <= max_y)
-                if not (x_ok and y_ok): continue
-
-                matched = False
-                for anchor, slot in current_vehicle_tire_slots.items():
-                    iou = compute_iou(t_box, slot['box'])
-                    if iou > self.iou_thresh_same_tire:
-                        slot.update({'box':t_box, 'latest_track_id':t_id_current_frame, 'last_seen_frame_in_job':current_frame_idx_in_job, 'updated_this_frame':True})
-                        matched = True; break
-                if matched: continue
-                
-                t_area = (t_box[2]-t_box[0])*(t_box[3]-t_box[1])
-                if t_area < self.min_abs_tire_area: continue
-                size_ok = True
-                if current_vehicle_tire_slots:
-                    s_areas, n_exist = sum(s.get('area',t_area) for s in current_vehicle_tire_slots.values()), len(current_vehicle_tire_slots)
-                    if n_exist > 0:
-                        avg_a = s_areas/n_exist
-                        if not (avg_a/self.area_ratio_tol <= t_area <= avg_a*self.area_ratio_tol): size_ok=False
-                if not size_ok:
-                    if self.debug_mode: print(f"    Llanta TrackID {t_id_current_frame} RECHAZADA (TAMAÑO REL) para Veh {v_track_id}.")
-                    continue
-                
-                if t_id_current_frame not in current_vehicle_tire_slots:
-                    current_vehicle_tire_slots[t_id_current_frame] = {'latest_track_id':t_id_current_frame, 'box':t_box, 'area':t_area, 'last_seen_frame_in_job':current_frame_idx_in_job, 'updated_this_frame':True, 'first_seen_frame_in_job': current_frame_idx_in_job}
-                    if self.debug_mode: print(f"    NUEVA LLANTA FÍSICA (Anchor {t_id_current_frame}) para Veh {v_track_id}. Área: {t_area:.0f}")
-                elif self.debug_mode:
-                     current_vehicle_tire_slots[t_id_current_frame].update({'box':t_box, 'latest_track_id':t_id_current_frame, 'area':t_area, 'last_seen_frame_in_job':current_frame_idx_in_job, 'updated_this_frame':True})
+                frame_tire_indices.append(i)
 
+        tire_indices = np.array(frame_tire_indices, dtype=int)
+        self._associate_tires_to_vehicles(current_job_vehicle_detections_this_frame, boxes[tire_indices],
+                                          track_ids[tire_indices], current_frame_idx_in_job, frame_shape)
 
         return current_job_vehicle_detections_this_frame
 
 
-    def finalize_job_and_prepare_payload(self, job_source_name):
-        main_v_track_id, main_v_data_from_job_info = self._get_main_vehicle_from_job_detections()
+    def _get_vehicle_assoc_box(self, v_box_orig, frame_shape):
+        """Caja del vehículo (expandida y recortada al frame si se configura) usada para asociar llantas, y su alto."""
+        return get_vehicle_assoc_box(v_box_orig, frame_shape, self.veh_box_exp_x_perc, self.veh_box_exp_y_perc)
+
+    def _associate_tires_to_vehicles(self, vehicle_detections, tire_boxes, tire_track_ids, current_frame_idx_in_job, frame_shape):
+        """
+        Asocia las llantas del frame a las ranuras de llanta física de cada vehículo detectado.
+        La contención (vehículos x llantas) se evalúa con una sola máscara y la fusión por IoU con una
+        matriz llantas x ranuras; el recorrido por llanta sigue siendo secuencial porque cada ranura
+        creada o actualizada afecta a las llantas siguientes (mismo resultado que la versión escalar).
+
+        Args:
+            vehicle_detections (dict): {v_track_id: {'box', 'class_id'}} de los vehículos de este frame.
+            tire_boxes (np.array): Cajas (T, 4) de las llantas que pasaron el umbral de confianza.
+            tire_track_ids (np.array): IDs de tracking (T,) de esas llantas.
+            current_frame_idx_in_job (int): Índice del frame dentro del trabajo.
+            frame_shape (tuple): Forma del frame (para recortar la caja expandida del vehículo).
+        """
+        if not vehicle_detections: return
+
+        # Límites de asociación por vehículo. Se calculan con la misma aritmética escalar de siempre y se
+        # comparan en float64 (conversión exacta), así la máscara coincide con las comparaciones escalares.
+        assoc_boxes = []
+        bounds = np.empty((len(vehicle_detections), 4), dtype=np.float64) # x_min, y_min, x_max, y_max
+        for pos, v_data_in_frame in enumerate(vehicle_detections.values()):
+            v_box_for_tire_assoc, v_height_for_tire_assoc = self._get_vehicle_assoc_box(v_data_in_frame['box'], frame_shape)
+            min_y, max_y = (v_box_for_tire_assoc[1] + v_height_for_tire_assoc * self.y_min_frac), \
+                           (v_box_for_tire_assoc[3] + v_height_for_tire_assoc * self.y_max_ext)
+            bounds[pos] = (float(v_box_for_tire_assoc[0]), float(min_y), float(v_box_for_tire_assoc[2]), float(max_y))
+            assoc_boxes.append(v_box_for_tire_assoc)
+
+        tcx = ((tire_boxes[:, 0] + tire_boxes[:, 2]) / 2).astype(np.float64)
+        tcy = ((tire_boxes[:, 1] + tire_boxes[:, 3]) / 2).astype(np.float64)
+        inside_mask = ((bounds[:, 0:1] <= tcx) & (tcx <= bounds[:, 2:3]) &
+                       (bounds[:, 1:2] <= tcy) & (tcy <= bounds[:, 3:4]))
+        tire_areas = (tire_boxes[:, 2] - tire_boxes[:, 0]) * (tire_boxes[:, 3] - tire_boxes[:, 1])
+
+        # Matriz de "misma llanta" (IoU > umbral) del frame completo, en una sola pasada: llantas x
+        # [llantas | ranuras existentes de los vehículos implicados]. Cada vehículo usa solo sus filas y columnas.
+        same_tire_matrix = None
+        slot_offsets = {}
+        vehicles_with_candidates = [v_id for pos, v_id in enumerate(vehicle_detections) if inside_mask[pos].any()]
+        if vehicles_with_candidates:
+            reference_boxes, n_reference = [tire_boxes], len(tire_boxes)
+            for v_id in vehicles_with_candidates:
+                slot_index = self._tire_slot_indices.get(v_id)
+                if slot_index is None or not slot_index.count: continue
+                slot_offsets[v_id] = n_reference
+                reference_boxes.append(slot_index.active_boxes())
+                n_reference += slot_index.count
+            same_tire_matrix = self._same_tire_matrix(tire_boxes, np.concatenate(reference_boxes))
+
+        for pos, (v_track_id, v_data_in_frame) in enumerate(vehicle_detections.items()):
+            if self.debug_mode and len(tire_boxes):
+                v_cname = self.class_names[v_data_in_frame['class_id']]
+                print(f"  FRAME_JOB {current_frame_idx_in_job}, Veh {v_track_id} ({v_cname}): Caja Asoc: {assoc_boxes[pos].astype(int)}")
+
+            current_vehicle_tire_slots = self.vehicle_physical_tires_current_job.setdefault(v_track_id, {})
+            for slot in current_vehicle_tire_slots.values(): slot.updated_this_frame = False
+
+            candidates = np.flatnonzero(inside_mask[pos])
+            if candidates.size == 0: continue
+            slot_index = self._tire_slot_indices.setdefault(v_track_id, _TireSlotIndex())
+            candidate_rows = same_tire_matrix[candidates]
+            same_tire_blocks = [candidate_rows[:, candidates]]
+            if v_track_id in slot_offsets:
+                offset = slot_offsets[v_track_id]
+                same_tire_blocks.insert(0, candidate_rows[:, offset:offset + slot_index.count])
+            self._merge_tires_into_slots(v_track_id, current_vehicle_tire_slots, slot_index, candidates,
+                                         np.concatenate(same_tire_blocks, axis=1), tire_boxes, tire_track_ids,
+                                         tire_areas, current_frame_idx_in_job)
+
+    def _same_tire_matrix(self, tire_boxes, other_boxes):
+        """`compute_iou(tire, other) > iou_threshold_same_physical_tire` para cada par, como matriz booleana."""
+        iou_matrix = compute_iou_matrix(tire_boxes, other_boxes)
+        # Mismo tipo en el que se compara un escalar NumPy con el umbral (float) de la configuración
+        iou_cmp_dtype = np.result_type(iou_matrix.dtype.type(0), self.iou_thresh_same_tire)
+        return iou_matrix.astype(iou_cmp_dtype, copy=False) > iou_cmp_dtype.type(self.iou_thresh_same_tire)
+
+    def _merge_tires_into_slots(self, v_track_id, current_vehicle_tire_slots, slot_index, candidates, same_tire_matrix,
+                                tire_boxes, tire_track_ids, tire_areas, current_frame_idx_in_job):
+        """
+        Fusión IoU, filtro de tamaño y creación de ranuras para las llantas contenidas en un vehículo.
+
+        Toda ranura tiene, en cada momento, la caja con la que empezó el frame o la de una llanta candidata
+        anterior (al fusionarse o crearse), así que `same_tire_matrix` (candidatas x [ranuras iniciales |
+        candidatas]) cubre todas las comparaciones; `slot_columns` indica la columna vigente de cada ranura.
+        """
+        n_cand, n_initial_slots = len(candidates), slot_index.count
+        slot_columns = np.empty(n_initial_slots + n_cand, dtype=np.intp)
+        slot_columns[:n_initial_slots] = np.arange(n_initial_slots)
+
+        for k in range(n_cand):
+            t_id_current_frame, t_box = tire_track_ids[candidates[k]], tire_boxes[candidates[k]]
+
+            if slot_index.count:
+                same_tire = same_tire_matrix[k, slot_columns[:slot_index.count]]
+                slot_pos = int(same_tire.argmax()) # Primera ranura (en orden de inserción) que supera el umbral
+                if same_tire[slot_pos]:
+                    current_vehicle_tire_slots[slot_index.anchors[slot_pos]].update(t_id_current_frame, t_box, current_frame_idx_in_job)
+                    slot_index.set_box(slot_pos, t_box)
+                    slot_columns[slot_pos] = n_initial_slots + k
+                    continue
 
-        if main_v_track_id is None or main_v_data_from_job_info is None:
-            if self.debug_mode: print(f"[FINALIZE_JOB] No se pudo determinar un vehículo principal para '{job_source_name}'.")
-            return None
+            t_area = tire_areas[candidates[k]]
+            if t_area < self.min_abs_tire_area: continue
+            size_ok = True
+            if current_vehicle_tire_slots:
+                s_areas, n_exist = slot_index.area_sum, slot_index.count
+                if n_exist > 0:
+                    avg_a = s_areas/n_exist
+                    if not (avg_a/self.area_ratio_tol <= t_area <= avg_a*self.area_ratio_tol): size_ok=False
+            if not size_ok:
+                if self.debug_mode: print(f"    Llanta TrackID {t_id_current_frame} RECHAZADA (TAMAÑO REL) para Veh {v_track_id}.")
+                continue
 
+            if t_id_current_frame not in current_vehicle_tire_slots:
+                current_vehicle_tire_slots[t_id_current_frame] = TireSlot(t_id_current_frame, t_box, t_area, current_frame_idx_in_job)
+                slot_index.append(t_id_current_frame, t_box, t_area)
+                slot_columns[slot_index.count - 1] = n_initial_slots + k
+                if self.debug_mode: print(f"    NUEVA LLANTA FÍSICA (Anchor {t_id_current_frame}) para Veh {v_track_id}. Área: {t_area:.0f}")
+            elif self.debug_mode:
+                current_vehicle_tire_slots[t_id_current_frame].update(t_id_current_frame, t_box, current_frame_idx_in_job, area=t_area)
+                slot_pos = slot_index.positions[t_id_current_frame]
+                slot_index.set_box(slot_pos, t_box)
+                slot_columns[slot_pos] = n_initial_slots + k
+                slot_index.area_sum = sum(s.area for s in current_vehicle_tire_slots.values()) # Área reemplazada: recalcular
+
+    def _build_vehicle_payload(self, v_track_id, vehicle_state, job_source_name, status):
+        """Payload de un vehículo: clase más frecuente, llantas físicas contadas y datos de su track."""
         # --- INICIO: Determinar la clase más frecuente ---
-        detected_class_ids_history = main_v_data_from_job_info.get('detected_class_ids_history', [])
-        if detected_class_ids_history:
-            # Ahora Counter estará definido
-            most_common_class_id = Counter(detected_class_ids_history).most_common(1)[0][0]
+        most_common_class_id = vehicle_state.most_common_class_id()
+        if most_common_class_id is not None:
             final_vehicle_class_id = most_common_class_id
-            if self.debug_mode: print(f"  [FINALIZE_JOB] Historial de clases para Veh {main_v_track_id}: {detected_class_ids_history}. Clase más común: {final_vehicle_class_id} ({self.class_names[final_vehicle_class_id] if 0 <= final_vehicle_class_id < len(self.class_names) else 'Desconocida'})")
+            if self.debug_mode: print(f"  [FINALIZE_JOB] Votos de clase para Veh {v_track_id}: {vehicle_state.class_vote_counts()}. Clase más común: {final_vehicle_class_id} ({self.class_names[final_vehicle_class_id] if 0 <= final_vehicle_class_id < len(self.class_names) else 'Desconocida'})")
         else:
-            # ... (lógica de fallback como la tenías) ...
             final_vehicle_class_id = self.vehicle_class_ids[0] if self.vehicle_class_ids else -1 
-            if self.debug_mode: print(f"  [FINALIZE_JOB] ADVERTENCIA: Historial de clases vacío para Veh {main_v_track_id}. Usando fallback a clase ID: {final_vehicle_class_id}")
-            if main_v_data_from_job_info.get('detected_class_ids_history'): # Doble check, si está vacío pero la clave existe
-                 if main_v_data_from_job_info['detected_class_ids_history']: # Y si la lista no está vacía
-                    final_vehicle_class_id = main_v_data_from_job_info['detected_class_ids_history'][0]
+            if self.debug_mode: print(f"  [FINALIZE_JOB] ADVERTENCIA: Sin votos de clase para Veh {v_track_id}. Usando fallback a clase ID: {final_vehicle_class_id}")
 
 
         final_vehicle_class_name = self.class_names[final_vehicle_class_id] if 0 <= final_vehicle_class_id < len(self.class_names) else f"ClaseID_Desconocida_{int(final_vehicle_class_id)}"
         # --- FIN: Determinar la clase más frecuente ---
 
-        tire_slots = self.vehicle_physical_tires_current_job.get(main_v_track_id, {})
+        tire_slots = self.vehicle_physical_tires_current_job.get(v_track_id, {})
         num_tires = len(tire_slots)
 
-        payload = {
-            "vehicle_unique_id": f"{job_source_name}_{int(main_v_track_id)}",
+        return {
+            "vehicle_unique_id": f"{job_source_name}_{int(v_track_id)}",
             "vehicle_class": final_vehicle_class_name,
             "tire_count": int(num_tires),
-            "vehicle_box_xyxy": [int(c) for c in main_v_data_from_job_info.get('box', [])],
-            "first_seen_frame_in_job": main_v_data_from_job_info.get('first_seen_frame_in_job'),
-            "last_seen_frame_in_job": main_v_data_from_job_info.get('last_seen_frame_in_job'),
-            "total_frames_vehicle_seen_in_job": main_v_data_from_job_info.get('frames_seen_count'),
+            "vehicle_box_xyxy": [int(c) for c in vehicle_state.box],
+            "first_seen_frame_in_job": vehicle_state.first_seen_frame_in_job,
+            "last_seen_frame_in_job": vehicle_state.last_seen_frame_in_job,
+            "total_frames_vehicle_seen_in_job": vehicle_state.frames_seen_count,
             "job_source_name": job_source_name,
-            "status": "job_completed"
+            "status": status
         }
-        if self.debug_mode: print(f"  [FINALIZE_JOB] Payload preparado para '{job_source_name}', Vehículo Principal ID {main_v_track_id} (Clase Final: {final_vehicle_class_name}): {num_tires} llantas.")
+
+    def finalize_job_and_prepare_payload(self, job_source_name):
+        main_v_track_id, main_v_data_from_job_info = self._get_main_vehicle_from_job_detections()
+
+        if main_v_track_id is None or main_v_data_from_job_info is None:
+            if self.debug_mode: print(f"[FINALIZE_JOB] No se pudo determinar un vehículo principal para '{job_source_name}'.")
+            return None
+
+        payload = self._build_vehicle_payload(main_v_track_id, main_v_data_from_job_info, job_source_name, "job_completed")
+        if self.debug_mode: print(f"  [FINALIZE_JOB] Payload preparado para '{job_source_name}', Vehículo Principal ID {main_v_track_id} (Clase Final: {payload['vehicle_class']}): {payload['tire_count']} llantas.")
         return payload
-    
-    # cleanup_old_tracks (para streams, necesita adaptarse para usar el historial de clases también si se quiere)
-    # Por ahora, cleanup_old_tracks usaría la última clase conocida del vehicle_data.
-    # Si necesitas que cleanup_old_tracks también use la clase más frecuente, esa lógica
-    # tendría que aplicarse allí también, o el payload de cleanup debe indicar que es una clase "tentativa".
+
+    # --- Modo streaming (rtsp / video_file): un payload por vehículo en cuanto deja de verse ---
+
+    def evict_lost_vehicles(self, current_frame_idx_in_job, job_source_name):
+        """
+        Finaliza los vehículos que llevan más de `frames_to_keep_data_for_lost_tracks` frames sin verse:
+        prepara su payload (status "vehicle_exited") y libera su track y sus ranuras de llantas.
+
+        Returns:
+            list: Payloads de los vehículos finalizados (puede estar vacía).
+        """
+        lost_v_track_ids = [v_id for v_id, vehicle_state in self.tracked_vehicles_info_current_job.items()
+                            if current_frame_idx_in_job - vehicle_state.last_seen_frame_in_job > self.frames_to_keep_data]
+        return self._finalize_and_release_vehicles(lost_v_track_ids, job_source_name, "vehicle_exited")
+
+    def flush_all_vehicles(self, job_source_name):
+        """Fin del stream: finaliza todos los vehículos aún activos (status "stream_ended") y libera su estado."""
+        return self._finalize_and_release_vehicles(list(self.tracked_vehicles_info_current_job), job_source_name, "stream_ended")
+
+    def _finalize_and_release_vehicles(self, v_track_ids, job_source_name, status):
+        payloads = []
+        for v_track_id in v_track_ids:
+            vehicle_state = self.tracked_vehicles_info_current_job[v_track_id]
+            if vehicle_state.frames_seen_count >= self.min_frames_seen_to_emit:
+                payloads.append(self._build_vehicle_payload(v_track_id, vehicle_state, job_source_name, status))
+            elif self.debug_mode:
+                print(f"  [STREAMING] Veh {v_track_id} descartado: visto solo en {vehicle_state.frames_seen_count} frames.")
+            self.tracked_vehicles_info_current_job.pop(v_track_id, None)
+            self.vehicle_physical_tires_current_job.pop(v_track_id, None)
+            self._tire_slot_indices.pop(v_track_id, None)
+        return payloads
@@ -31,6 +31,33 @@ def compute_iou(box1, box2):
     union_area = box1_area + box2_area - inter_area
     return inter_area / union_area if union_area != 0 else 0
 
+def compute_iou_matrix(boxes1, boxes2):
+    """
+    Versión vectorizada de `compute_iou`: IoU de cada caja de `boxes1` contra cada caja de `boxes2`.
+    Aplica las mismas operaciones y en el mismo orden que la versión escalar, por lo que
+    cada celda coincide con `compute_iou(boxes1[i], boxes2[j])`.
+
+    Args:
+        boxes1 (np.array): Cajas (N, 4) en formato [x1, y1, x2, y2].
+        boxes2 (np.array): Cajas (M, 4) en formato [x1, y1, x2, y2].
+
+    Returns:
+        np.array: Matriz (N, M) de IoU. Vale 0.0 donde el área de unión es cero.
+    """
+    b1 = np.asarray(boxes1).reshape(-1, 4)[:, None, :]
+    b2 = np.asarray(boxes2).reshape(-1, 4)[None, :, :]
+    xA = np.maximum(b1[..., 0], b2[..., 0]); yA = np.maximum(b1[..., 1], b2[..., 1])
+    xB = np.minimum(b1[..., 2], b2[..., 2]); yB = np.minimum(b1[..., 3], b2[..., 3])
+
+    inter_area = np.maximum(0, xB - xA) * np.maximum(0, yB - yA)
+    box1_area = np.maximum(0, b1[..., 2] - b1[..., 0]) * np.maximum(0, b1[..., 3] - b1[..., 1])
+    box2_area = np.maximum(0, b2[..., 2] - b2[..., 0]) * np.maximum(0, b2[..., 3] - b2[..., 1])
+    union_area = box1_area + box2_area - inter_area
+
+    iou = np.zeros(union_area.shape, dtype=np.result_type(inter_area.dtype, union_area.dtype, np.float16))
+    np.divide(inter_area, union_area, out=iou, where=union_area != 0)
+    return iou
+
 def encode_image_to_base64(image_frame, max_width, max_height, quality=75, debug_mode=False):
     """
     Redimensiona una imagen si es necesario para que quepa dentro de max_width y max_height
@@ -157,3 +184,27 @@ def draw_vehicle_tire_counts(frame, current_frame_vehicle_detections, vehicle_ph
         cv2.putText(frame, label, (text_x, text_y), 
                     cv2.FONT_HERSHEY_SIMPLEX, font_scale, text_color, font_thickness, cv2.LINE_AA)
     return frame
+
+def annotate_frame(frame, yolo_results, current_frame_vehicle_detections, vehicle_physical_tires_data, config_obj):
+    """
+    Genera el frame anotado para visualización y video: cajas de YOLO (`yolo_results.plot`)
+    más las etiquetas personalizadas de conteo de llantas.
+
+    Args:
+        frame (numpy.ndarray): Frame original (no se modifica).
+        yolo_results (ultralytics.engine.results.Results or None): Resultados del detector para el frame.
+        current_frame_vehicle_detections (dict): Detecciones de vehículos en el frame actual.
+        vehicle_physical_tires_data (dict): Estado (o instantánea) de las llantas físicas por vehículo.
+        config_obj (AppConfig): La instancia de configuración.
+
+    Returns:
+        numpy.ndarray: El frame anotado.
+    """
+    output_frame = frame.copy()
+    if yolo_results: # Dibujar siempre para el video si está habilitado, y para display si está habilitado
+        plot_options = config_obj.get('processing.visualization_plot_options', {})
+        plot_args = { "conf": plot_options.get('show_conf',True), "line_width": plot_options.get('line_width',1), "font_size": plot_options.get('font_size',0.4), "labels": plot_options.get('show_labels',True) }
+        output_frame = yolo_results.plot(**plot_args)
+
+    # Dibujar nuestras etiquetas personalizadas sobre el frame que ya tiene las de YOLO
+    return draw_vehicle_tire_counts(output_frame, current_frame_vehicle_detections, vehicle_physical_tires_data, config_obj)
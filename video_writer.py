@@ -0,0 +1,123 @@
+# video_writer.py
+import cv2
+import os
+
+from stage_timing import NULL_STAGE_TIMER
+
+class IncrementalVideoWriter:
+    """
+    Escribe el video de salida de un trabajo frame a frame, a medida que se producen.
+    El `cv2.VideoWriter` se abre de forma perezosa al llegar el primer frame (usando sus
+    dimensiones, ya redimensionadas) y se cierra con `finalize()` o `abort()`.
+    Así la memoria usada es la de un solo frame, sin importar la longitud del trabajo.
+    """
+    def __init__(self, output_path, video_payload_config, debug_mode=False, stage_timer=None):
+        """
+        Args:
+            output_path (str): Ruta del archivo de video temporal a generar.
+            video_payload_config (dict): Sección 'processing.payload_video' de la configuración
+                                         (codec, fps y tamaño máximo de los frames).
+            debug_mode (bool, optional): Si es True, imprime mensajes de depuración.
+            stage_timer (StageTimer, optional): Mide las etapas 'resize' y 'video_write'.
+        """
+        self.output_path = output_path
+        self.debug_mode = debug_mode
+        self.stage_timer = stage_timer or NULL_STAGE_TIMER
+        self.codec_str = video_payload_config.get('output_video_codec', 'mp4v')
+        self.fps = video_payload_config.get('output_video_fps', 10)
+        self.target_w = video_payload_config.get('output_video_frame_max_width', 0)
+        self.target_h = video_payload_config.get('output_video_frame_max_height', 0)
+
+        self.video_writer = None
+        self.frame_size = None # (ancho, alto) fijado por el primer frame
+        self.frames_written = 0
+        self.open_failed = False # True si el VideoWriter no pudo abrirse (codec no soportado, etc.)
+        self.file_released = False # True si el archivo se cedió a otro componente (no se elimina aquí)
+
+    def _open(self, width, height):
+        """Abre el VideoWriter con las dimensiones del primer frame."""
+        fourcc = cv2.VideoWriter_fourcc(*self.codec_str)
+        if self.debug_mode:
+            print(f"    Creando video con: filename='{self.output_path}', fourcc='{self.codec_str}', fps={self.fps}, size=({width}x{height})")
+        self.video_writer = cv2.VideoWriter(self.output_path, fourcc, self.fps, (width, height))
+        if not self.video_writer.isOpened():
+            print(f"    [VIDEO_WRITER] ERROR: No se pudo abrir VideoWriter para '{self.output_path}' con codec '{self.codec_str}'. ¿Está soportado?")
+            self.video_writer = None
+            self.open_failed = True
+            return False
+        self.frame_size = (width, height)
+        return True
+
+    def write(self, frame):
+        """
+        Redimensiona (si está configurado) y escribe un frame anotado en el video.
+
+        Args:
+            frame (numpy.ndarray): Frame BGR anotado.
+
+        Returns:
+            bool: True si el frame se escribió, False si el writer no está disponible.
+        """
+        if frame is None or self.open_failed: return False
+
+        frame_to_write = frame
+        if self.target_w > 0 and self.target_h > 0:
+            current_h, current_w = frame_to_write.shape[:2]
+            if current_w != self.target_w or current_h != self.target_h: # Solo redimensionar si es diferente
+                with self.stage_timer.measure("resize"):
+                    frame_to_write = cv2.resize(frame_to_write, (self.target_w, self.target_h), interpolation=cv2.INTER_AREA)
+
+        if self.video_writer is None:
+            height, width = frame_to_write.shape[:2]
+            if not self._open(width, height): return False
+        elif (frame_to_write.shape[1], frame_to_write.shape[0]) != self.frame_size:
+            # Sin tamaño fijo configurado, los frames deben coincidir con el primero
+            with self.stage_timer.measure("resize"):
+                frame_to_write = cv2.resize(frame_to_write, self.frame_size, interpolation=cv2.INTER_AREA)
+
+        with self.stage_timer.measure("video_write"):
+            self.video_writer.write(frame_to_write)
+        self.frames_written += 1
+        return True
+
+    def finalize(self):
+        """
+        Cierra el video correctamente.
+
+        Returns:
+            str or None: Ruta del video generado, o None si no se escribió ningún frame.
+        """
+        if self.video_writer is None: return None
+        with self.stage_timer.measure("video_write"): # Vacía el codificador y cierra el contenedor
+            self.video_writer.release()
+        self.video_writer = None
+        if self.debug_mode: print(f"    [VIDEO_WRITER] Video temporal '{self.output_path}' CREADO y cerrado ({self.frames_written} frames).")
+        return self.output_path if self.frames_written > 0 else None
+
+    def abort(self):
+        """Cierra el writer (si estaba abierto) y elimina el archivo parcial."""
+        if self.video_writer is not None:
+            self.video_writer.release()
+            self.video_writer = None
+        self.remove_file()
+
+    def release_file(self):
+        """
+        Cede el video ya finalizado a otro componente (p. ej. `APIClient`, que lo sube y lo elimina):
+        `abort()` y `remove_file()` dejan de borrarlo.
+
+        Returns:
+            str: Ruta del video.
+        """
+        self.file_released = True
+        return self.output_path
+
+    def remove_file(self):
+        """Elimina el archivo de video temporal si existe (salvo que se haya cedido con `release_file()`)."""
+        if self.file_released: return
+        try:
+            if os.path.exists(self.output_path): # Verificar antes de borrar
+                os.remove(self.output_path)
+                if self.debug_mode: print(f"    [VIDEO_WRITER] Video temporal '{self.output_path}' eliminado.")
+        except Exception as e_del:
+            if self.debug_mode: print(f"    [VIDEO_WRITER] No se pudo eliminar el video temporal '{self.output_path}': {e_del}")
@@ -0,0 +1,274 @@
+# worker_pool.py
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+# Variables de entorno que fijan el número de hilos de las librerías numéricas. Se leen al importarlas y,
+# con "spawn", el hijo reimporta el módulo principal (y con él torch/numpy) antes de ejecutar su función:
+# se fijan en el entorno del proceso principal al arrancar los workers, que lo heredan
+_THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+def _available_cpu_ids():
+    """CPUs en las que puede ejecutarse este proceso (respeta cgroups/taskset en Linux)."""
+    if hasattr(os, "sched_getaffinity"): return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def _configure_worker_process(worker_idx, torch_threads, cpu_ids, debug_mode):
+    """
+    Aplica afinidad de CPU y límite de hilos de torch/OpenCV al proceso trabajador (antes de cargar el modelo).
+    Las variables de `_THREAD_ENV_VARS` ya vienen fijadas desde `JobWorkerPool.start`.
+    """
+    if cpu_ids:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpu_ids)
+        elif debug_mode:
+            print(f"[WORKER_POOL] Worker {worker_idx}: afinidad de CPU no soportada en este sistema operativo.")
+    try:
+        import torch
+        if torch_threads > 0:
+            torch.set_num_threads(torch_threads)
+            torch.set_num_interop_threads(1)
+    except (ImportError, RuntimeError):
+        pass # Sin torch (p. ej. backend onnx/openvino) o hilos ya inicializados
+    try:
+        import cv2
+        cv2.setNumThreads(max(1, torch_threads))
+    except ImportError:
+        pass
+
+def _worker_process_main(worker_idx, num_workers, config_path_str, job_queue, event_queue, torch_threads, cpu_ids):
+    """
+    Punto de entrada de cada proceso trabajador: carga su propio ObjectDetector y
+    TireCounterLogic y procesa trabajos de la cola compartida hasta recibir None.
+    El worker 0 se queda además con los spools de lotes de instancias que ya no existen.
+    """
+    from config_loader import AppConfig
+    cfg = AppConfig(config_path_str=config_path_str)
+    debug_mode = cfg.get('processing.debug_mode', False)
+    _configure_worker_process(worker_idx, torch_threads, cpu_ids, debug_mode)
+
+    from api_client import APIClient
+    from detector import ObjectDetector
+    from job_processing import process_job
+    from metrics import ProcessingMetrics
+    from tracker_logic import TireCounterLogic
+
+    try:
+        detector = ObjectDetector(cfg)
+        active_instances = [f"worker_{i}" for i in range(num_workers)] if worker_idx == 0 else None
+        api_client = APIClient(cfg, instance_name=f"worker_{worker_idx}", active_instances=active_instances) \
+            if cfg.get('external_server.enabled') else None
+        tire_counter = TireCounterLogic(cfg, api_client_instance=api_client)
+    except Exception as e:
+        print(f"[WORKER_POOL] Worker {worker_idx}: ERROR inicializando componentes: {e}")
+        event_queue.put(("worker_failed", worker_idx, str(e)))
+        return
+
+    print(f"[WORKER_POOL] Worker {worker_idx} (PID {os.getpid()}) listo. Hilos torch: {torch_threads or 'auto'}, CPUs: {cpu_ids or 'todas'}")
+    event_queue.put(("worker_ready", worker_idx, os.getpid()))
+    while True:
+        current_job = job_queue.get()
+        if current_job is None: break # Señal de apagado
+        event_queue.put(("job_started", worker_idx, str(Path(current_job['path']).name)))
+        # Histogramas propios del trabajo: el proceso principal los suma a los de /metrics
+        job_metrics = ProcessingMetrics() if cfg.get('command_server.metrics.enabled', False) else None
+        summary = process_job(current_job, cfg, detector, tire_counter, api_client,
+                              stage_timer=job_metrics.job_timer() if job_metrics else None)
+        if job_metrics: summary["stage_histograms"] = job_metrics.export_stage_histograms()
+        event_queue.put(("job_finished", worker_idx, summary))
+    if api_client is not None: api_client.close() # Vacía la cola de envíos pendientes
+
+class JobWorkerPool:
+    """
+    Pool de procesos trabajadores para la cola de trabajos del servidor de comandos.
+    Cada proceso carga su propio `ObjectDetector` y `TireCounterLogic`, de modo que los trabajos
+    avanzan en paralelo sin competir por el GIL. El número de hilos de torch y la afinidad de CPU
+    por proceso se configuran para no sobresuscribir los núcleos.
+    """
+    def __init__(self, config, config_path_str="config.yaml", metrics=None):
+        """
+        Args:
+            config (AppConfig): Configuración (sección 'processing.worker_pool').
+            config_path_str (str, optional): Archivo de configuración que cargarán los procesos hijos.
+            metrics (ProcessingMetrics, optional): Métricas del proceso principal a las que se suman los
+                                                   histogramas por etapa de cada trabajo terminado.
+        """
+        self.metrics = metrics
+        self.config_path_str = config_path_str
+        self.debug_mode = config.get('processing.debug_mode', False)
+        self.num_processes = max(1, int(config.get('processing.worker_pool.num_processes', 2)))
+        torch_threads = int(config.get('processing.worker_pool.torch_threads_per_worker', 0))
+        pin_affinity = config.get('processing.worker_pool.pin_cpu_affinity', True)
+
+        cpu_ids = _available_cpu_ids()
+        cores_per_worker = max(1, len(cpu_ids) // self.num_processes)
+        self.torch_threads = torch_threads if torch_threads > 0 else cores_per_worker
+        # Bloques contiguos de CPUs por worker (si hay menos CPUs que workers, se reparten cíclicamente)
+        self.cpu_assignments = []
+        for i in range(self.num_processes):
+            if not pin_affinity:
+                self.cpu_assignments.append(None)
+                continue
+            start = (i * cores_per_worker) % len(cpu_ids)
+            self.cpu_assignments.append(cpu_ids[start:start + cores_per_worker])
+
+        mp_context = multiprocessing.get_context("spawn") # Sin heredar hilos/locks de Flask ni el modelo
+        self.job_queue = mp_context.Queue()
+        self.event_queue = mp_context.Queue()
+        self.processes = [
+            mp_context.Process(target=_worker_process_main, name=f"job_worker_{i}", daemon=True,
+                               args=(i, self.num_processes, self.config_path_str, self.job_queue, self.event_queue,
+                                     self.torch_threads, self.cpu_assignments[i]))
+            for i in range(self.num_processes)
+        ]
+
+        self._stats_lock = threading.Lock()
+        self.started_at = None
+        self.jobs_submitted = 0
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        self.in_flight = {} # worker_idx -> nombre del job en curso
+        self._in_flight_started = {} # worker_idx -> time.monotonic() al empezar su job
+        self.workers_ready = 0
+        self.dead_workers = set() # Workers que terminaron sin que se pidiera el apagado
+        self._shutting_down = False
+        self.completion_times = deque() # time.monotonic() de los jobs terminados en la última ventana
+        self.throughput_window_seconds = 60.0
+        self._event_thread = threading.Thread(target=self._consume_events, daemon=True)
+
+    def start(self):
+        """Arranca los procesos trabajadores y el hilo que recoge sus eventos."""
+        self.started_at = time.monotonic()
+        # Los hijos heredan el entorno al crearse: límite de hilos solo para ellos, luego se restaura
+        previous_env = {env_var: os.environ.get(env_var) for env_var in _THREAD_ENV_VARS}
+        try:
+            for env_var in _THREAD_ENV_VARS: os.environ[env_var] = str(self.torch_threads)
+            for process in self.processes: process.start()
+        finally:
+            for env_var, value in previous_env.items():
+                if value is None: os.environ.pop(env_var, None)
+                else: os.environ[env_var] = value
+        self._event_thread.start()
+        print(f"[WORKER_POOL] {self.num_processes} procesos iniciados ({self.torch_threads} hilos torch por proceso).")
+
+    def submit(self, current_job):
+        """Encola un trabajo para el siguiente proceso libre (o lo da por fallido si no queda ningún worker vivo)."""
+        with self._stats_lock:
+            self.jobs_submitted += 1
+            if self.started_at is not None and len(self.dead_workers) == self.num_processes:
+                self.jobs_failed += 1
+                print(f"[WORKER_POOL] ERROR: No quedan workers vivos; el trabajo '{Path(current_job['path']).name}' se da por fallido.")
+                return
+        self.job_queue.put(current_job)
+
+    def pending_jobs(self):
+        """Trabajos encolados o en curso que aún no han terminado."""
+        with self._stats_lock:
+            return self.jobs_submitted - self.jobs_completed - self.jobs_failed
+
+    def shutdown(self, timeout=10.0):
+        """Pide a los procesos que terminen tras sus trabajos actuales y espera su salida."""
+        self._shutting_down = True
+        for _ in self.processes: self.job_queue.put(None)
+        for process in self.processes: process.join(timeout=timeout)
+
+    def _check_workers(self):
+        """
+        Detecta workers que terminaron sin apagado (fallo al iniciar, OOM, segfault...): su trabajo en
+        curso se cuenta como fallido y, si no queda ninguno vivo, también los trabajos encolados, para
+        que `pending_jobs()` llegue a 0.
+        """
+        if self._shutting_down: return
+        now = time.monotonic()
+        failed_summaries = []
+        with self._stats_lock:
+            for worker_idx, process in enumerate(self.processes):
+                if worker_idx in self.dead_workers or process.is_alive(): continue
+                self.dead_workers.add(worker_idx)
+                job_name = self.in_flight.pop(worker_idx, None)
+                started = self._in_flight_started.pop(worker_idx, now)
+                print(f"[WORKER_POOL] ERROR: Worker {worker_idx} terminó inesperadamente (código de salida {process.exitcode})"
+                      + (f" procesando '{job_name}'; el trabajo se da por fallido." if job_name else "."))
+                if job_name is not None:
+                    self.jobs_failed += 1
+                    self.completion_times.append(now)
+                    failed_summaries.append({"job_name": job_name, "success": False, "wall_seconds": now - started, "frames": 0})
+            if len(self.dead_workers) == self.num_processes:
+                abandoned = self.jobs_submitted - self.jobs_completed - self.jobs_failed
+                while True: # Vaciar la cola: nadie la va a consumir
+                    try: self.job_queue.get_nowait()
+                    except (queue.Empty, OSError): break
+                if abandoned > 0:
+                    self.jobs_failed += abandoned
+                    print(f"[WORKER_POOL] ERROR: No quedan workers vivos; {abandoned} trabajo(s) pendientes se dan por fallidos.")
+        if self.metrics:
+            for summary in failed_summaries: self.metrics.job_finished(summary)
+
+    def _consume_events(self):
+        while True:
+            try:
+                event, worker_idx, data = self.event_queue.get(timeout=1.0)
+            except queue.Empty:
+                # Solo con la cola de eventos vacía: un worker que terminó bien ya entregó su 'job_finished'
+                self._check_workers()
+                continue
+            except (EOFError, OSError):
+                return
+            now = time.monotonic()
+            with self._stats_lock:
+                if event == "worker_ready":
+                    self.workers_ready += 1
+                elif event == "worker_failed":
+                    print(f"[WORKER_POOL] Worker {worker_idx} no pudo iniciar: {data}")
+                elif event == "job_started":
+                    self.in_flight[worker_idx] = data
+                    self._in_flight_started[worker_idx] = now
+                elif event == "job_finished":
+                    self.in_flight.pop(worker_idx, None)
+                    self._in_flight_started.pop(worker_idx, None)
+                    if data.get("success"): self.jobs_completed += 1
+                    else: self.jobs_failed += 1
+                    self.completion_times.append(now)
+                    self._trim_completion_window(now)
+            if self.metrics and event == "job_started": self.metrics.job_started()
+            if event == "job_finished":
+                if self.metrics: self.metrics.job_finished(data)
+                print(f"[WORKER_POOL] Worker {worker_idx} terminó '{data['job_name']}' en {data['wall_seconds']:.1f}s "
+                      f"({data['frames']} frames). Throughput: {self.get_stats()['jobs_per_minute_last_window']:.1f} jobs/min")
+
+    def _trim_completion_window(self, now):
+        while self.completion_times and now - self.completion_times[0] > self.throughput_window_seconds:
+            self.completion_times.popleft()
+
+    def get_stats(self):
+        """
+        Estadísticas agregadas del pool.
+
+        Returns:
+            dict: Procesos, trabajos (enviados, completados, fallidos, en curso) y jobs por minuto
+                  (ventana reciente y desde el arranque).
+        """
+        now = time.monotonic()
+        with self._stats_lock:
+            self._trim_completion_window(now)
+            elapsed_minutes = (now - self.started_at) / 60.0 if self.started_at else 0.0
+            finished = self.jobs_completed + self.jobs_failed
+            window_minutes = min(self.throughput_window_seconds / 60.0, elapsed_minutes) if elapsed_minutes > 0 else 0.0
+            return {
+                "num_processes": self.num_processes,
+                "workers_ready": self.workers_ready,
+                "workers_alive": sum(1 for p in self.processes if p.is_alive()),
+                "workers_dead": sorted(self.dead_workers),
+                "torch_threads_per_worker": self.torch_threads,
+                "cpu_assignments": self.cpu_assignments,
+                "jobs_submitted": self.jobs_submitted,
+                "jobs_completed": self.jobs_completed,
+                "jobs_failed": self.jobs_failed,
+                "jobs_in_flight": dict(self.in_flight),
+                "jobs_per_minute_last_window": round(len(self.completion_times) / window_minutes, 2) if window_minutes > 0 else 0.0,
+                "jobs_per_minute_overall": round(finished / elapsed_minutes, 2) if elapsed_minutes > 0 else 0.0,
+            }